@@ -8,10 +8,14 @@ Released under the GNU GPL version 3 or later
 '''
 
 import sys, os, struct, math, time, socket
-import fnmatch, errno, threading
-import serial, Queue, select
+
+# start timing as early as possible, see --startup-bench
+from MAVProxy.modules.lib import mp_startup
+startup = mp_startup.StartupTimer('--startup-bench' in sys.argv)
+
+import fnmatch, errno, threading, functools, heapq
+import serial, Queue
 import traceback
-import select
 
 # allow running without installing
 #sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
@@ -22,7 +26,23 @@ from MAVProxy.modules.lib import mp_settings
 from MAVProxy.modules.lib import rline
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import dumpstacks
+from MAVProxy.modules.lib import mp_reactor
+from MAVProxy.modules.lib import mp_scheduler
+from MAVProxy.modules.lib import mp_frame
+from MAVProxy.modules.lib import mp_outqueue
+from MAVProxy.modules.lib import mp_recvbuf
+from MAVProxy.modules.lib import mp_linkworker
+from MAVProxy.modules.lib import mp_dedup
+from MAVProxy.modules.lib import mp_route
+from MAVProxy.modules.lib import mp_outfilter
+from MAVProxy.modules.lib import mp_stats
+from MAVProxy.modules.lib import mp_profile
+from MAVProxy.modules.lib import mp_linkstats
+from MAVProxy.modules.lib import mp_logwriter
+from MAVProxy.modules.lib import mp_replay
+from MAVProxy.modules.lib import mp_worker
 from pymavlink import mavutil, mavwp, mavparm
+startup.phase('imports')
 
 class MPStatus(object):
     '''hold status information about the mavproxy'''
@@ -71,10 +91,14 @@ class MPStatus(object):
             f.write('\n')
             f.write('MAV Errors: %u\n' % self.mav_error)
             f.write(str(self.gps)+'\n')
-        for m in sorted(self.msgs.keys()):
+        for m in sorted(self.msg_count.keys()):
             if pattern is not None and not fnmatch.fnmatch(str(m).upper(), pattern.upper()):
                 continue
-            f.write("%u: %s\n" % (self.msg_count[m], str(self.msgs[m])))
+            if m in self.msgs:
+                f.write("%u: %s\n" % (self.msg_count[m], str(self.msgs[m])))
+            else:
+                # forwarded by fastfwd without being decoded
+                f.write("%u: %s (not decoded)\n" % (self.msg_count[m], m))
 
     def write(self):
         '''write status to status.txt'''
@@ -125,12 +149,33 @@ class MPState(object):
               ('basealt', int, 0),
               ('wpalt', int, 100),
               ('flushlogs', int, 0),
-              ('requireexit', int, 0)]
+              ('logbuf', int, 1024),
+              ('logcommit', float, 0.2),
+              ('logcommitkb', int, 64),
+              ('logfsync', float, 0),
+              ('logcompress', int, 0),
+              ('logrotatemb', int, 0),
+              ('logrotatemin', int, 0),
+              ('rawlog', str, 'on'),
+              ('rawlogmb', int, 4),
+              ('rawlogerrors', int, 20),
+              ('requireexit', int, 0),
+              ('idlerate', int, 50),
+              ('fastfwd', int, 0),
+              ('outqueue', int, 8192),
+              ('outdrop', str, 'oldest'),
+              ('xferwindow', int, 4),
+              ('xfertimeout', float, 1.0),
+              ('paramcache', int, 1),
+              ('paramsample', int, 16)]
             )
 
         self.completions = {
             "script" : ["(FILENAME)"],
-            "set"    : ["(SETTING)"]
+            "set"    : ["(SETTING)"],
+            "route"  : ["<list|add|remove|clear>"],
+            "output" : ["<list|add|remove|rate|drop|allow|only|clear>"],
+            "profile": ["<start|stop|status> <sample|cprofile> <all>", "dump (FILENAME)"]
             }
 
         self.status = MPStatus()
@@ -147,17 +192,53 @@ class MPState(object):
         self.mav_param = mavparm.MAVParmDict()
         self.modules = []
         self.public_modules = {}
+        # message type -> list of modules interested in that type
+        self.module_dispatch = {}
+        # modules to load on first use: name -> (commands, message types, unknown)
+        self.lazy_modules = {}
+        # message type -> names of lazy modules to load when it arrives
+        self.lazy_messages = {}
+        self.dedup = mp_dedup.Deduplicator()
+        self.routes = mp_route.RouteTable()
+        self.target_fields = mp_route.TargetFields(mavutil.mavlink)
+        self.profiler = None
+        self.replay = None
+        self.replay_link = None
+        self.replay_timer = None
+        self.logwriter = None
+        self.logqueue_raw = None
+        # raw link capture to a file, or to an in memory ring
+        self.rawlog_file = None
+        self.rawlog_ring = None
+        self.rawlog_errors = 0
         self.functions = MAVFunctions()
-        self.select_extra = {}
+        self.reactor = mp_reactor.Reactor()
+        self.scheduler = mp_scheduler.Scheduler(on_error=scheduler_error)
+        # modules can add their own file descriptors to the main loop
+        self.select_extra = mp_reactor.SelectExtra(self.reactor, on_error=self.select_error)
+        # shared pool for blocking work, with results delivered to the main loop
+        self.workers = mp_worker.WorkerPool(4, wakeup=self.reactor.wakeup, on_error=worker_error)
+        # parameter sets waiting for the vehicle to acknowledge them
+        self.param_sets = {}
+        # characters waiting to be sent to the master in setup mode
+        self.setup_output = ''
+        self.setup_timer = None
         self.continue_mode = False
         self.aliases = {}
 
     def module(self, name):
         '''Find a public module (most modules are private)'''
+        if not name in self.public_modules and name in self.lazy_modules:
+            load_module(name, quiet=True)
         if name in self.public_modules:
             return self.public_modules[name]
         return None
     
+    def select_error(self, msg):
+        '''report an exception from a module file descriptor handler'''
+        if self.settings.moddebug == 1:
+            print(msg)
+
     def master(self):
         '''return the currently chosen mavlink master object'''
         if self.settings.link > len(self.mav_master):
@@ -180,10 +261,59 @@ def get_mav_param(param, default=None):
     '''return a EEPROM parameter value'''
     return mpstate.mav_param.get(param, default)
 
+class PendingParamSet(object):
+    '''a parameter set waiting to be acknowledged'''
+    def __init__(self, name, value, retries, future):
+        self.name = name
+        self.value = value
+        self.retries = retries
+        self.future = future
+        self.timer = None
+
 def param_set(name, value, retries=3):
-    '''set a parameter'''
+    '''set a parameter. This returns a future that completes with True
+    once the vehicle has acknowledged the new value, or with False if
+    all the retries time out. The acknowledgement arrives through the
+    main loop, so telemetry keeps flowing while waiting'''
+    if not mpstate.workers.on_main_thread():
+        return mpstate.workers.run_on_main(param_set, name, value, retries)
     name = name.upper()
-    return mpstate.mav_param.mavset(mpstate.master(), name, value, retries=retries)
+    future = mp_worker.Future(mpstate.workers, 'param set %s' % name)
+    old = mpstate.param_sets.pop(name, None)
+    if old is not None:
+        # superseded by the new value
+        mpstate.scheduler.cancel(old.timer)
+        old.future.set_result(False)
+    p = PendingParamSet(name, float(value), retries, future)
+    mpstate.param_sets[name] = p
+    param_set_send(p)
+    return future
+
+def param_set_send(p):
+    '''send a parameter set, and wait a second for the acknowledgement'''
+    p.retries -= 1
+    mpstate.master().param_set_send(p.name, p.value)
+    p.timer = mpstate.scheduler.add_oneshot('param_set', 1.0, functools.partial(param_set_timeout, p))
+
+def param_set_timeout(p):
+    '''retry a parameter set that hasn't been acknowledged'''
+    if mpstate.param_sets.get(p.name, None) is not p:
+        return
+    if p.retries > 0:
+        param_set_send(p)
+        return
+    mpstate.param_sets.pop(p.name)
+    print("timeout setting %s to %f" % (p.name, p.value))
+    p.future.set_result(False)
+
+def param_ack(m):
+    '''complete a parameter set on a PARAM_VALUE from the vehicle'''
+    p = mpstate.param_sets.pop(str(m.param_id).upper(), None)
+    if p is None:
+        return
+    mpstate.scheduler.cancel(p.timer)
+    mpstate.mav_param[p.name] = p.value
+    p.future.set_result(True)
 
 def cmd_reboot(args):
     '''reboot autopilot'''
@@ -200,11 +330,24 @@ def cmd_script(args):
 def cmd_set(args):
     '''control mavproxy options'''
     mpstate.settings.command(args)
+    # apply any stream rate change straight away
+    set_stream_rates()
+    apply_log_settings()
+    if len(args) > 1 and args[0] in ['rawlog', 'rawlogmb']:
+        apply_rawlog_setting()
 
 def cmd_status(args):
     '''show status'''
     if len(args) == 0:
         mpstate.status.show(sys.stdout, pattern=None)
+        for i in range(len(mpstate.mav_outputs)):
+            r = mpstate.mav_outputs[i]
+            if getattr(r, 'outqueue', None) is not None:
+                print("Output %u %s: %s" % (i+1, r.address, r.outqueue.stats()))
+        if mpstate.logqueue:
+            print(mpstate.logqueue.stats())
+        if mpstate.logqueue_raw:
+            print(mpstate.logqueue_raw.stats())
     else:
         for pattern in args:
             mpstate.status.show(sys.stdout, pattern=pattern)
@@ -246,6 +389,9 @@ def cmd_reset(args):
     mpstate.master().reset()
 
 def cmd_link(args):
+    if len(args) > 0 and args[0] == 'stats':
+        link_stats(args[1:])
+        return
     for master in mpstate.mav_master:
         linkdelay = (mpstate.status.highest_msec - master.highest_msec)*1.0e-3
         if master.linkerror:
@@ -256,6 +402,316 @@ def cmd_link(args):
                                                                                   linkdelay,
                                                                                   master.mav_loss,
                                                                                   master.packet_loss()))
+        if getattr(master, 'duplicates', 0):
+            print("link %u %u duplicate packets ignored" % (master.linknum+1, master.duplicates))
+        if getattr(master, 'link_worker', None) is not None:
+            print("link %u %s" % (master.linknum+1, master.link_worker.stats()))
+
+def link_stats(args):
+    '''show message rates and bandwidth for each master link'''
+    count = 10
+    if len(args) > 0:
+        count = int(args[0])
+    for master in mpstate.mav_master:
+        stats = master.linkstats
+        (pkt_rate, byte_rate) = stats.rates()
+        print("link %u: %.1f pkt/s %.1f bytes/s, %u lost, %u duplicates" % (master.linknum+1,
+                                                                             pkt_rate, byte_rate,
+                                                                             master.mav_loss,
+                                                                             getattr(master, 'duplicates', 0)))
+        for (sysid, prate, brate) in stats.source_rates():
+            print("  sysid %-3u %8.1f pkt/s %9.1f bytes/s" % (sysid, prate, brate))
+        for (msgid, prate, brate) in stats.message_rates()[:count]:
+            name = get_framer(master).table.names.get(msgid, str(msgid))
+            print("  %-24.24s %8.1f pkt/s %9.1f bytes/s" % (name, prate, brate))
+
+def add_master(m):
+    '''set up a new master link'''
+    m.mav.set_callback(master_callback, m)
+    if hasattr(m.mav, 'set_send_callback'):
+        m.mav.set_send_callback(master_send_callback, m)
+    m.linknum = len(mpstate.mav_master)
+    m.linkerror = False
+    m.link_delayed = False
+    m.last_heartbeat = 0
+    m.last_message = 0
+    m.highest_msec = 0
+    m.linkstats = mp_linkstats.LinkStats()
+    mpstate.mav_master.append(m)
+    mpstate.status.counters['MasterIn'].append(0)
+
+def link_name(link):
+    '''return a name for a master or output link'''
+    if link in mpstate.mav_master:
+        return "master %u" % (mpstate.mav_master.index(link)+1)
+    if link in mpstate.mav_outputs:
+        return "out %u" % (mpstate.mav_outputs.index(link)+1)
+    return str(link)
+
+def cmd_route(args):
+    '''show and set routes'''
+    usage = "usage: route <list|add|remove|clear> (SYSID[:COMPID]) (master|out) (N)"
+    if len(args) == 0 or args[0] == 'list':
+        print("%-6s %-6s %-10s %s" % ('SysID', 'CompID', 'Link', 'Age'))
+        for (sysid, compid, link, age, static) in mpstate.routes.routes():
+            if static:
+                age = 'static'
+            else:
+                age = '%.1fs' % age
+            print("%-6u %-6u %-10s %s" % (sysid, compid, link_name(link), age))
+        return
+    if args[0] == 'clear':
+        mpstate.routes.clear()
+        return
+    if not args[0] in ['add', 'remove'] or len(args) < 2:
+        print(usage)
+        return
+    try:
+        a = args[1].split(':')
+        sysid = int(a[0])
+        compid = 0
+        if len(a) > 1:
+            compid = int(a[1])
+    except ValueError:
+        print(usage)
+        return
+    if args[0] == 'remove':
+        if not mpstate.routes.remove_static(sysid, compid):
+            print("No static route for %s" % args[1])
+        return
+    if len(args) != 4 or not args[2] in ['master', 'out']:
+        print(usage)
+        return
+    if args[2] == 'master':
+        links = mpstate.mav_master
+    else:
+        links = mpstate.mav_outputs
+    try:
+        n = int(args[3])
+    except ValueError:
+        print(usage)
+        return
+    if n < 1 or n > len(links):
+        print("No %s link %u" % (args[2], n))
+        return
+    mpstate.routes.add_static(sysid, compid, links[n-1])
+
+def add_output(device):
+    '''add an output link'''
+    if ',' in device and not os.path.exists(device):
+        port, baud = device.split(',')
+    else:
+        port, baud = device, opts.baudrate
+    mpstate.mav_outputs.append(mavutil.mavlink_connection(port, baud=int(baud), input=False))
+
+def remove_output(r):
+    '''remove an output link'''
+    if getattr(r, 'reactor_fd', None) is not None:
+        mpstate.reactor.remove_reader(r.reactor_fd)
+    q = getattr(r, 'outqueue', None)
+    if q is not None and q.writer_fd is not None:
+        mpstate.reactor.remove_writer(q.writer_fd)
+    mpstate.mav_outputs.remove(r)
+    mpstate.routes.remove_link(r)
+    r.close()
+
+def cmd_output(args):
+    '''manage outputs and their filters'''
+    usage = '''usage: output list
+       output add DEVICE
+       output remove N
+       output rate N MSGTYPE HZ
+       output drop N MSGTYPE
+       output allow N MSGTYPE
+       output only N MSGTYPE...
+       output clear N'''
+    if len(args) == 0 or args[0] == 'list':
+        for i in range(len(mpstate.mav_outputs)):
+            r = mpstate.mav_outputs[i]
+            print("%u: %s" % (i+1, r.address))
+            q = getattr(r, 'outqueue', None)
+            if q is not None:
+                print("   %s" % q.stats())
+            f = getattr(r, 'outfilter', None)
+            if f is not None:
+                print("   filter passed %u dropped %u: %s" % (f.passed, f.dropped, ', '.join(f.describe())))
+        return
+    if args[0] == 'add' and len(args) == 2:
+        add_output(args[1])
+        return
+    if len(args) < 2 or not args[0] in ['remove', 'rate', 'drop', 'allow', 'only', 'clear']:
+        print(usage)
+        return
+    try:
+        r = mpstate.mav_outputs[int(args[1])-1]
+        if int(args[1]) < 1:
+            raise IndexError()
+    except (ValueError, IndexError):
+        print("No output %s" % args[1])
+        return
+    if args[0] == 'remove':
+        remove_output(r)
+        return
+    if args[0] == 'clear':
+        r.outfilter = None
+        return
+    if len(args) < 3 or (args[0] == 'rate' and len(args) != 4):
+        print(usage)
+        return
+    names = get_framer(r).table.ids.keys()
+    if args[0] == 'only':
+        patterns = args[2:]
+    else:
+        patterns = args[2:3]
+    mtypes = []
+    for pattern in patterns:
+        matches = mp_outfilter.match_types(pattern, names)
+        if len(matches) == 0:
+            print("No message types match %s" % pattern)
+        mtypes.extend(matches)
+    if len(mtypes) == 0:
+        # an empty only list would silently cut the output off
+        return
+    if getattr(r, 'outfilter', None) is None:
+        r.outfilter = mp_outfilter.OutputFilter()
+    f = r.outfilter
+    if args[0] == 'only':
+        f.only(mtypes)
+        return
+    for mtype in mtypes:
+        if args[0] == 'rate':
+            try:
+                rate = float(args[3])
+            except ValueError:
+                print(usage)
+                return
+            if rate <= 0:
+                f.drop(mtype)
+            else:
+                f.set_rate(mtype, rate)
+        elif args[0] == 'drop':
+            f.drop(mtype)
+        else:
+            f.allow(mtype)
+
+def cmd_profile(args):
+    '''profile the main loop'''
+    usage = "usage: profile <start|stop|status|dump> (sample|cprofile) (all) (FILENAME)"
+    if len(args) == 0:
+        print(usage)
+        return
+    profiler = mpstate.profiler
+    if args[0] == 'start':
+        if profiler is not None and profiler.running:
+            print("Profiler already running")
+            return
+        if 'cprofile' in args[1:]:
+            # commands run in the main loop thread, so that is what
+            # cProfile will see
+            mpstate.profiler = mp_profile.DeterministicProfiler()
+        else:
+            threads = [threading.current_thread()]
+            if 'all' in args[1:]:
+                threads = threading.enumerate()
+            mpstate.profiler = mp_profile.SamplingProfiler(threads)
+        mpstate.profiler.start()
+        return
+    if profiler is None:
+        print("Profiler not started")
+        return
+    if args[0] == 'stop':
+        if profiler.running:
+            profiler.stop()
+        profiler.summary(sys.stdout)
+    elif args[0] == 'status':
+        if profiler.running:
+            print("Profiler running")
+        else:
+            print("Profiler stopped")
+    elif args[0] == 'dump' and len(args) == 2:
+        if isinstance(profiler, mp_profile.DeterministicProfiler) and profiler.running:
+            print("Stop the profiler before saving cProfile results")
+            return
+        profiler.dump(args[1])
+        print("Saved profile to %s" % args[1])
+    else:
+        print(usage)
+
+def cmd_replay(args):
+    '''control log replay'''
+    usage = "usage: replay <status|pause|resume|speed|seek> (SPEED|SECONDS|+SECONDS|-SECONDS)"
+    replay = mpstate.replay
+    if replay is None:
+        print("Not replaying a log")
+        return
+    if len(args) == 0 or args[0] == 'status':
+        print(replay.status())
+    elif args[0] == 'pause':
+        replay.pause()
+    elif args[0] == 'resume':
+        replay.resume()
+    elif args[0] == 'speed' and len(args) == 2:
+        replay.set_speed(float(args[1]))
+    elif args[0] == 'seek' and len(args) == 2:
+        t = float(args[1])
+        if args[1][0] in '+-':
+            t += replay.position()
+        replay.seek(max(t, 0))
+    else:
+        print(usage)
+        return
+    # the timing of the next packet may have changed
+    if mpstate.replay_timer is not None:
+        mpstate.scheduler.cancel(mpstate.replay_timer)
+    mpstate.replay_timer = mpstate.scheduler.add_oneshot('replay', 0, replay_task)
+
+def replay_task():
+    '''feed packets that are due from the log being replayed'''
+    replay = mpstate.replay
+    m = mpstate.replay_link
+    mpstate.replay_timer = None
+    for (t, frame) in replay.due(time.time()):
+        m._timestamp = t
+        process_master_data(m, frame)
+    if replay.finished():
+        elapsed = time.time() - replay.wall_start
+        print("Replay finished: %u packets in %.1fs (%.0f packets/s)" % (replay.records, elapsed,
+                                                                         replay.records / max(elapsed, 0.001)))
+        return
+    delay = replay.delay(time.time())
+    if delay is not None:
+        mpstate.replay_timer = mpstate.scheduler.add_oneshot('replay', delay, replay_task)
+
+def cmd_rawlog(args):
+    '''raw link capture control'''
+    usage = "usage: rawlog <status|dump> (FILENAME)"
+    if len(args) == 0 or args[0] == 'status':
+        print("rawlog mode %s" % mpstate.settings.rawlog)
+        if mpstate.logqueue_raw:
+            print(mpstate.logqueue_raw.stats())
+    elif args[0] == 'dump':
+        if mpstate.rawlog_ring is None or mpstate.logqueue_raw is not mpstate.rawlog_ring:
+            print("rawlog dump needs 'set rawlog ring'")
+            return
+        filename = None
+        if len(args) > 1:
+            filename = args[1]
+        dump_rawlog(filename, "on demand")
+    else:
+        print(usage)
+
+def cmd_workers(args):
+    '''show background worker status'''
+    mpstate.workers.show(sys.stdout)
+    if mpstate.param_sets:
+        print("waiting for parameters: %s" % ' '.join(sorted(mpstate.param_sets.keys())))
+
+def cmd_timers(args):
+    '''show scheduler statistics'''
+    if len(args) > 0 and args[0] == 'reset':
+        mpstate.scheduler.reset_stats()
+        return
+    mpstate.scheduler.show(sys.stdout)
 
 def cmd_watch(args):
     '''watch a mavlink packet pattern'''
@@ -273,6 +729,7 @@ def load_module(modname, quiet=False):
             if not quiet:
                 print("module %s already loaded" % modname)
             return False
+    forget_lazy_module(modname)
     for modpath in modpaths:
         try:
             m = import_package(modpath)
@@ -280,6 +737,8 @@ def load_module(modname, quiet=False):
             module = m.init(mpstate)
             if isinstance(module, mp_module.MPModule):
                 mpstate.modules.append((module, m))
+                mpstate.module_dispatch.clear()
+                schedule_module(module)
                 if not quiet:
                     print("Loaded module %s" % (modname,))
                 return True
@@ -294,13 +753,106 @@ def load_module(modname, quiet=False):
     print("Failed to load module: %s" % ex)
     return False
 
+# standard modules, with the commands and message types that load them
+# on first use. Modules with None for their commands are loaded at
+# startup even when loading is lazy
+standard_modules = [
+    ('log',          ['log'], ['LOG_ENTRY', 'LOG_DATA']),
+    ('rally',        ['rally'], []),
+    ('fence',        ['fence'], ['FENCE_STATUS', 'SYS_STATUS']),
+    # fetches the parameters at startup
+    ('param',        None, None),
+    ('relay',        ['relay', 'servo'], []),
+    ('tuneopt',      ['tuneopt'], []),
+    ('arm',          ['arm', 'disarm'], []),
+    # also handles flight mode names as commands
+    ('mode',         ['mode', 'guided'], []),
+    ('calibration',  ['ground', 'level', 'compassmot', 'calpress', 'accelcal'], []),
+    ('rc',           ['rc', 'switch'], []),
+    ('wp',           ['wp'], ['MISSION_COUNT', 'WAYPOINT_COUNT', 'MISSION_ITEM', 'WAYPOINT',
+                              'MISSION_REQUEST', 'WAYPOINT_REQUEST',
+                              'MISSION_CURRENT', 'WAYPOINT_CURRENT']),
+    ('auxopt',       ['auxopt'], []),
+    ('quadcontrols', ['movez', 'strafe', 'movey', 'yaw', 'hover', 'bend', 'setalt', 'startalt'], []),
+    ]
+
+# modules that handle commands they haven't registered
+unknown_command_modules = ['mode']
+
+def register_lazy_module(modname, commands, mtypes):
+    '''arrange for a module to be loaded when one of its commands is
+    used or one of its message types arrives'''
+    unknown = modname in unknown_command_modules
+    mpstate.lazy_modules[modname] = (commands, mtypes, unknown)
+    for cmd in commands:
+        if not cmd in command_map:
+            command_map[cmd] = (functools.partial(lazy_command, modname, cmd),
+                                '(loads the %s module)' % modname)
+        if not cmd in mpstate.completions:
+            mpstate.completions[cmd] = functools.partial(lazy_completions, modname, cmd)
+    for mtype in mtypes:
+        mpstate.lazy_messages.setdefault(mtype, []).append(modname)
+    mpstate.module_dispatch.clear()
+
+def forget_lazy_module(modname):
+    '''remove a module from the lazy loading tables, as it is being loaded'''
+    if not modname in mpstate.lazy_modules:
+        return
+    (commands, mtypes, unknown) = mpstate.lazy_modules.pop(modname)
+    for cmd in commands:
+        if callable(mpstate.completions.get(cmd, None)):
+            # the module registers its own completions, if it has any
+            mpstate.completions.pop(cmd)
+    for mtype in mtypes:
+        names = mpstate.lazy_messages.get(mtype, [])
+        if modname in names:
+            names.remove(modname)
+        if len(names) == 0:
+            mpstate.lazy_messages.pop(mtype, None)
+
+def lazy_command(modname, cmd, args):
+    '''load a module on first use of one of its commands, then run the command'''
+    stub = command_map.get(cmd, None)
+    load_module(modname, quiet=True)
+    if command_map.get(cmd, None) is stub:
+        # the module failed to load or doesn't provide the command
+        command_map.pop(cmd, None)
+        print("Unknown command '%s'" % cmd)
+        return
+    process_stdin(' '.join([cmd] + args))
+
+def lazy_completions(modname, cmd):
+    '''load a module when one of its commands is first completed, and
+    return the completion rules it registers. This is called from the
+    input thread, so the module is loaded by the main loop'''
+    try:
+        mpstate.workers.run_on_main(load_module, modname, quiet=True).result(2)
+    except Exception:
+        return []
+    rules = mpstate.completions.get(cmd, [])
+    if callable(rules):
+        return []
+    return rules
+
+def load_lazy_modules(mtype=None, unknown=False):
+    '''load the lazy modules for a message type, or those that handle
+    unknown commands'''
+    if mtype is not None:
+        names = mpstate.lazy_messages.get(mtype, [])[:]
+    else:
+        names = [name for (name, (c, m, u)) in mpstate.lazy_modules.items() if u and unknown]
+    for name in names:
+        load_module(name, quiet=True)
+
 def unload_module(modname):
     '''unload a module'''
     for (m,pm) in mpstate.modules:
         if m.name == modname:
             if hasattr(m, 'unload'):
                 m.unload()
+            unschedule_module(m)
             mpstate.modules.remove((m,pm))
+            mpstate.module_dispatch.clear()
             print("Unloaded module %s" % modname)
             return True
     print("Unable to find module %s" % modname)
@@ -308,13 +860,15 @@ def unload_module(modname):
 
 def cmd_module(args):
     '''module commands'''
-    usage = "usage: module <list|load|reload|unload>"
+    usage = "usage: module <list|load|reload|unload|stats>"
     if len(args) < 1:
         print(usage)
         return
     if args[0] == "list":
         for (m,pm) in mpstate.modules:
             print("%s: %s" % (m.name, m.description))
+        for name in sorted(mpstate.lazy_modules.keys()):
+            print("%s: (loaded on first use)" % name)
     elif args[0] == "load":
         if len(args) < 2:
             print("usage: module load <name>")
@@ -342,6 +896,16 @@ def cmd_module(args):
             return
         modname = os.path.basename(args[1])
         unload_module(modname)
+    elif args[0] == "stats":
+        if len(args) > 1 and args[1] == 'reset':
+            for (m,pm) in mpstate.modules:
+                if len(args) < 3 or m.name in args[2:]:
+                    module_stats(m).reset()
+            return
+        mp_stats.show_header(sys.stdout)
+        for (m,pm) in mpstate.modules:
+            if len(args) < 2 or m.name in args[1:]:
+                module_stats(m).show(m.name, sys.stdout)
     else:
         print(usage)
 
@@ -406,15 +970,38 @@ command_map = {
     'set'     : (cmd_set,      'mavproxy settings'),
     'bat'     : (cmd_bat,      'show battery levels'),
     'alt'     : (cmd_alt,      'show relative altitude'),
-    'link'    : (cmd_link,     'show link status'),
+    'link'    : (cmd_link,     'show link status, or link stats'),
     'reboot'  : (cmd_reboot,   'reboot the autopilot'),
     'up'      : (cmd_up,       'adjust TRIM_PITCH_CD up by 5 degrees'),
     'watch'   : (cmd_watch,    'watch a MAVLink pattern'),
     'module'  : (cmd_module,   'module commands'),
     'alias'   : (cmd_alias,    'command aliases'),
     'time'    : (cmd_time,     'Show autopilot time'),
+    'timers'  : (cmd_timers,   'show timer statistics'),
+    'workers' : (cmd_workers,  'show background job status'),
+    'route'   : (cmd_route,    'show and set routes to systems'),
+    'output'  : (cmd_output,   'manage outputs and their message filters'),
+    'profile' : (cmd_profile,  'profile the running proxy'),
+    'replay'  : (cmd_replay,   'control log replay'),
+    'rawlog'  : (cmd_rawlog,   'raw link capture control'),
     }
 
+def command_done(cmd, future):
+    '''report a failure of a command that completed in the background'''
+    if future.cancelled():
+        print("%s: cancelled" % cmd)
+    elif future.exception() is not None:
+        print("ERROR in command %s: %s" % (cmd, str(future.exception())))
+
+def setup_output_task():
+    '''send the next character in setup mode'''
+    if mpstate.setup_output:
+        mpstate.master().write(mpstate.setup_output[0])
+        mpstate.setup_output = mpstate.setup_output[1:]
+    if not mpstate.setup_output:
+        mpstate.scheduler.cancel(mpstate.setup_timer)
+        mpstate.setup_timer = None
+
 def process_stdin(line):
     '''handle commands from user'''
     if line is None:
@@ -430,9 +1017,11 @@ def process_stdin(line):
             return
         if line != '+++':
             line += '\r'
-        for c in line:
-            time.sleep(0.01)
-            mpstate.master().write(c)
+        # the characters are paced out by a timer, so the main loop
+        # isn't held up
+        mpstate.setup_output += line
+        if mpstate.setup_timer is None:
+            mpstate.setup_timer = mpstate.scheduler.add_periodic('setup', 0.01, setup_output_task)
         return
 
     if not line:
@@ -459,22 +1048,40 @@ def process_stdin(line):
         return
 
     if not cmd in command_map:
+        load_lazy_modules(unknown=True)
         for (m,pm) in mpstate.modules:
             if hasattr(m, 'unknown_command'):
+                t1 = time.time()
                 try:
-                    if m.unknown_command(args):
-                        return
+                    handled = m.unknown_command(args)
                 except Exception as e:
+                    handled = False
+                    module_stats(m).errors += 1
                     print("ERROR in command: %s" % str(e))
+                module_stats(m).command.add(time.time() - t1)
+                if handled:
+                    return
         print("Unknown command '%s'" % line)
         return
     (fn, help) = command_map[cmd]
+    # commands added by modules are bound methods of the module
+    module = getattr(fn, 'im_self', None)
+    if not isinstance(module, mp_module.MPModule):
+        module = None
+    t1 = time.time()
     try:
-        fn(args[1:])
+        ret = fn(args[1:])
+        if isinstance(ret, mp_worker.Future):
+            # the command continues in the background
+            ret.add_done_callback(functools.partial(command_done, cmd))
     except Exception as e:
+        if module is not None:
+            module_stats(module).errors += 1
         print("ERROR in command: %s" % str(e))
         if mpstate.settings.moddebug > 1:
             traceback.print_exc()
+    if module is not None:
+        module_stats(module).command.add(time.time() - t1)
 
 
 def vcell_to_battery_percent(vcell):
@@ -590,6 +1197,174 @@ def report_altitude(altitude):
         say("height %u" % rounded_alt, priority='notification')
 
 
+def module_stats(module):
+    '''return the call statistics of a module, adding them to a module
+    that didn't call MPModule.__init__()'''
+    stats = getattr(module, 'stats', None)
+    if not isinstance(stats, mp_stats.ModuleStats):
+        stats = mp_stats.ModuleStats()
+        module.stats = stats
+    return stats
+
+def dispatch_list(mtype):
+    '''return the list of modules that want messages of type mtype'''
+    mods = mpstate.module_dispatch.get(mtype, None)
+    if mods is not None:
+        return mods
+    if mtype in mpstate.lazy_messages:
+        load_lazy_modules(mtype)
+    mods = []
+    for (mod,pm) in mpstate.modules:
+        # skip modules that don't override the default (empty) handler
+        if mod.__class__.mavlink_packet.im_func is mp_module.MPModule.mavlink_packet.im_func:
+            continue
+        if mod.wants_message(mtype):
+            mods.append(mod)
+    mpstate.module_dispatch[mtype] = mods
+    return mods
+
+# message types that master_callback() acts on itself
+core_message_types = frozenset([ 'HEARTBEAT', 'GPS_RAW_INT', 'GPS_RAW', 'GLOBAL_POSITION_INT',
+                                 'SYS_STATUS', 'STATUSTEXT', 'VFR_HUD', 'NAV_CONTROLLER_OUTPUT',
+                                 'COMPASSMOT_STATUS', 'COMMAND_ACK', 'MISSION_ACK',
+                                 'MISSION_CURRENT', 'SCALED_PRESSURE', 'PARAM_VALUE' ])
+
+def needs_decode(mtype):
+    '''return True if a message type needs to be decoded, rather than
+    just forwarded'''
+    return (mtype in core_message_types or
+            len(dispatch_list(mtype)) != 0 or
+            mpstate.status.watch is not None)
+
+def get_framer(link):
+    '''return the byte level framer for a link'''
+    framer = getattr(link, 'framer', None)
+    if framer is None:
+        framer = mp_frame.Framer(mp_frame.message_table(mavutil.mavlink))
+        link.framer = framer
+    return framer
+
+def log_master_packet(buf, master):
+    '''log a packet from the master'''
+    # put link number in bottom 2 bits, so we can analyse packet
+    # delay in saved logs
+    usec = get_usec()
+    usec = (usec & ~3) | master.linknum
+    mpstate.logqueue.put(buf, usec)
+
+def get_outqueue(output):
+    '''return the outbound queue for an output link'''
+    q = getattr(output, 'outqueue', None)
+    if q is None:
+        q = mp_outqueue.OutputQueue(output, mpstate.reactor,
+                                    maxbytes=mpstate.settings.outqueue,
+                                    policy=mpstate.settings.outdrop)
+        output.outqueue = q
+    return q
+
+def route_links(links, target):
+    '''return the links a packet should go to. Packets targeted at a
+    system we have a route to only go to the links on that route'''
+    if target is None or target[0] == 0:
+        return links
+    route = mpstate.routes.lookup(target[0], target[1])
+    if route is None:
+        return links
+    ret = [r for r in links if r in route]
+    if len(ret) == 0:
+        # none of these links are on the route, so send to them all as
+        # we would with no route at all
+        return links
+    return ret
+
+def message_target(m):
+    '''return (target_system, target_component) of a decoded message'''
+    return (getattr(m, 'target_system', 0), getattr(m, 'target_component', 0))
+
+def forward_packet(buf, mtype, target=None):
+    '''pass a packet from the master along to listeners'''
+    # don't forward REQUEST_DATA_STREAM, which would lead a conflict
+    # in stream rate setting between mavproxy and the other GCS
+    if mpstate.settings.mavfwd_rate or mtype != 'REQUEST_DATA_STREAM':
+        for r in route_links(mpstate.mav_outputs, target):
+            output_send(r, buf, mtype)
+
+def output_send(r, buf, mtype):
+    '''queue a packet for an output, subject to the output's filter'''
+    f = getattr(r, 'outfilter', None)
+    if f is not None and not f.check(mtype):
+        return
+    get_outqueue(r).push(buf, mtype)
+    if startup.active:
+        startup.finish('first packet forwarded')
+
+def forward_slave_packet(slave, buf, mtype, target):
+    '''send a packet from a slave to the master, or to the link that
+    can reach its target'''
+    if target is not None and target[0] != 0:
+        route = mpstate.routes.lookup(target[0], target[1])
+        if route is not None:
+            masters = [m for m in mpstate.mav_master if m in route]
+            if mpstate.master() in masters:
+                # prefer the active link when several reach the target
+                masters = [mpstate.master()]
+            for m in masters[:1]:
+                m.write(buf)
+            for r in mpstate.mav_outputs:
+                if r in route and r is not slave:
+                    output_send(r, buf, mtype)
+            return
+    mpstate.master().write(buf)
+
+def flush_outputs():
+    '''write out the packets queued for each output this loop'''
+    for r in mpstate.mav_outputs:
+        q = getattr(r, 'outqueue', None)
+        if q is None or len(q) == 0:
+            continue
+        q.maxbytes = mpstate.settings.outqueue
+        q.policy = mpstate.settings.outdrop
+        if q.writer_fd is None:
+            # otherwise we are waiting for the fd to become writable
+            q.flush()
+
+def count_master_seq(master, src_system, src_component, seq):
+    '''packet loss accounting for a frame that isn't decoded, matching
+    what mavfile.post_message() does for decoded messages'''
+    if not hasattr(master, 'last_seq'):
+        return
+    src_tuple = (src_system, src_component)
+    if src_tuple == (ord('3'), ord('D')):
+        # radio status packets have their own sequence
+        return
+    last_seq = master.last_seq.get(src_tuple, -1)
+    if last_seq != -1 and seq != (last_seq+1) % 256:
+        master.mav_loss += (seq - (last_seq+1)) % 256
+    master.last_seq[src_tuple] = seq
+    master.mav_count += 1
+
+def is_duplicate(master, src_system, src_component, seq, msgid):
+    '''return True if a packet has already been seen on another master link'''
+    if len(mpstate.mav_master) < 2:
+        return False
+    if mpstate.dedup.is_duplicate(src_system, src_component, seq, msgid):
+        master.duplicates = getattr(master, 'duplicates', 0) + 1
+        return True
+    return False
+
+def master_raw_callback(master, frame, msgid, mtype, src_system, src_component, seq):
+    '''process a frame from the master that nothing needs decoded'''
+    mpstate.status.counters['MasterIn'][master.linknum] += 1
+    master.linkstats.update(msgid, src_system, len(frame))
+    count_master_seq(master, src_system, src_component, seq)
+    mpstate.routes.learn(src_system, src_component, master, time.time())
+    if mtype != 'LOG_DATA' and mpstate.logqueue:
+        log_master_packet(frame, master)
+    if is_duplicate(master, src_system, src_component, seq, msgid):
+        return
+    mpstate.status.msg_count[mtype] = mpstate.status.msg_count.get(mtype, 0) + 1
+    forward_packet(frame, mtype, mpstate.target_fields.target(msgid, frame))
+
 def master_send_callback(m, master):
     '''called on sending a message'''
     mtype = m.get_type()
@@ -597,7 +1372,7 @@ def master_send_callback(m, master):
     if mtype != 'BAD_DATA' and mpstate.logqueue:
         usec = get_usec()
         usec = (usec & ~3) | 3 # linknum 3
-        mpstate.logqueue.put(str(struct.pack('>Q', usec) + m.get_msgbuf()))
+        mpstate.logqueue.put(m.get_msgbuf(), usec)
 
 
 def master_callback(m, master):
@@ -612,14 +1387,13 @@ def master_callback(m, master):
         handle_msec_timestamp(m, master)
 
     mtype = m.get_type()
+    if mtype != 'BAD_DATA':
+        mpstate.routes.learn(m.get_srcSystem(), m.get_srcComponent(), master, time.time())
+        master.linkstats.update(m.get_msgId(), m.get_srcSystem(), len(m.get_msgbuf()))
 
     # and log them
     if mtype not in ['BAD_DATA','LOG_DATA'] and mpstate.logqueue:
-        # put link number in bottom 2 bits, so we can analyse packet
-        # delay in saved logs
-        usec = get_usec()
-        usec = (usec & ~3) | master.linknum
-        mpstate.logqueue.put(str(struct.pack('>Q', usec) + m.get_msgbuf()))
+        log_master_packet(m.get_msgbuf(), master)
 
     if mtype in [ 'HEARTBEAT', 'GPS_RAW_INT', 'GPS_RAW', 'GLOBAL_POSITION_INT', 'SYS_STATUS' ]:
         if master.linkerror:
@@ -628,6 +1402,12 @@ def master_callback(m, master):
         mpstate.status.last_message = time.time()
         master.last_message = mpstate.status.last_message
 
+    # copies of packets already received on another link only count
+    # towards the link statistics above
+    if mtype != 'BAD_DATA' and is_duplicate(master, m.get_srcSystem(), m.get_srcComponent(),
+                                            m.get_seq(), m.get_msgId()):
+        return
+
     if master.link_delayed:
         # don't process delayed packets that cause double reporting
         if mtype in [ 'MISSION_CURRENT', 'SYS_STATUS', 'VFR_HUD',
@@ -740,6 +1520,10 @@ def master_callback(m, master):
     elif mtype == "COMPASSMOT_STATUS":
         print(m)
 
+    elif mtype == "PARAM_VALUE":
+        if mpstate.param_sets:
+            param_ack(m)
+
     elif mtype == "BAD_DATA":
         if mpstate.settings.shownoise and mavutil.all_printable(m.data):
             mpstate.console.write(str(m.data), bg='red')
@@ -761,42 +1545,44 @@ def master_callback(m, master):
 
     # don't pass along bad data
     if mtype != "BAD_DATA":
-        # pass messages along to listeners, except for REQUEST_DATA_STREAM, which
-        # would lead a conflict in stream rate setting between mavproxy and the other
-        # GCS
-        if mpstate.settings.mavfwd_rate or mtype != 'REQUEST_DATA_STREAM':
-            for r in mpstate.mav_outputs:
-                r.write(m.get_msgbuf())
+        forward_packet(m.get_msgbuf(), mtype, message_target(m))
 
         # pass to modules
-        for (mod,pm) in mpstate.modules:
-            if not hasattr(mod, 'mavlink_packet'):
-                continue
+        for mod in dispatch_list(mtype):
+            t1 = time.time()
             try:
                 mod.mavlink_packet(m)
             except Exception, msg:
-                if mpstate.settings.moddebug == 1:
-                    print(msg)
-                elif mpstate.settings.moddebug > 1:
-                    exc_type, exc_value, exc_traceback = sys.exc_info()
-                    traceback.print_exception(exc_type, exc_value, exc_traceback,
-                                              limit=2, file=sys.stdout)
+                module_stats(mod).errors += 1
+                print_module_exception(msg)
+            module_stats(mod).packet.add(time.time() - t1)
+
+def end_recv_backoff(m):
+    '''start reading from a master link again'''
+    m.recv_backoff = None
 
 def process_master(m):
     '''process packets from the MAVLink master'''
+    recvbuf = getattr(m, 'recvbuf', None)
+    if recvbuf is None:
+        recvbuf = mp_recvbuf.ReceiveBuffer(m)
+        m.recvbuf = recvbuf
     try:
-        s = m.recv(16*1024)
-    except Exception:
-        time.sleep(0.1)
+        s = recvbuf.drain()
+    except mp_recvbuf.LinkDead:
+        # prevent a dead serial port from causing the CPU to spin, by
+        # ignoring the link for a while. The user hitting enter will
+        # cause it to try and reconnect
+        if getattr(m, 'recv_backoff', None) is None:
+            m.recv_backoff = mpstate.scheduler.add_oneshot('backoff:%u' % (m.linknum+1), 0.1,
+                                                           functools.partial(end_recv_backoff, m))
         return
-    # prevent a dead serial port from causing the CPU to spin. The user hitting enter will
-    # cause it to try and reconnect
-    if len(s) == 0:
-        time.sleep(0.1)
-        return
-    
+    process_master_data(m, s)
+
+def process_master_data(m, s):
+    '''process data received from the MAVLink master'''
     if mpstate.logqueue_raw:
-        mpstate.logqueue_raw.put(str(s))
+        mpstate.logqueue_raw.put(s)
 
     if mpstate.status.setup_mode:
         sys.stdout.write(str(s))
@@ -805,6 +1591,9 @@ def process_master(m):
 
     if m.first_byte and opts.auto_protocol:
         m.auto_mavlink_version(s)
+    if mpstate.settings.fastfwd:
+        process_master_frames(m, s)
+        return
     msgs = m.mav.parse_buffer(s)
     if msgs:
         for msg in msgs:
@@ -817,12 +1606,107 @@ def process_master(m):
 
 
 
+def process_master_frame(m, msgid, frame, src_system, src_component, seq):
+    '''process one checked frame from the master, decoding it only if
+    needed'''
+    mtype = get_framer(m).table.names.get(msgid, None)
+    if not needs_decode(mtype):
+        master_raw_callback(m, frame, msgid, mtype, src_system, src_component, seq)
+        return
+    try:
+        msg = m.mav.decode(bytearray(frame))
+    except mavutil.mavlink.MAVError as e:
+        if opts.show_errors:
+            mpstate.console.writeln("MAV error: %s" % e)
+        mpstate.status.mav_error += 1
+        return
+    master_callback(msg, m)
+
+def process_master_frames(m, s):
+    '''split data from the master into frames, only decoding the
+    messages that we or a module want to look at'''
+    framer = get_framer(m)
+    errors = framer.errors
+    for (msgid, frame, src_system, src_component, seq) in framer.parse(s):
+        process_master_frame(m, msgid, frame, src_system, src_component, seq)
+    if framer.errors != errors:
+        if opts.show_errors:
+            mpstate.console.writeln("MAV error: %u bad bytes" % framer.bad_bytes)
+        mpstate.status.mav_error += framer.errors - errors
+
+def process_worker_record(m, rec):
+    '''process a record from the worker process of a master link'''
+    (kind, tstamp, data, msgid, src_system, src_component, seq) = rec
+    if kind == mp_linkworker.REC_FRAME:
+        if mpstate.logqueue_raw:
+            mpstate.logqueue_raw.put(data)
+        if m.first_byte and opts.auto_protocol:
+            m.auto_mavlink_version(data)
+        process_master_frame(m, msgid, data, src_system, src_component, seq)
+    elif kind == mp_linkworker.REC_RAW:
+        process_master_data(m, data)
+    elif kind == mp_linkworker.REC_ADDRESS:
+        (host, port) = data.rsplit(':', 1)
+        m.last_address = (host, int(port))
+    elif kind == mp_linkworker.REC_ERRORS:
+        mpstate.status.mav_error += msgid
+
+def process_link_workers(arg=None):
+    '''process records from the link worker processes. Records from
+    different links are merged in the order the workers received them'''
+    streams = []
+    for master in mpstate.mav_master:
+        worker = getattr(master, 'link_worker', None)
+        if worker is None:
+            continue
+        worker.drain_wakeup()
+        worker.set_raw(mpstate.status.setup_mode)
+        recs = worker.records()
+        if recs:
+            streams.append([(rec[1], master.linknum, i, rec) for (i, rec) in enumerate(recs)])
+    for (tstamp, linknum, i, rec) in heapq.merge(*streams):
+        process_worker_record(mpstate.mav_master[linknum], rec)
+    for master in mpstate.mav_master:
+        worker = getattr(master, 'link_worker', None)
+        if worker is not None and worker.ring.pending():
+            # we stopped at the record limit, come back for the rest
+            mpstate.reactor.wakeup()
+            break
+
+def link_worker_task():
+    '''read a link in the main process if its worker process has died,
+    rather than letting it go silent'''
+    for master in mpstate.mav_master:
+        worker = getattr(master, 'link_worker', None)
+        if worker is None or worker.alive():
+            continue
+        # pass on anything the worker queued before it died
+        process_link_workers()
+        print("link %u worker process exited with code %s, reading the link in the main process" % (
+            master.linknum+1, worker.process.exitcode))
+        mpstate.reactor.remove_reader(worker.wakeup_rfd)
+        worker.stop()
+        master.link_worker = None
+        master.link_worker_failed = True
+        if master.reactor_key[0] is not None:
+            mpstate.reactor.add_reader(master.reactor_key[0], process_master, master)
+
 def process_mavlink(slave):
     '''process packets from MAVLink slaves, forwarding to the master'''
     try:
         buf = slave.recv()
     except socket.error:
         return
+    tnow = time.time()
+    if mpstate.settings.fastfwd:
+        framer = get_framer(slave)
+        for (msgid, frame, src_system, src_component, seq) in framer.parse(buf):
+            mpstate.routes.learn(src_system, src_component, slave, tnow)
+            if mpstate.settings.mavfwd and not mpstate.status.setup_mode:
+                forward_slave_packet(slave, frame, framer.table.names.get(msgid, None),
+                                     mpstate.target_fields.target(msgid, frame))
+        mpstate.status.counters['Slave'] += 1
+        return
     try:
         if slave.first_byte and opts.auto_protocol:
             slave.auto_mavlink_version(buf)
@@ -832,9 +1716,11 @@ def process_mavlink(slave):
         return
     if msgs is None:
         return
-    if mpstate.settings.mavfwd and not mpstate.status.setup_mode:
-        for m in msgs:
-            mpstate.master().write(m.get_msgbuf())
+    for m in msgs:
+        if m.get_type() != 'BAD_DATA':
+            mpstate.routes.learn(m.get_srcSystem(), m.get_srcComponent(), slave, tnow)
+        if mpstate.settings.mavfwd and not mpstate.status.setup_mode:
+            forward_slave_packet(slave, m.get_msgbuf(), m.get_type(), message_target(m))
     mpstate.status.counters['Slave'] += 1
 
 
@@ -850,17 +1736,91 @@ def mkdir_p(dir):
     mkdir_p(os.path.dirname(dir))
     os.mkdir(dir)
 
-def log_writer():
-    '''log writing thread'''
-    while True:
-        mpstate.logfile_raw.write(mpstate.logqueue_raw.get())
-        while not mpstate.logqueue_raw.empty():
-            mpstate.logfile_raw.write(mpstate.logqueue_raw.get())
-        while not mpstate.logqueue.empty():
-            mpstate.logfile.write(mpstate.logqueue.get())
-        if mpstate.settings.flushlogs:
-            mpstate.logfile.flush()
-            mpstate.logfile_raw.flush()
+def apply_log_settings():
+    '''apply the log commit settings to the log writer'''
+    writer = mpstate.logwriter
+    if writer is None:
+        return
+    writer.commit_interval = max(mpstate.settings.logcommit, 0.01)
+    if mpstate.settings.flushlogs:
+        # commit every packet as it arrives
+        writer.commit_bytes = 1
+    else:
+        writer.commit_bytes = max(mpstate.settings.logcommitkb, 1) * 1024
+    writer.fsync_interval = mpstate.settings.logfsync
+    # compression changes apply from the next log segment
+    writer.compress = min(max(mpstate.settings.logcompress, 0), 9)
+    writer.rotate_bytes = mpstate.settings.logrotatemb * 1024 * 1024
+    writer.rotate_time = mpstate.settings.logrotatemin * 60
+
+def apply_rawlog_setting():
+    '''capture the raw link data to match the rawlog setting'''
+    if mpstate.logwriter is None:
+        return
+    mode = mpstate.settings.rawlog
+    if mode == 'on':
+        if mpstate.rawlog_file is None:
+            size = max(mpstate.settings.logbuf, 16) * 1024
+            mpstate.rawlog_file = mpstate.logwriter.add(mpstate.logfile_name+'.raw', mpstate.logfile_mode, size)
+        mpstate.logqueue_raw = mpstate.rawlog_file
+    elif mode == 'ring':
+        size = max(mpstate.settings.rawlogmb, 1) * 1024 * 1024
+        if mpstate.rawlog_ring is None or mpstate.rawlog_ring.size != size:
+            mpstate.rawlog_ring = mp_logwriter.CaptureRing(size)
+        mpstate.logqueue_raw = mpstate.rawlog_ring
+    else:
+        if mode != 'off':
+            print("rawlog should be on, off or ring")
+        mpstate.logqueue_raw = None
+
+def dump_rawlog(filename, reason):
+    '''save the raw capture ring to a file'''
+    ring = mpstate.rawlog_ring
+    if filename is None:
+        filename = "%s.raw-%s" % (mpstate.logfile_name, time.strftime("%Y%m%d-%H%M%S"))
+    data = ring.snapshot()
+    ring.dumps += 1
+    ring.last_dump = time.time()
+    def save():
+        try:
+            open(filename, mode='wb').write(data)
+        except Exception as e:
+            print("Failed to save raw capture to %s: %s" % (filename, e))
+            return
+        print("Saved %u bytes of raw capture to %s (%s)" % (len(data), filename, reason))
+    # write from a thread so a slow disk doesn't stall the links
+    t = threading.Thread(target=save, name='rawlog_dump')
+    t.daemon = True
+    t.start()
+
+def rawlog_task():
+    '''dump the raw capture ring when the parse error rate spikes'''
+    rate = mpstate.status.mav_error - mpstate.rawlog_errors
+    mpstate.rawlog_errors = mpstate.status.mav_error
+    ring = mpstate.rawlog_ring
+    if (ring is None or mpstate.logqueue_raw is not ring or
+        mpstate.settings.rawlogerrors <= 0 or rate < mpstate.settings.rawlogerrors):
+        return
+    # one dump covers the ring, so don't dump again until it has refilled
+    if time.time() - ring.last_dump < 60:
+        return
+    dump_rawlog(None, "%u parse errors/s" % rate)
+
+def close_logs():
+    '''write out any buffered log data and close the logs'''
+    if mpstate.logwriter is not None:
+        mpstate.logwriter.close()
+        mpstate.logwriter = None
+
+def archive_logs(logdir, current):
+    '''compress the logs of earlier flights'''
+    try:
+        count = mp_logwriter.compress_flights(logdir, current)
+    except Exception as e:
+        print("Log archive failed: %s" % e)
+        return
+    if count:
+        print("Compressed %u old log files" % count)
 
 def open_logs():
     '''open log files'''
@@ -888,24 +1848,29 @@ def open_logs():
         logfile = os.path.join(fdir, 'flight.tlog')
         mpstate.status.logdir = fdir
     mpstate.logfile_name = logfile
-    mpstate.logfile = open(logfile, mode=mode)
-    mpstate.logfile_raw = open(logfile+'.raw', mode=mode)
-    print("Logging to %s" % logfile)
-
-    # queues for logging
-    mpstate.logqueue = Queue.Queue()
-    mpstate.logqueue_raw = Queue.Queue()
+    mpstate.logfile_mode = mode
 
     # use a separate thread for writing to the logfile to prevent
     # delays during disk writes (important as delays can be long if camera
-    # app is running)
-    t = threading.Thread(target=log_writer)
-    t.daemon = True
-    t.start()
-
-def set_stream_rates():
+    # app is running). Packets are buffered in fixed size rings, so a
+    # stalled disk drops packets rather than growing memory
+    mpstate.logwriter = mp_logwriter.LogWriter()
+    apply_log_settings()
+    size = max(mpstate.settings.logbuf, 16) * 1024
+    mpstate.logqueue = mpstate.logwriter.add(logfile, mode, size)
+    apply_rawlog_setting()
+    mpstate.logwriter.start()
+    print("Logging to %s" % mpstate.logqueue.name)
+
+    if opts.archive_logs and opts.aircraft is not None:
+        t = threading.Thread(target=archive_logs, name='log_archive',
+                             args=(os.path.join(opts.aircraft, 'logs'), fdir))
+        t.daemon = True
+        t.start()
+
+def set_stream_rates(force=False):
     '''set mavlink stream rates'''
-    if (not msg_period.trigger() and
+    if (not force and
         mpstate.status.last_streamrate1 == mpstate.settings.streamrate and
         mpstate.status.last_streamrate2 == mpstate.settings.streamrate2):
         return
@@ -941,44 +1906,130 @@ def send_heartbeat(master):
         MAV_AUTOPILOT_NONE = 4
         master.mav.heartbeat_send(MAV_GROUND, MAV_AUTOPILOT_NONE)
 
-def periodic_tasks():
-    '''run periodic checks'''
-    if mpstate.status.setup_mode:
-        return
-
+def print_module_exception(msg):
+    '''report an exception from a module according to the moddebug setting'''
+    if mpstate.settings.moddebug == 1:
+        print(msg)
+    elif mpstate.settings.moddebug > 1:
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        traceback.print_exception(exc_type, exc_value, exc_traceback,
+                                  limit=2, file=sys.stdout)
+
+def heartbeat_task():
+    '''send our heartbeat to all masters'''
     if mpstate.settings.heartbeat != 0:
-        heartbeat_period.frequency = mpstate.settings.heartbeat
-
-    if heartbeat_period.trigger() and mpstate.settings.heartbeat != 0:
-        mpstate.status.counters['MasterOut'] += 1
-        for master in mpstate.mav_master:
-            send_heartbeat(master)
+        mpstate.scheduler.set_period(heartbeat_timer, 1.0/mpstate.settings.heartbeat)
+    if mpstate.status.setup_mode or mpstate.settings.heartbeat == 0:
+        return
+    mpstate.status.counters['MasterOut'] += 1
+    for master in mpstate.mav_master:
+        send_heartbeat(master)
 
-    if heartbeat_check_period.trigger():
+def link_check_task():
+    '''check status of master links'''
+    if not mpstate.status.setup_mode:
         check_link_status()
 
-    set_stream_rates()
+def stream_rate_task():
+    '''resend the stream rates, in case the vehicle has rebooted'''
+    if not mpstate.status.setup_mode:
+        set_stream_rates(force=True)
 
-    if battery_period.trigger():
-        battery_report()
+def link_stats_task():
+    '''snapshot the link counters for rate calculations'''
+    for master in mpstate.mav_master:
+        master.linkstats.sample()
 
-    # call optional module idle tasks. These are called at several hundred Hz
-    for (m,pm) in mpstate.modules:
-        if hasattr(m, 'idle_task'):
-            try:
-                m.idle_task()
-            except Exception, msg:
-                if mpstate.settings.moddebug == 1:
-                    print(msg)
-                elif mpstate.settings.moddebug > 1:
-                    exc_type, exc_value, exc_traceback = sys.exc_info()
-                    traceback.print_exception(exc_type, exc_value, exc_traceback,
-                                              limit=2, file=sys.stdout)
+def battery_task():
+    '''report battery levels'''
+    if not mpstate.status.setup_mode:
+        battery_report()
 
+def module_idle_rate(module):
+    '''return the rate in Hz to call a modules idle_task at'''
+    rate = getattr(module, 'idle_rate', None)
+    if rate is None:
+        rate = mpstate.settings.idlerate
+    return max(rate, 0.01)
+
+def run_module_idle_task(module):
+    '''scheduled call of a module idle_task'''
+    task = module.idle_timer
+    mpstate.scheduler.set_period(task, 1.0/module_idle_rate(module))
+    if mpstate.status.setup_mode:
+        return
+    t1 = time.time()
+    try:
+        module.idle_task()
+    except Exception, msg:
+        module_stats(module).errors += 1
+        print_module_exception(msg)
+    module_stats(module).idle.add(time.time() - t1)
+
+def schedule_module(module):
+    '''schedule the idle_task of a newly loaded module'''
+    module.idle_timer = None
+    if module.__class__.idle_task.im_func is mp_module.MPModule.idle_task.im_func:
+        # no idle work to do
+        return
+    module.idle_timer = mpstate.scheduler.add_periodic('idle:%s' % module.name,
+                                                       1.0/module_idle_rate(module),
+                                                       functools.partial(run_module_idle_task, module),
+                                                       delay=0)
+
+def unschedule_module(module):
+    '''stop calling the idle_task of a module'''
+    if getattr(module, 'idle_timer', None) is not None:
+        mpstate.scheduler.cancel(module.idle_timer)
+        module.idle_timer = None
+
+def scheduler_error(task, msg):
+    '''report an exception from a scheduled task'''
+    print_module_exception(msg)
+
+def worker_error(fn, msg):
+    '''report an exception from a background job callback'''
+    print_module_exception(msg)
+
+def update_link_fds():
+    '''keep the reactor registrations in step with the master and output
+    links, which can change fd when they reconnect'''
+    for master in mpstate.mav_master:
+        # the port object is included as a reconnect can reuse the fd number
+        key = (master.fd, getattr(master, 'port', None))
+        if getattr(master, 'recv_backoff', None) is not None:
+            key = (None, None)
+        old = getattr(master, 'reactor_key', (None, None))
+        if key[0] == old[0] and key[1] is old[1]:
+            continue
+        worker = getattr(master, 'link_worker', None)
+        if worker is not None:
+            mpstate.reactor.remove_reader(worker.wakeup_rfd)
+            worker.stop()
+            master.link_worker = None
+        elif old[0] is not None:
+            mpstate.reactor.remove_reader(old[0])
+        if key[0] is not None:
+            if (opts.link_workers and mp_linkworker.supported(master) and
+                not getattr(master, 'link_worker_failed', False)):
+                worker = mp_linkworker.LinkWorker(master)
+                master.link_worker = worker
+                mpstate.reactor.add_reader(worker.wakeup_rfd, process_link_workers, None)
+            else:
+                mpstate.reactor.add_reader(key[0], process_master, master)
+        master.reactor_key = key
+    for m in mpstate.mav_outputs:
+        if getattr(m, 'reactor_fd', None) != m.fd:
+            if getattr(m, 'reactor_fd', None) is not None:
+                mpstate.reactor.remove_reader(m.reactor_fd)
+            mpstate.reactor.add_reader(m.fd, process_mavlink, m)
+            m.reactor_fd = m.fd
 
 def main_loop():
     '''main processing loop'''
-    if not mpstate.status.setup_mode and not opts.nowait:
+    startup.phase('main loop started')
+    mpstate.workers.set_main_thread()
+    if not mpstate.status.setup_mode and not opts.nowait and not opts.replay:
         for master in mpstate.mav_master:
             send_heartbeat(master)
             master.wait_heartbeat()
@@ -993,56 +2044,35 @@ def main_loop():
                 process_stdin(c)
             mpstate.rl.line = None
 
+        # links without a fd (eg. serial ports on windows) need polling
+        polled_links = False
         for master in mpstate.mav_master:
-            if master.fd is None:
-                if master.port.inWaiting() > 0:
+            if master.fd is None and getattr(master, 'port', None) is not None:
+                polled_links = True
+                if (getattr(master, 'recv_backoff', None) is None and
+                    master.port.inWaiting() > 0):
                     process_master(master)
 
-        periodic_tasks()
+        mpstate.workers.run_completions()
+        mpstate.scheduler.run_pending()
 
-        rin = []
-        for master in mpstate.mav_master:
-            if master.fd is not None:
-                rin.append(master.fd)
-        for m in mpstate.mav_outputs:
-            rin.append(m.fd)
-        if rin == []:
-            time.sleep(0.0001)
-            continue
+        update_link_fds()
+        flush_outputs()
 
-        for fd in mpstate.select_extra:
-            rin.append(fd)
-        try:
-            (rin, win, xin) = select.select(rin, [], [], 0.01)
-        except select.error:
-            continue
+        # sleep until the next timer is due unless a link has data
+        timeout = 1.0
+        deadline = mpstate.scheduler.next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+        if polled_links or not mpstate.reactor.can_wakeup():
+            timeout = min(timeout, 0.01)
+        if mpstate.workers.completions:
+            timeout = 0
+        mpstate.reactor.poll(timeout)
 
         if mpstate is None:
             return
 
-        for fd in rin:
-            for master in mpstate.mav_master:
-                if fd == master.fd:
-                    process_master(master)
-                    continue
-            for m in mpstate.mav_outputs:
-                if fd == m.fd:
-                    process_mavlink(m)
-                    continue
-
-            # this allow modules to register their own file descriptors
-            # for the main select loop
-            if fd in mpstate.select_extra:
-                try:
-                    # call the registered read function
-                    (fn, args) = mpstate.select_extra[fd]
-                    fn(args)
-                except Exception, msg:
-                    if mpstate.settings.moddebug == 1:
-                        print(msg)
-                    # on an exception, remove it from the select list
-                    mpstate.select_extra.pop(fd)
-
 
 
 def input_loop():
@@ -1055,8 +2085,13 @@ def input_loop():
                 line = raw_input(mpstate.rl.prompt)
         except EOFError:
             mpstate.status.exit = True
+            # let the main loop see the exit before the interpreter shuts down
+            mpstate.reactor.wakeup()
+            mpstate.status.thread.join(1)
+            close_logs()
             sys.exit(1)
         mpstate.rl.line = line
+        mpstate.reactor.wakeup()
 
 
 def run_script(scriptfile):
@@ -1125,12 +2160,24 @@ if __name__ == '__main__':
         help='Load the specified module. Can be used multiple times, or with a comma separated list')
     parser.add_option("--mav09", action='store_true', default=False, help="Use MAVLink protocol 0.9")
     parser.add_option("--auto-protocol", action='store_true', default=False, help="Auto detect MAVLink protocol version")
+    parser.add_option("--link-workers", action='store_true', default=False, help="read each master link in its own process")
     parser.add_option("--nowait", action='store_true', default=False, help="don't wait for HEARTBEAT on startup")
+    parser.add_option("--replay", default=None, help="replay a telemetry log as the master")
+    parser.add_option("--replay-speed", dest='replay_speed', type='float', default=1.0,
+                      help="replay speed multiplier, 0 for as fast as possible")
     parser.add_option("--continue", dest='continue_mode', action='store_true', default=False, help="continue logs")
+    parser.add_option("--log-compress", dest='log_compress', type='int', default=0, help="gzip level for compressing logs as they are written")
+    parser.add_option("--rawlog", default='on', help="raw link capture: on, off or ring")
+    parser.add_option("--archive-logs", dest='archive_logs', action='store_true', default=False, help="compress the logs of earlier flights")
+    parser.add_option("--eager-modules", dest='eager_modules', action='store_true', default=False,
+                      help="load all standard modules at startup, rather than on first use")
+    parser.add_option("--startup-bench", dest='startup_bench', action='store_true', default=False,
+                      help="show startup times up to the first forwarded packet")
     parser.add_option("--dialect",  default="ardupilotmega", help="MAVLink dialect")
     parser.add_option("--rtscts",  action='store_true', help="enable hardware RTS/CTS flow control")
 
     (opts, args) = parser.parse_args()
+    startup.phase('options parsed')
 
     if opts.mav09:
         os.environ['MAVLINK09'] = '1'
@@ -1148,7 +2195,7 @@ if __name__ == '__main__':
         # modules/mavutil
         load_module('speech')
 
-    if not opts.master:
+    if not opts.master and not opts.replay:
         serial_list = mavutil.auto_detect_serial(preferred_list=['*FTDI*',"*Arduino_Mega_2560*", "*3D_Robotics*", "*USB_to_UART*"])
         if len(serial_list) == 1:
             opts.master = [serial_list[0].device]
@@ -1173,50 +2220,50 @@ Auto-detected serial ports are:
     mpstate.mav_master = []
 
     # open master link
-    for mdev in opts.master:
+    for mdev in (opts.master or []):
         if ',' in mdev and not os.path.exists(mdev):
             port, baud = mdev.split(',')
         else:
             port, baud = mdev, opts.baudrate
 
         m = mavutil.mavlink_connection(port, autoreconnect=True, baud=int(baud))
-        m.mav.set_callback(master_callback, m)
-        if hasattr(m.mav, 'set_send_callback'):
-            m.mav.set_send_callback(master_send_callback, m)
         if opts.rtscts:
             m.set_rtscts(True)
-        m.linknum = len(mpstate.mav_master)
-        m.linkerror = False
-        m.link_delayed = False
-        m.last_heartbeat = 0
-        m.last_message = 0
-        m.highest_msec = 0
-        mpstate.mav_master.append(m)
-        mpstate.status.counters['MasterIn'].append(0)
+        add_master(m)
+
+    # a replayed log appears as one more master link
+    if opts.replay:
+        mpstate.replay = mp_replay.Replay(opts.replay, opts.replay_speed)
+        mpstate.replay_link = mp_replay.ReplayLink(opts.replay)
+        add_master(mpstate.replay_link)
 
     # log all packets from the master, for later replay
+    mpstate.settings.logcompress = opts.log_compress
+    mpstate.settings.set('rawlog', opts.rawlog)
     open_logs()
 
     # open any mavlink UDP ports
     for p in opts.output:
-        if ',' in p and not os.path.exists(p):
-            port, baud = p.split(',')            
-        else:
-            port, baud = p, opts.baudrate
-
-        mpstate.mav_outputs.append(mavutil.mavlink_connection(port, baud=int(baud), input=False))
+        add_output(p)
 
     if opts.sitl:
         mpstate.sitl_output = mavutil.mavudp(opts.sitl, input=False)
+    startup.phase('links opened')
 
     mpstate.settings.numcells = opts.num_cells
     mpstate.settings.streamrate = opts.streamrate
     mpstate.settings.streamrate2 = opts.streamrate
 
-    msg_period = mavutil.periodic_event(1.0/15)
-    heartbeat_period = mavutil.periodic_event(1)
-    battery_period = mavutil.periodic_event(0.1)
-    heartbeat_check_period = mavutil.periodic_event(0.33)
+    heartbeat_timer = mpstate.scheduler.add_periodic('heartbeat', 1.0, heartbeat_task)
+    mpstate.scheduler.add_periodic('linkcheck', 3.0, link_check_task)
+    mpstate.scheduler.add_periodic('streamrate', 15.0, stream_rate_task)
+    mpstate.scheduler.add_periodic('battery', 10.0, battery_task)
+    mpstate.scheduler.add_periodic('linkstats', 1.0, link_stats_task)
+    mpstate.scheduler.add_periodic('rawlog', 1.0, rawlog_task)
+    if opts.link_workers:
+        mpstate.scheduler.add_periodic('linkworkers', 1.0, link_worker_task)
+    if mpstate.replay is not None:
+        mpstate.replay_timer = mpstate.scheduler.add_oneshot('replay', 0, replay_task)
 
     mpstate.rl = rline.rline("MAV> ", mpstate)
     if opts.setup:
@@ -1236,10 +2283,11 @@ Auto-detected serial ports are:
 
     if not opts.setup:
         # some core functionality is in modules
-        standard_modules = ['log','rally','fence','param','relay',
-                            'tuneopt','arm','mode','calibration','rc','wp','auxopt','quadcontrols']
-        for m in standard_modules:
-            load_module(m, quiet=True)
+        for (m, commands, mtypes) in standard_modules:
+            if commands is None or opts.eager_modules:
+                load_module(m, quiet=True)
+            else:
+                register_lazy_module(m, commands, mtypes)
 
     if opts.console:
         process_stdin('module load console')
@@ -1256,9 +2304,10 @@ Auto-detected serial ports are:
         cmds = opts.cmd.split(';')
         for c in cmds:
             process_stdin(c)
+    startup.phase('modules loaded')
 
     # run main loop as a thread
-    mpstate.status.thread = threading.Thread(target=main_loop)
+    mpstate.status.thread = threading.Thread(target=main_loop, name='main_loop')
     mpstate.status.thread.daemon = True
     mpstate.status.thread.start()
 
@@ -1283,13 +2332,18 @@ Auto-detected serial ports are:
                         m.init(mpstate)   
 
             else:
+                # fall through to the cleanup below, so modules are
+                # unloaded and the logs flushed as on 'exit'
                 mpstate.status.exit = True
-                sys.exit(1)
+                break
 
     #this loop executes after leaving the above loop and is for cleanup on exit
     for (m,pm) in mpstate.modules:
         if hasattr(m, 'unload'):
             print "Unloading module:", m.name
             m.unload()
+
+    mpstate.workers.close()
+    close_logs()
         
     sys.exit(1)
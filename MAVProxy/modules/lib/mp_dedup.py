@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''
+duplicate packet suppression for MAVProxy
+
+When a vehicle is heard over more than one link every packet arrives
+several times. Packets are identified by (sysid, compid, seq, msgid),
+with a sliding window of the last 128 sequence numbers kept for each
+source so we can tell a copy of a recent packet from a new one after
+the sequence number wraps.
+'''
+
+import time
+
+WINDOW = 128
+
+# RADIO and RADIO_STATUS packets come from each link's own radio, with
+# its own sequence numbers, so they are never copies of each other
+RADIO_SOURCE = (ord('3'), ord('D'))
+
+class SourceWindow(object):
+    '''msgid seen at each recent sequence number of one source, and
+    when the window last passed that sequence number'''
+    def __init__(self, seq, msgid, tnow):
+        self.slots = [-1] * 256
+        self.times = [0] * 256
+        self.slots[seq] = msgid
+        self.times[seq] = tnow
+        self.newest = seq
+        self.last_seen = tnow
+
+
+class Deduplicator(object):
+    '''detect repeated copies of packets'''
+    def __init__(self, timeout=2.0, max_delay=1.0):
+        # a source we haven't heard from for this long has its window
+        # reset, which copes with a vehicle rebooting
+        self.timeout = timeout
+        # a copy arriving later than this over a slower link is taken
+        # as a new packet after a jump in the sequence numbers
+        self.max_delay = max_delay
+        self.sources = {}
+        self.duplicates = 0
+
+    def is_duplicate(self, src_system, src_component, seq, msgid):
+        '''record a packet, returning True if it is a copy of one
+        already seen'''
+        src = (src_system, src_component)
+        if src == RADIO_SOURCE:
+            return False
+        tnow = time.time()
+        w = self.sources.get(src, None)
+        if w is None or tnow - w.last_seen > self.timeout:
+            self.sources[src] = SourceWindow(seq, msgid, tnow)
+            return False
+        w.last_seen = tnow
+        slots = w.slots
+        times = w.times
+        ahead = (seq - w.newest) % 256
+        if ahead != 0 and ahead < WINDOW:
+            # new packet, slide the window forward
+            for i in range(1, ahead):
+                slots[(w.newest + i) % 256] = -1
+                times[(w.newest + i) % 256] = tnow
+            slots[seq] = msgid
+            times[seq] = tnow
+            w.newest = seq
+            return False
+        if tnow - times[seq] > self.max_delay:
+            # the slot is from an earlier lap, so this is a jump of a
+            # window or more after lost packets, not a late arrival
+            self.sources[src] = SourceWindow(seq, msgid, tnow)
+            return False
+        if slots[seq] == msgid:
+            self.duplicates += 1
+            return True
+        # a late first copy of an older packet
+        slots[seq] = msgid
+        times[seq] = tnow
+        return False
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+'''
+byte level MAVLink framing for MAVProxy
+
+This splits a stream into MAVLink 1.0 and 2.0 frames using only the
+header, length and checksum, so packets that nobody needs to look at
+can be forwarded without being decoded into message objects.
+'''
+
+import binascii, struct
+
+MAGIC_V1 = '\xfe'
+MAGIC_V2 = '\xfd'
+MAVLINK_IFLAG_SIGNED = 0x01
+SIGNATURE_LEN = 13
+
+def _reverse_bits(b):
+    '''reverse the bits in a byte'''
+    r = 0
+    for i in range(8):
+        if b & (1<<i):
+            r |= 1 << (7-i)
+    return r
+
+_REVERSE = ''.join([chr(_reverse_bits(i)) for i in range(256)])
+_REVERSE_ORD = [_reverse_bits(i) for i in range(256)]
+
+def x25crc(buf):
+    '''MAVLink (X.25/MCRF4XX) checksum of a string.
+
+    This is the reflected form of the CCITT CRC that binascii.crc_hqx()
+    calculates, so bit reversing the input and output lets the C
+    implementation do the work instead of a per-byte python loop'''
+    crc = binascii.crc_hqx(buf.translate(_REVERSE), 0xffff)
+    return (_REVERSE_ORD[crc & 0xff] << 8) | _REVERSE_ORD[crc >> 8]
+
+
+class MessageTable(object):
+    '''msgid to name and CRC extra lookup for a MAVLink dialect'''
+    def __init__(self, mavlink):
+        self.names = {}
+        self.crc_extra = {}
+        for name in dir(mavlink):
+            if name.startswith('MAVLINK_MSG_ID_'):
+                msgid = getattr(mavlink, name)
+                if isinstance(msgid, int) and msgid >= 0:
+                    self.names[msgid] = name[15:]
+        for (msgid, entry) in mavlink.mavlink_map.items():
+            if isinstance(entry, tuple):
+                # older generators used (fmt, type, order_map, crc_extra)
+                self.crc_extra[msgid] = chr(entry[3])
+            else:
+                self.crc_extra[msgid] = chr(entry.crc_extra)
+        self.ids = dict([(name, msgid) for (msgid, name) in self.names.items()])
+
+_tables = {}
+
+def message_table(mavlink):
+    '''return the (cached) MessageTable for a mavlink dialect module'''
+    if not mavlink in _tables:
+        _tables[mavlink] = MessageTable(mavlink)
+    return _tables[mavlink]
+
+
+class Framer(object):
+    '''split a byte stream into checked MAVLink frames'''
+    def __init__(self, table):
+        self.table = table
+        self.buf = ''
+        self.frames = 0
+        # number of times we lost sync, either on junk between frames
+        # or a frame with a bad checksum
+        self.errors = 0
+        self.bad_bytes = 0
+
+    def parse(self, s):
+        '''add bytes to the stream, returning a list of complete frames
+        as (msgid, frame, srcSystem, srcComponent, seq) tuples'''
+        buf = self.buf + s
+        n = len(buf)
+        crc_extra = self.table.crc_extra
+        ret = []
+        i = 0
+        while i < n:
+            c = buf[i]
+            if c != MAGIC_V1 and c != MAGIC_V2:
+                # skip to the next possible start of frame
+                j1 = buf.find(MAGIC_V1, i)
+                j2 = buf.find(MAGIC_V2, i)
+                if j1 == -1 or (j2 != -1 and j2 < j1):
+                    j1 = j2
+                if j1 == -1:
+                    j1 = n
+                self.errors += 1
+                self.bad_bytes += j1 - i
+                i = j1
+                continue
+            if c == MAGIC_V1:
+                if n - i < 6:
+                    break
+                hdrlen = 6
+                flen = ord(buf[i+1]) + 8
+                (seq, src_system, src_component, msgid) = struct.unpack('BBBB', buf[i+2:i+6])
+            else:
+                if n - i < 10:
+                    break
+                hdrlen = 10
+                flen = ord(buf[i+1]) + 12
+                if ord(buf[i+2]) & MAVLINK_IFLAG_SIGNED:
+                    flen += SIGNATURE_LEN
+                (seq, src_system, src_component, msgid, msgid_high) = struct.unpack('<BBBHB', buf[i+4:i+10])
+                msgid |= msgid_high << 16
+            if n - i < flen:
+                break
+            end = i + hdrlen + ord(buf[i+1])
+            extra = crc_extra.get(msgid, None)
+            if (extra is None or
+                x25crc(buf[i+1:end] + extra) != struct.unpack('<H', buf[end:end+2])[0]):
+                # not a frame we can check, resync on the next byte
+                self.errors += 1
+                self.bad_bytes += 1
+                i += 1
+                continue
+            ret.append((msgid, buf[i:i+flen], src_system, src_component, seq))
+            i += flen
+        self.buf = buf[i:]
+        self.frames += len(ret)
+        return ret
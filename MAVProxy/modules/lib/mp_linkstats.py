@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+'''
+per-link traffic accounting for MAVProxy
+
+Packet and byte counts are kept in arrays indexed by message ID and by
+source system, so counting a packet on the hot path is a few array
+increments. Once a second the counters are snapshotted, and rates are
+worked out from the difference over a short rolling window.
+'''
+
+import time
+from array import array
+from collections import deque
+
+# message IDs below this map straight to an array slot. MAVLink2 IDs
+# above it are given slots as they are seen
+DIRECT_IDS = 256
+
+def _zeros(n):
+    return array('d', [0]) * n
+
+class LinkStats(object):
+    '''rolling packet and byte rates for one link'''
+    def __init__(self, window=5):
+        self.slots = {}
+        self.slot_ids = range(DIRECT_IDS)
+        self.msg_pkts = _zeros(DIRECT_IDS)
+        self.msg_bytes = _zeros(DIRECT_IDS)
+        self.src_pkts = _zeros(256)
+        self.src_bytes = _zeros(256)
+        self.pkts = 0
+        self.bytes = 0
+        # (time, pkts, bytes, msg_pkts, msg_bytes, src_pkts, src_bytes)
+        self.history = deque(maxlen=window+1)
+        self.sample()
+
+    def _slot(self, msgid):
+        '''find the array slot for a MAVLink2 message ID'''
+        slot = self.slots.get(msgid, None)
+        if slot is None:
+            slot = len(self.slot_ids)
+            self.slots[msgid] = slot
+            self.slot_ids.append(msgid)
+            self.msg_pkts.append(0)
+            self.msg_bytes.append(0)
+        return slot
+
+    def update(self, msgid, src_system, nbytes):
+        '''count a packet'''
+        if msgid < DIRECT_IDS:
+            slot = msgid
+        else:
+            slot = self._slot(msgid)
+        self.msg_pkts[slot] += 1
+        self.msg_bytes[slot] += nbytes
+        self.src_pkts[src_system] += 1
+        self.src_bytes[src_system] += nbytes
+        self.pkts += 1
+        self.bytes += nbytes
+
+    def sample(self):
+        '''take a snapshot of the counters for rate calculations'''
+        self.history.append((time.time(), self.pkts, self.bytes,
+                             array('d', self.msg_pkts), array('d', self.msg_bytes),
+                             array('d', self.src_pkts), array('d', self.src_bytes)))
+
+    def _span(self):
+        '''return the oldest and newest snapshots and the time between them'''
+        old = self.history[0]
+        new = self.history[-1]
+        return (old, new, max(new[0] - old[0], 0.001))
+
+    def rates(self):
+        '''return (packets/s, bytes/s) for the whole link'''
+        (old, new, dt) = self._span()
+        return ((new[1] - old[1]) / dt, (new[2] - old[2]) / dt)
+
+    def _array_rates(self, pidx, bidx, ids):
+        (old, new, dt) = self._span()
+        ret = []
+        for i in range(len(new[pidx])):
+            opkts = old[pidx][i] if i < len(old[pidx]) else 0
+            obytes = old[bidx][i] if i < len(old[bidx]) else 0
+            if new[pidx][i] != opkts:
+                ret.append((ids[i], (new[pidx][i] - opkts) / dt, (new[bidx][i] - obytes) / dt))
+        return sorted(ret, key=lambda x: -x[2])
+
+    def message_rates(self):
+        '''return a list of (msgid, packets/s, bytes/s), busiest first'''
+        return self._array_rates(3, 4, self.slot_ids)
+
+    def source_rates(self):
+        '''return a list of (sysid, packets/s, bytes/s), busiest first'''
+        return self._array_rates(5, 6, range(256))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+'''
+per-link worker processes for MAVProxy
+
+With --link-workers each master link is read and framed in its own
+process, so receiving and checksumming packets on several links can use
+more than one core. Checked frames are passed back to the main process
+through a shared memory single-producer/single-consumer ring, with a
+pipe used to wake the main loop. The main process only decodes the
+frames it needs, as with fastfwd.
+
+This relies on fork(), so it is only available on posix systems.
+'''
+
+import os, time, mmap, struct, select, errno, ctypes, multiprocessing
+from pymavlink import mavutil
+from MAVProxy.modules.lib import mp_frame
+from MAVProxy.modules.lib import mp_recvbuf
+
+# record kinds
+REC_FRAME = 0
+REC_ADDRESS = 1
+REC_ERRORS = 2
+REC_RAW = 3
+
+# length, kind, timestamp, msgid, srcSystem, srcComponent, seq. The
+# length is 32 bits as a raw record holds a whole receive buffer
+REC_HEADER = struct.Struct('<IBdIBBB')
+
+# ring flags set by the main process
+FLAG_RAW = 1
+FLAG_STOP = 2
+
+def supported(conn):
+    '''return True if a connection can be read by a worker process'''
+    if os.name == 'nt' or getattr(conn, 'fd', None) is None:
+        return False
+    return isinstance(conn, (mavutil.mavudp, mavutil.mavserial))
+
+
+class SharedRing(object):
+    '''a byte ring in shared memory with one writer and one reader.
+
+    head and tail only ever increase, and are each written by only one
+    side. A record is written in full before head is advanced past it,
+    so the reader never sees a partial record'''
+    def __init__(self, size=1024*1024):
+        self.size = size
+        self.buf = mmap.mmap(-1, size)
+        self.head = multiprocessing.RawValue(ctypes.c_uint64, 0)
+        self.tail = multiprocessing.RawValue(ctypes.c_uint64, 0)
+        self.flags = multiprocessing.RawValue(ctypes.c_uint32, 0)
+        self.overflows = multiprocessing.RawValue(ctypes.c_uint32, 0)
+
+    def _write(self, pos, data):
+        ofs = pos % self.size
+        n = min(len(data), self.size - ofs)
+        self.buf[ofs:ofs+n] = data[:n]
+        if n < len(data):
+            self.buf[0:len(data)-n] = data[n:]
+
+    def _read(self, pos, length):
+        ofs = pos % self.size
+        n = min(length, self.size - ofs)
+        ret = self.buf[ofs:ofs+n]
+        if n < length:
+            ret += self.buf[0:length-n]
+        return ret
+
+    def put(self, kind, tstamp, data, msgid=0, src_system=0, src_component=0, seq=0):
+        '''add a record, returning False if there is no room'''
+        rec = REC_HEADER.pack(len(data), kind, tstamp, msgid, src_system, src_component, seq) + data
+        head = self.head.value
+        if len(rec) > self.size - (head - self.tail.value):
+            return False
+        self._write(head, rec)
+        self.head.value = head + len(rec)
+        return True
+
+    def get(self, limit=1000):
+        '''return up to limit records as (kind, tstamp, data, msgid, srcSystem, srcComponent, seq)'''
+        ret = []
+        tail = self.tail.value
+        head = self.head.value
+        while tail < head and len(ret) < limit:
+            (length, kind, tstamp, msgid, src_system, src_component, seq) = REC_HEADER.unpack(
+                self._read(tail, REC_HEADER.size))
+            tail += REC_HEADER.size
+            ret.append((kind, tstamp, self._read(tail, length), msgid, src_system, src_component, seq))
+            tail += length
+        self.tail.value = tail
+        return ret
+
+    def pending(self):
+        '''return True if there are records waiting'''
+        return self.tail.value != self.head.value
+
+
+def _worker_main(conn, ring, wakeup_fd):
+    '''read, frame and queue packets from one link'''
+    framer = mp_frame.Framer(mp_frame.message_table(mavutil.mavlink))
+    recvbuf = mp_recvbuf.ReceiveBuffer(conn)
+    last_address = getattr(conn, 'last_address', None)
+    errors = 0
+    parent = os.getppid()
+
+    def put(*args, **kwargs):
+        # wait for the main process to catch up rather than drop frames
+        while not ring.put(*args, **kwargs):
+            if ring.flags.value & FLAG_STOP:
+                return
+            ring.overflows.value += 1
+            time.sleep(0.001)
+
+    while not ring.flags.value & FLAG_STOP and os.getppid() == parent:
+        try:
+            select.select([conn.fd], [], [], 0.5)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                break
+            continue
+        try:
+            data = recvbuf.drain()
+        except mp_recvbuf.LinkDead:
+            time.sleep(0.1)
+            continue
+        tnow = time.time()
+        address = getattr(conn, 'last_address', None)
+        if address is not None and address != last_address:
+            put(REC_ADDRESS, tnow, '%s:%u' % address)
+            last_address = address
+        if ring.flags.value & FLAG_RAW:
+            put(REC_RAW, tnow, data)
+        else:
+            for (msgid, frame, src_system, src_component, seq) in framer.parse(data):
+                put(REC_FRAME, tnow, frame, msgid, src_system, src_component, seq)
+        if framer.errors != errors:
+            put(REC_ERRORS, tnow, '', framer.errors - errors)
+            errors = framer.errors
+        try:
+            os.write(wakeup_fd, 'x')
+        except OSError:
+            # pipe full, the main process already has a wakeup pending
+            pass
+
+def _worker_run(conn, ring, wakeup_fd):
+    try:
+        _worker_main(conn, ring, wakeup_fd)
+    except KeyboardInterrupt:
+        pass
+
+
+class LinkWorker(object):
+    '''a worker process reading one master link'''
+    def __init__(self, conn, ring_size=1024*1024):
+        import fcntl
+        self.conn = conn
+        self.fd = conn.fd
+        self.ring = SharedRing(ring_size)
+        (self.wakeup_rfd, wfd) = os.pipe()
+        for fd in [self.wakeup_rfd, wfd]:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.wakeup_wfd = wfd
+        self.process = multiprocessing.Process(target=_worker_run,
+                                               args=(conn, self.ring, wfd),
+                                               name='link worker %s' % getattr(conn, 'address', ''))
+        self.process.daemon = True
+        self.process.start()
+
+    def alive(self):
+        '''return True if the worker process is still running'''
+        return self.process.is_alive()
+
+    def set_raw(self, raw):
+        '''ask the worker to pass raw data instead of frames'''
+        if raw:
+            self.ring.flags.value |= FLAG_RAW
+        else:
+            self.ring.flags.value &= ~FLAG_RAW
+
+    def drain_wakeup(self):
+        '''empty the wakeup pipe'''
+        try:
+            while len(os.read(self.wakeup_rfd, 256)) == 256:
+                pass
+        except OSError:
+            pass
+
+    def records(self, limit=1000):
+        '''return the records waiting from the worker'''
+        return self.ring.get(limit)
+
+    def stats(self):
+        '''return a one line summary of the worker'''
+        return "worker pid %s, %u ring overflow waits" % (self.process.pid, self.ring.overflows.value)
+
+    def stop(self):
+        '''stop the worker process'''
+        self.ring.flags.value |= FLAG_STOP
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        for fd in [self.wakeup_rfd, self.wakeup_wfd]:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
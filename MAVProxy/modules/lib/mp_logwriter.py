@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+'''
+group commit log writer for MAVProxy
+
+Packets are copied into a preallocated ring buffer per log file, so
+logging a packet costs one copy rather than a Python object on a
+queue. A writer thread commits everything in the ring to disk once
+enough data has built up or the commit interval has passed, and
+optionally fsyncs the file. If the disk stalls the ring fills, and
+further packets are dropped and counted rather than using more memory.
+
+Logs can be gzip compressed as they are written. Each commit is written
+as a separate gzip member, so a crash loses at most the last commit, and
+the members together read back as a single gzip file. Logs can also be
+rotated into numbered segments by size or age.
+'''
+
+import os, struct, threading, time, zlib, gzip, shutil
+
+def segment_name(filename, segment, compress):
+    '''return the file name of a log segment. Segments after the first
+    are numbered before the extension, so flight.tlog.raw becomes
+    flight-2.tlog.raw'''
+    if segment > 1:
+        dirname = os.path.dirname(filename)
+        parts = os.path.basename(filename).split('.', 1)
+        parts[0] = '%s-%u' % (parts[0], segment)
+        filename = os.path.join(dirname, '.'.join(parts))
+    if compress:
+        filename += '.gz'
+    return filename
+
+def last_segment(filename):
+    '''return the number of the last existing segment of a log, or 1'''
+    segment = 1
+    while (os.path.exists(segment_name(filename, segment+1, False)) or
+           os.path.exists(segment_name(filename, segment+1, True))):
+        segment += 1
+    return segment
+
+def ring_copy(buf, pos, data):
+    '''copy data into a ring buffer at pos, wrapping if needed'''
+    n = len(data)
+    size = len(buf)
+    if pos + n <= size:
+        buf[pos:pos+n] = data
+    else:
+        first = size - pos
+        buf[pos:] = data[:first]
+        buf[:n-first] = data[first:]
+
+class LogRing(object):
+    '''ring buffer holding data waiting to be written to one log'''
+    def __init__(self, writer, filename, mode, size):
+        self.writer = writer
+        self.filename = filename
+        self.mode = mode
+        self.segment = writer.segment
+        self._open()
+        self.size = size
+        self.buf = bytearray(size)
+        # total bytes ever added and ever written, the ring holds the
+        # bytes between them
+        self.head = 0
+        self.tail = 0
+        self.written = 0
+        self.records = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.max_fill = 0
+        self.last_fsync = time.time()
+
+    def _open(self):
+        '''open the file for the current segment'''
+        self.compress = self.writer.compress
+        self.name = segment_name(self.filename, self.segment, self.compress)
+        self.f = open(self.name, mode=self.mode)
+        self.file_bytes = 0
+        self.opened = time.time()
+
+    def rotate(self):
+        '''close the current segment and start the next one'''
+        self.f.close()
+        self.segment = self.writer.segment
+        self.mode = 'w'
+        self._open()
+
+    def _write(self, data):
+        '''write data to the file, compressing it if needed'''
+        if self.compress:
+            c = zlib.compressobj(self.compress, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+            data = c.compress(data) + c.flush()
+        self.f.write(data)
+        self.file_bytes += len(data)
+
+    def pending(self):
+        '''number of bytes waiting to be written'''
+        return self.head - self.tail
+
+    def put(self, data, usec=None):
+        '''add data to the ring, preceded by a big endian timestamp if
+        usec is given. Returns False if the ring is full'''
+        n = len(data)
+        if usec is not None:
+            n += 8
+        with self.writer.lock:
+            fill = self.head - self.tail + n
+            if fill > self.size:
+                self.dropped += 1
+                self.dropped_bytes += n
+                return False
+            pos = self.head % self.size
+            if usec is None:
+                ring_copy(self.buf, pos, data)
+            elif pos + n <= self.size:
+                struct.pack_into('>Q', self.buf, pos, usec)
+                self.buf[pos+8:pos+n] = data
+            else:
+                ring_copy(self.buf, pos, struct.pack('>Q', usec) + str(data))
+            self.head += n
+            self.records += 1
+            if fill > self.max_fill:
+                self.max_fill = fill
+            if fill >= self.writer.commit_bytes:
+                self.writer.cond.notify()
+        return True
+
+    def commit(self, head):
+        '''write the ring up to head to the file. The bytes between tail
+        and head are not touched by put() until tail moves on, so the
+        lock isn't held while writing'''
+        n = head - self.tail
+        if n == 0:
+            return 0
+        pos = self.tail % self.size
+        if pos + n <= self.size:
+            self._write(buffer(self.buf, pos, n))
+        else:
+            first = self.size - pos
+            self._write(buffer(self.buf, pos, first) + buffer(self.buf, 0, n-first))
+        self.f.flush()
+        with self.writer.lock:
+            self.tail = head
+        self.written += n
+        return n
+
+    def sync(self, tnow):
+        '''fsync the file if the fsync interval has passed'''
+        interval = self.writer.fsync_interval
+        if interval <= 0 or tnow - self.last_fsync < interval:
+            return
+        os.fsync(self.f.fileno())
+        self.last_fsync = tnow
+
+    def stats(self):
+        '''return a one line summary'''
+        return "%s: %u records %u bytes written, %u/%u bytes buffered (max %u), %u dropped (%u bytes)" % (
+            self.name, self.records, self.written, self.pending(), self.size, self.max_fill,
+            self.dropped, self.dropped_bytes)
+
+
+class LogWriter(object):
+    '''thread committing a set of log rings to disk'''
+    def __init__(self, commit_interval=0.2, commit_bytes=65536, fsync_interval=0):
+        self.commit_interval = commit_interval
+        self.commit_bytes = commit_bytes
+        self.fsync_interval = fsync_interval
+        # gzip level for new segments, 0 for no compression
+        self.compress = 0
+        # start new segments after this many bytes or seconds, 0 to disable
+        self.rotate_bytes = 0
+        self.rotate_time = 0
+        self.segment = 1
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.rings = []
+        self.commits = 0
+        self.max_commit_time = 0
+        self.running = False
+        self.thread = None
+
+    def add(self, filename, mode, size):
+        '''add a log to be written through a ring of size bytes'''
+        if mode.startswith('a'):
+            # carry on from the last segment of an earlier session, so
+            # rotating doesn't overwrite its later segments
+            self.segment = max(self.segment, last_segment(filename))
+        ring = LogRing(self, filename, mode, size)
+        with self.lock:
+            self.rings.append(ring)
+        return ring
+
+    def start(self):
+        '''start the writer thread'''
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='log_writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            with self.lock:
+                if max([r.pending() for r in self.rings]) < self.commit_bytes:
+                    self.cond.wait(self.commit_interval)
+            self.commit()
+
+    def commit(self):
+        '''write out everything currently in the rings'''
+        with self.lock:
+            heads = [r.head for r in self.rings]
+        t0 = time.time()
+        n = 0
+        for (ring, head) in zip(self.rings, heads):
+            n += ring.commit(head)
+        tnow = time.time()
+        for ring in self.rings:
+            ring.sync(tnow)
+        if n > 0:
+            self.commits += 1
+            self.max_commit_time = max(self.max_commit_time, tnow - t0)
+            if self.need_rotate(tnow):
+                # rotate all the logs together, so segments line up
+                self.segment += 1
+                for ring in self.rings:
+                    ring.rotate()
+
+    def need_rotate(self, tnow):
+        '''return True if it is time to start new log segments'''
+        for ring in self.rings:
+            if self.rotate_bytes > 0 and ring.file_bytes >= self.rotate_bytes:
+                return True
+            if self.rotate_time > 0 and tnow - ring.opened >= self.rotate_time:
+                return True
+        return False
+
+    def close(self):
+        '''stop the writer thread and write out anything left'''
+        self.running = False
+        if self.thread is not None:
+            with self.lock:
+                self.cond.notify()
+            self.thread.join()
+            self.thread = None
+        self.commit()
+        for ring in self.rings:
+            ring.f.close()
+
+
+class CaptureRing(object):
+    '''in memory ring keeping the last size bytes of a stream, for
+    writing out when something goes wrong'''
+    def __init__(self, size):
+        self.size = size
+        self.buf = bytearray(size)
+        # total bytes ever added
+        self.head = 0
+        self.dumps = 0
+        self.last_dump = 0
+
+    def put(self, data, usec=None):
+        '''add data to the ring, overwriting the oldest data'''
+        n = len(data)
+        if n > self.size:
+            self.head += n - self.size
+            data = data[n-self.size:]
+            n = self.size
+        ring_copy(self.buf, self.head % self.size, data)
+        self.head += n
+        return True
+
+    def snapshot(self):
+        '''return the contents of the ring, oldest first'''
+        if self.head <= self.size:
+            return str(self.buf[:self.head])
+        pos = self.head % self.size
+        return str(self.buf[pos:] + self.buf[:pos])
+
+    def stats(self):
+        '''return a one line summary'''
+        return "raw capture: %u/%u bytes held, %u bytes seen, %u dumps" % (
+            min(self.head, self.size), self.size, self.head, self.dumps)
+
+
+def compress_file(filename, level=6):
+    '''gzip a completed log file, replacing the original'''
+    tmpname = filename + '.gz.tmp'
+    src = open(filename, 'rb')
+    dst = gzip.open(tmpname, 'wb', level)
+    shutil.copyfileobj(src, dst, 1024*1024)
+    dst.close()
+    src.close()
+    os.rename(tmpname, filename + '.gz')
+    os.unlink(filename)
+
+def compress_flights(logdir, exclude, level=6, min_age=600):
+    '''gzip the logs of completed flights in the logs/DATE/flightN
+    directories under logdir, skipping the directory exclude. Logs
+    modified in the last min_age seconds may still be being written by
+    another MAVProxy, so they are left alone'''
+    count = 0
+    tnow = time.time()
+    for (dirpath, dirnames, filenames) in os.walk(logdir):
+        if os.path.abspath(dirpath) == os.path.abspath(exclude):
+            continue
+        for f in sorted(filenames):
+            if f.endswith('.tlog') or f.endswith('.tlog.raw'):
+                path = os.path.join(dirpath, f)
+                if tnow - os.path.getmtime(path) < min_age:
+                    continue
+                compress_file(path, level)
+                count += 1
+    return count
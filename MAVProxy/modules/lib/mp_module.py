@@ -1,3 +1,7 @@
+from MAVProxy.modules.lib import mp_stats
+from MAVProxy.modules.lib import mp_worker
+from MAVProxy.modules.lib import mp_transfer
+
 
 class MPModule(object):
     '''
@@ -18,6 +22,14 @@ class MPModule(object):
             self.description = description
         if public:
             mpstate.public_modules[name] = self
+        # message types passed to mavlink_packet(). None means all
+        # types, which keeps modules that don't declare any working
+        self.message_types = None
+        # rate in Hz to call idle_task() at. None means the idlerate setting
+        self.idle_rate = None
+        self.idle_timer = None
+        # call timing, see 'module stats'
+        self.stats = mp_stats.ModuleStats()
 
     #
     # Overridable hooks follow...
@@ -99,7 +111,8 @@ class MPModule(object):
         return self.mpstate.functions.get_mav_param(param_name, default)
 
     def param_set(self, name, value, retries=3):
-        self.mpstate.functions.param_set(name, value, retries)
+        '''set a parameter, returning a future for the acknowledgement'''
+        return self.mpstate.functions.param_set(name, value, retries)
 
     def add_command(self, name, callback, description, completions=None):
         self.mpstate.command_map[name] = (callback, description)
@@ -108,3 +121,100 @@ class MPModule(object):
 
     def add_completion_function(self, name, callback):
         self.mpstate.completion_functions[name] = callback
+
+    def add_select_fd(self, fd, callback, args):
+        '''ask the main loop to call callback(args) when fd is readable'''
+        self.mpstate.select_extra[fd] = (callback, args)
+
+    def remove_select_fd(self, fd):
+        '''remove a fd added with add_select_fd()'''
+        self.mpstate.select_extra.pop(fd, None)
+
+    def set_idle_rate(self, rate):
+        '''set the rate in Hz that idle_task() is called at. None
+        means use the idlerate setting'''
+        self.idle_rate = rate
+        if self.idle_timer is not None and rate is not None:
+            self.mpstate.scheduler.set_period(self.idle_timer, 1.0/max(rate, 0.01))
+
+    def run_in_background(self, fn, on_done=None, process=False):
+        '''run fn() on the shared worker pool, returning a future for its
+        result. on_done(future) is called from the main loop when it
+        completes. With process=True fn runs in a worker process, so it
+        must be picklable'''
+        workers = self.mpstate.workers
+        if process:
+            future = workers.submit_process(fn)
+        else:
+            future = workers.submit(fn)
+        if future.description is None or future.description == '<lambda>':
+            future.description = self.name
+        if on_done is not None:
+            future.add_done_callback(on_done)
+        return future
+
+    def run_on_main(self, fn, *args, **kwargs):
+        '''from a background job, run fn on the main loop and return a
+        future for its result'''
+        return self.mpstate.workers.run_on_main(fn, *args, **kwargs)
+
+    def future(self, description=None):
+        '''return a new future, for an operation the module completes
+        itself from the main loop'''
+        return mp_worker.Future(self.mpstate.workers, description)
+
+    def point_transfer(self, name, count, fetch, points=None, send=None, match=None,
+                       indexes=None):
+        '''start a pipelined download of count points, or of the points
+        listed in indexes, or an upload and verify of points, returning
+        the transfer. Feed the points
+        received to transfer.handle(idx, m). transfer.future completes
+        when the transfer does'''
+        transfer = mp_transfer.PointTransfer(name, count, fetch,
+                                             self.future('%s transfer' % name),
+                                             self.mpstate.scheduler,
+                                             points=points, send=send, match=match,
+                                             window=self.settings.xferwindow,
+                                             timeout=self.settings.xfertimeout,
+                                             progress=self.transfer_progress,
+                                             indexes=indexes)
+        transfer.start()
+        return transfer
+
+    def upload_transfer(self, name, first, count, start, send):
+        '''start an upload of count items from first, driven by requests
+        from the vehicle. Feed the requests to transfer.handle_request(idx)
+        and the final acknowledgement to transfer.handle_ack()'''
+        transfer = mp_transfer.UploadTransfer(name, first, count, start, send,
+                                              self.future('%s upload' % name),
+                                              self.mpstate.scheduler,
+                                              timeout=self.settings.xfertimeout,
+                                              progress=self.transfer_progress)
+        transfer.start()
+        return transfer
+
+    def transfer_progress(self, transfer):
+        '''report the progress of a point transfer'''
+        self.console.writeln(transfer.status())
+
+    def add_message_types(self, types):
+        '''subscribe to a list of MAVLink message types for
+        mavlink_packet(). Use '*' to receive all message types'''
+        if getattr(self, 'message_types', None) is None:
+            self.message_types = set()
+        self.message_types.update(types)
+        self.mpstate.module_dispatch.clear()
+
+    def remove_message_types(self, types):
+        '''unsubscribe from a list of MAVLink message types'''
+        if getattr(self, 'message_types', None) is None:
+            self.message_types = set()
+        self.message_types.difference_update(types)
+        self.mpstate.module_dispatch.clear()
+
+    def wants_message(self, mtype):
+        '''return True if this module should see messages of type mtype'''
+        types = getattr(self, 'message_types', None)
+        if types is None or '*' in types:
+            return True
+        return mtype in types
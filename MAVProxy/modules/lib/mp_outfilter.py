@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+'''
+per-output message filters for MAVProxy
+
+A filter holds a rule for each message type: drop it, or limit it to a
+maximum rate. Types without a rule are passed, or dropped if the
+filter is in 'only' mode. Checking a packet costs a dict lookup, plus a
+time check for rate limited types.
+'''
+
+import fnmatch, time
+
+class OutputFilter(object):
+    '''message type filter and rate limiter for one output'''
+    def __init__(self):
+        # mtype -> minimum interval in seconds, or None to drop
+        self.rules = {}
+        # mtype -> earliest time the next packet may be sent
+        self.next_send = {}
+        # pass types without a rule
+        self.default_allow = True
+        self.passed = 0
+        self.dropped = 0
+
+    def set_rate(self, mtype, rate):
+        '''limit mtype to rate Hz'''
+        self.rules[mtype] = 1.0 / rate
+        self.next_send.pop(mtype, None)
+
+    def drop(self, mtype):
+        '''drop all packets of type mtype'''
+        self.rules[mtype] = None
+
+    def allow(self, mtype):
+        '''remove any rule for mtype. In 'only' mode this passes all
+        packets of that type'''
+        if self.default_allow:
+            self.rules.pop(mtype, None)
+        else:
+            self.rules[mtype] = 0
+        self.next_send.pop(mtype, None)
+
+    def only(self, mtypes):
+        '''pass only the listed types, at full rate'''
+        self.default_allow = False
+        self.rules = {}
+        self.next_send = {}
+        for mtype in mtypes:
+            self.rules[mtype] = 0
+
+    def check(self, mtype):
+        '''return True if a packet of type mtype should be sent'''
+        if not mtype in self.rules:
+            if self.default_allow:
+                self.passed += 1
+                return True
+            self.dropped += 1
+            return False
+        interval = self.rules[mtype]
+        if interval is None:
+            self.dropped += 1
+            return False
+        if interval == 0:
+            self.passed += 1
+            return True
+        tnow = time.time()
+        t = self.next_send.get(mtype, 0)
+        if tnow < t:
+            self.dropped += 1
+            return False
+        # keep to the average rate when packets arrive with jitter, but
+        # don't build up credit after a gap
+        if tnow - t < interval:
+            self.next_send[mtype] = t + interval
+        else:
+            self.next_send[mtype] = tnow + interval
+        self.passed += 1
+        return True
+
+    def describe(self):
+        '''return a list of rule descriptions'''
+        ret = []
+        if not self.default_allow:
+            ret.append('only listed types')
+        for mtype in sorted(self.rules.keys()):
+            interval = self.rules[mtype]
+            if interval is None:
+                ret.append('%s drop' % mtype)
+            elif interval == 0:
+                ret.append('%s allow' % mtype)
+            else:
+                ret.append('%s %.1fHz' % (mtype, 1.0/interval))
+        return ret
+
+
+def match_types(pattern, names):
+    '''expand a message type pattern such as RAW_* against a list of
+    known message names'''
+    pattern = pattern.upper()
+    if not any([c in pattern for c in '*?[']):
+        return [pattern]
+    return sorted([n for n in names if fnmatch.fnmatch(n, pattern)])
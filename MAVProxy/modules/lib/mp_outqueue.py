@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+'''
+outbound queues for MAVProxy output links
+
+Each output gets a bounded queue of frames. The queue is flushed once per
+main loop pass, coalescing the queued frames into as few writes (or
+datagrams) as the transport allows, and is only written to when it
+won't block, so a slow output can't stall the rest of MAVProxy.
+'''
+
+import os, errno, socket
+from collections import deque
+from pymavlink import mavutil
+
+# largest UDP datagram we build when coalescing frames
+UDP_MAX_DATAGRAM = 1400
+# largest single write on a stream transport
+STREAM_MAX_WRITE = 16384
+
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+# message priorities for the 'priority' drop policy. High rate sensor
+# data goes first, link and protocol messages are dropped last
+message_priority = {
+    'HEARTBEAT'        : PRIORITY_HIGH,
+    'STATUSTEXT'       : PRIORITY_HIGH,
+    'SYS_STATUS'       : PRIORITY_HIGH,
+    'COMMAND_LONG'     : PRIORITY_HIGH,
+    'COMMAND_ACK'      : PRIORITY_HIGH,
+    'PARAM_VALUE'      : PRIORITY_HIGH,
+    'PARAM_SET'        : PRIORITY_HIGH,
+    'MISSION_COUNT'    : PRIORITY_HIGH,
+    'MISSION_ITEM'     : PRIORITY_HIGH,
+    'MISSION_REQUEST'  : PRIORITY_HIGH,
+    'MISSION_ACK'      : PRIORITY_HIGH,
+    'MISSION_CURRENT'  : PRIORITY_HIGH,
+    'WAYPOINT_COUNT'   : PRIORITY_HIGH,
+    'WAYPOINT'         : PRIORITY_HIGH,
+    'WAYPOINT_REQUEST' : PRIORITY_HIGH,
+    'WAYPOINT_ACK'     : PRIORITY_HIGH,
+    'WAYPOINT_CURRENT' : PRIORITY_HIGH,
+    'FENCE_POINT'      : PRIORITY_HIGH,
+    'RALLY_POINT'      : PRIORITY_HIGH,
+    'LOG_ENTRY'        : PRIORITY_HIGH,
+    'LOG_DATA'         : PRIORITY_HIGH,
+    'SERIAL_CONTROL'   : PRIORITY_HIGH,
+    'ATTITUDE'         : PRIORITY_LOW,
+    'RAW_IMU'          : PRIORITY_LOW,
+    'SCALED_IMU'       : PRIORITY_LOW,
+    'SCALED_IMU2'      : PRIORITY_LOW,
+    'SCALED_PRESSURE'  : PRIORITY_LOW,
+    'RAW_PRESSURE'     : PRIORITY_LOW,
+    'RC_CHANNELS_RAW'  : PRIORITY_LOW,
+    'SERVO_OUTPUT_RAW' : PRIORITY_LOW,
+    'SENSOR_OFFSETS'   : PRIORITY_LOW,
+    'AHRS'             : PRIORITY_LOW,
+    'AHRS2'            : PRIORITY_LOW,
+    'HWSTATUS'         : PRIORITY_LOW,
+    'MEMINFO'          : PRIORITY_LOW,
+    'SIMSTATE'         : PRIORITY_LOW,
+    'VIBRATION'        : PRIORITY_LOW,
+    }
+
+class OutputQueue(object):
+    '''bounded, non-blocking outbound queue for a mavlink connection'''
+    def __init__(self, conn, reactor, maxbytes=8192, policy='oldest'):
+        self.conn = conn
+        self.reactor = reactor
+        self.maxbytes = maxbytes
+        self.policy = policy
+        self.queue = deque()
+        self.qbytes = 0
+        # bytes of a coalesced write that the transport only partly took
+        self.pending = ''
+        self.writer_fd = None
+        self.nonblock_fd = None
+        self.frames = 0
+        self.writes = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.queue) + (len(self.pending) != 0)
+
+    def push(self, buf, mtype=None):
+        '''queue a frame for sending'''
+        prio = message_priority.get(mtype, PRIORITY_NORMAL)
+        # newer pymavlink gives us a bytearray
+        self.queue.append((str(buf), prio))
+        self.qbytes += len(buf)
+        while self.qbytes > self.maxbytes and self.queue:
+            self._drop()
+
+    def _drop(self):
+        '''drop one frame according to the drop policy'''
+        if self.policy == 'priority':
+            lowest = min([p for (b, p) in self.queue])
+            for i in range(len(self.queue)):
+                if self.queue[i][1] == lowest:
+                    (buf, prio) = self.queue[i]
+                    del self.queue[i]
+                    break
+        else:
+            (buf, prio) = self.queue.popleft()
+        self.qbytes -= len(buf)
+        self.dropped += 1
+
+    def _coalesce(self, limit):
+        '''take queued frames up to limit bytes as one buffer'''
+        bufs = []
+        n = 0
+        while self.queue:
+            buf = self.queue[0][0]
+            if bufs and n + len(buf) > limit:
+                break
+            self.queue.popleft()
+            bufs.append(buf)
+            n += len(buf)
+        self.qbytes -= n
+        self.frames += len(bufs)
+        return ''.join(bufs)
+
+    def _write_stream(self, data):
+        '''write to a stream transport, returning the number of bytes taken'''
+        conn = self.conn
+        if isinstance(conn, mavutil.mavtcp) and conn.port is not None:
+            try:
+                return conn.port.send(data)
+            except socket.error as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    return 0
+                # let pymavlink deal with the disconnect
+                conn.write(data)
+                return len(data)
+        fd = getattr(conn, 'fd', None)
+        if isinstance(conn, mavutil.mavserial) and fd is not None:
+            if self.nonblock_fd != fd:
+                import fcntl
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+                self.nonblock_fd = fd
+            try:
+                return os.write(fd, data)
+            except OSError as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    return 0
+                conn.write(data)
+                return len(data)
+        conn.write(data)
+        return len(data)
+
+    def flush(self, arg=None):
+        '''write as much as the transport will take without blocking'''
+        if isinstance(self.conn, mavutil.mavudp):
+            while self.queue:
+                data = self._coalesce(UDP_MAX_DATAGRAM)
+                self.conn.write(data)
+                self.writes += 1
+                self.bytes += len(data)
+        else:
+            while self.pending or self.queue:
+                if not self.pending:
+                    self.pending = self._coalesce(STREAM_MAX_WRITE)
+                n = self._write_stream(self.pending)
+                if n <= 0:
+                    break
+                self.writes += 1
+                self.bytes += n
+                self.pending = self.pending[n:]
+        self._update_writer()
+
+    def _update_writer(self):
+        '''only ask for writable events while we have data waiting'''
+        fd = getattr(self.conn, 'fd', None)
+        want = fd if (len(self) != 0 and self.reactor is not None) else None
+        if want == self.writer_fd:
+            return
+        if self.writer_fd is not None:
+            self.reactor.remove_writer(self.writer_fd)
+        if want is not None:
+            self.reactor.add_writer(want, self.flush, None)
+        self.writer_fd = want
+
+    def stats(self):
+        '''return a one line summary of the queue'''
+        return "%u queued (%u bytes), %u frames in %u writes, %u dropped" % (
+            len(self.queue), self.qbytes + len(self.pending),
+            self.frames, self.writes, self.dropped)
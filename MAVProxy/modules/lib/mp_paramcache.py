@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+'''
+on-disk parameter cache for MAVProxy
+
+Fetching every parameter over a slow radio takes a long time, and they
+rarely change between connections. The parameters of each vehicle are
+kept in ~/.mavproxy, keyed by its system ID, autopilot and vehicle
+type. On connect the cache is loaded straight into the parameter list,
+then a sample of the parameters is fetched by index and compared with
+it. The full list is only fetched if a sampled parameter has a
+different name or value, or the vehicle has a different number of
+parameters, which is what happens after a firmware change.
+'''
+
+import os, random, time
+
+from MAVProxy.modules.lib import mp_util
+
+def cache_path(sysid, autopilot, mav_type):
+    '''return the cache file for a vehicle'''
+    return mp_util.dot_mavproxy("params-%u-%u-%u.parm" % (sysid, autopilot, mav_type))
+
+
+class ParamCache(object):
+    '''the cached parameters of one vehicle'''
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        # index -> (name, value)
+        self.params = {}
+        # name -> index
+        self.index = {}
+        self.dirty = False
+        self.last_save = 0
+
+    def clear(self):
+        '''forget all cached parameters'''
+        self.count = 0
+        self.params = {}
+        self.index = {}
+        self.dirty = False
+
+    def complete(self):
+        '''return True if every parameter is cached'''
+        return self.count > 0 and len(self.params) == self.count
+
+    def load(self):
+        '''load the cache, returning False if there is no complete cache'''
+        self.clear()
+        try:
+            f = open(self.path)
+        except IOError:
+            return False
+        count = None
+        try:
+            for line in f:
+                a = line.split()
+                if line.startswith('#'):
+                    if len(a) == 3 and a[1] == 'count':
+                        count = int(a[2])
+                    continue
+                if len(a) != 3:
+                    continue
+                self.params[int(a[0])] = (a[1], float(a[2]))
+                self.index[a[1]] = int(a[0])
+        except ValueError:
+            count = None
+        f.close()
+        if count is None:
+            self.clear()
+            return False
+        self.count = count
+        if not self.complete():
+            self.clear()
+            return False
+        return True
+
+    def save(self):
+        '''write the cache, replacing the file in one step so a crash
+        can't leave it half written'''
+        tmp = self.path + '.tmp'
+        f = open(tmp, mode='w')
+        f.write("# count %u\n" % self.count)
+        for idx in sorted(self.params.keys()):
+            (name, value) = self.params[idx]
+            f.write("%u %s %r\n" % (idx, name, value))
+        f.close()
+        os.rename(tmp, self.path)
+        self.dirty = False
+        self.last_save = time.time()
+
+    def remove(self):
+        '''delete the cache file'''
+        self.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def set(self, idx, name, value, count):
+        '''note a parameter value from the vehicle. Replies to a set may
+        not carry the index, so they are matched by name'''
+        if count > 0 and count != self.count:
+            self.count = count
+            self.dirty = True
+        if idx < 0 or idx >= self.count:
+            if not name in self.index:
+                return
+            idx = self.index[name]
+        if self.params.get(idx, None) != (name, value):
+            old = self.params.get(idx, None)
+            if old is not None and old[0] != name:
+                self.index.pop(old[0], None)
+            self.params[idx] = (name, value)
+            self.index[name] = idx
+            self.dirty = True
+
+    def matches(self, idx, name, value, count):
+        '''return True if a parameter from the vehicle matches the cache'''
+        return count == self.count and self.params.get(idx, None) == (name, value)
+
+    def sample(self, n):
+        '''return the indexes of up to n parameters to check. The last is
+        always included, as added parameters are often at the end'''
+        n = min(max(n, 1), self.count)
+        indexes = set(random.sample(range(self.count - 1), n - 1))
+        indexes.add(self.count - 1)
+        return indexes
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+'''
+compiled parameter documentation for MAVProxy
+
+The parameter documentation fetched by 'param download' is an XML file
+of several megabytes, which is slow to parse. It is compiled once into
+a pickled index of each parameter's description, units, range and
+values, which loads in a fraction of the time. The index is rebuilt if
+the XML file is newer.
+'''
+
+import os, bisect, fnmatch, cPickle
+from collections import namedtuple
+
+from MAVProxy.modules.lib import mp_util
+
+# bumped when the layout of the compiled index changes
+VERSION = 1
+
+ParamDoc = namedtuple('ParamDoc', ['name', 'human_name', 'documentation', 'units', 'range', 'values'])
+
+class ParamDocs(object):
+    '''documentation for a vehicle's parameters, by name'''
+    def __init__(self, params):
+        self.params = params
+        self.names = sorted(params.keys())
+
+    def get(self, name):
+        '''return the ParamDoc for a parameter, or None'''
+        return self.params.get(name.upper(), None)
+
+    def complete(self, prefix):
+        '''return the parameter names starting with prefix'''
+        prefix = prefix.upper()
+        i = bisect.bisect_left(self.names, prefix)
+        ret = []
+        while i < len(self.names) and self.names[i].startswith(prefix):
+            ret.append(self.names[i])
+            i += 1
+        return ret
+
+    def check(self, name, value):
+        '''return a message if value is outside the documented range of
+        a parameter, or None'''
+        doc = self.get(name)
+        if doc is None or doc.range is None:
+            return None
+        (low, high) = doc.range
+        if value < low or value > high:
+            return "%s %f outside range %g to %g" % (name, value, low, high)
+        return None
+
+    def check_file(self, filename, wildcard='*'):
+        '''return messages for the values in a parameter file that are
+        outside their documented ranges'''
+        ret = []
+        f = open(filename, mode='r')
+        for line in f:
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            a = line.replace(',', ' ').split()
+            if len(a) != 2 or not fnmatch.fnmatch(a[0].upper(), wildcard.upper()):
+                continue
+            try:
+                value = float(a[1])
+            except ValueError:
+                continue
+            msg = self.check(a[0], value)
+            if msg is not None:
+                ret.append(msg)
+        f.close()
+        return ret
+
+def store_path(xml_path):
+    '''return the compiled index for a documentation file'''
+    return os.path.splitext(xml_path)[0] + '.pdoc'
+
+def parse_range(text):
+    '''parse a "min max" range, returning None if it isn't one'''
+    try:
+        (low, high) = [float(v) for v in text.split()]
+    except ValueError:
+        return None
+    return (low, high)
+
+def parse_param(name, p):
+    '''make a ParamDoc from a param element'''
+    units = None
+    prange = None
+    for field in p.findall('field'):
+        if field.get('name') == 'Units':
+            units = field.text
+        elif field.get('name') == 'Range' and field.text:
+            prange = parse_range(field.text)
+    values = [(v.get('code'), v.text) for v in p.findall('values/value')]
+    return ParamDoc(name, p.get('humanName'), p.get('documentation'), units, prange, values)
+
+def compile_docs(xml_path):
+    '''parse a documentation file and write its compiled index,
+    returning a ParamDocs'''
+    from xml.etree import cElementTree as ElementTree
+    root = ElementTree.parse(xml_path).getroot()
+    params = {}
+    for group in root.findall('vehicles/parameters'):
+        for p in group.findall('param'):
+            # vehicle parameters are named VEHICLE:NAME
+            name = p.get('name').split(':')[-1]
+            params[name] = parse_param(name, p)
+    for group in root.findall('libraries/parameters'):
+        for p in group.findall('param'):
+            name = p.get('name')
+            params[name] = parse_param(name, p)
+    path = store_path(xml_path)
+    # the documentation may be compiled by a download process and by
+    # MAVProxy at the same time
+    tmp = '%s.%u.tmp' % (path, os.getpid())
+    f = open(tmp, mode='wb')
+    cPickle.dump((VERSION, params), f, cPickle.HIGHEST_PROTOCOL)
+    f.close()
+    os.rename(tmp, path)
+    return ParamDocs(params)
+
+def load_docs(xml_path):
+    '''return the ParamDocs for a documentation file, compiling it if
+    there is no up to date index'''
+    path = store_path(xml_path)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(xml_path):
+            f = open(path, mode='rb')
+            (version, params) = cPickle.load(f)
+            f.close()
+            if version == VERSION:
+                return ParamDocs(params)
+    except Exception:
+        pass
+    return compile_docs(xml_path)
+
+def download_docs(files):
+    '''download documentation files, given as (url, path) pairs, and
+    compile the XML ones. Run in a child process by param download'''
+    mp_util.download_files(files)
+    for (url, path) in files:
+        if path.endswith('.xml') and os.path.exists(path):
+            try:
+                compile_docs(path)
+            except Exception as e:
+                print("Failed to compile %s: %s" % (path, e))
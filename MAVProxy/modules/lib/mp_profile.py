@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+'''
+profiling of a running MAVProxy
+
+Two modes are available. The sampling profiler looks at the stacks of
+the chosen threads from a background thread every few milliseconds,
+which costs the profiled threads almost nothing, so it is safe to use
+in flight. Its results are written as collapsed stacks, the input
+format of flamegraph.pl. The cprofile mode uses the deterministic
+cProfile profiler on the thread that starts it, which is much more
+intrusive, and writes pstats files.
+'''
+
+import sys, os, time, threading
+
+class SamplingProfiler(object):
+    '''periodically sample the stacks of a set of threads'''
+    def __init__(self, threads, interval=0.005):
+        self.threads = threads
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self.running = False
+        self.thread = None
+        self.start_time = None
+        self.elapsed = 0
+
+    def _frame_name(self, frame):
+        code = frame.f_code
+        return "%s (%s:%u)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+    def _sample(self):
+        '''record the current stack of each profiled thread'''
+        frames = sys._current_frames()
+        for th in self.threads:
+            frame = frames.get(th.ident, None)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            stack.append(th.name)
+            stack.reverse()
+            key = ';'.join(stack)
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        while self.running:
+            self._sample()
+            time.sleep(self.interval)
+
+    def start(self):
+        '''start sampling'''
+        self.running = True
+        self.start_time = time.time()
+        self.thread = threading.Thread(target=self._run, name='profiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''stop sampling'''
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.elapsed += time.time() - self.start_time
+
+    def dump(self, filename):
+        '''write collapsed stacks for flamegraph.pl'''
+        f = open(filename, 'w')
+        for (stack, count) in sorted(self.counts.items()):
+            f.write("%s %u\n" % (stack, count))
+        f.close()
+
+    def summary(self, f, count=20):
+        '''write the functions with the most samples at the top of the stack'''
+        total = {}
+        for (stack, n) in self.counts.items():
+            func = stack.split(';')[-1]
+            total[func] = total.get(func, 0) + n
+        f.write("%u samples over %.1fs\n" % (self.samples, self.elapsed))
+        for (func, n) in sorted(total.items(), key=lambda x: -x[1])[:count]:
+            f.write("%6.2f%% %s\n" % (100.0 * n / max(self.samples, 1), func))
+
+
+class DeterministicProfiler(object):
+    '''cProfile the thread that starts the profiler'''
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.running = False
+
+    def start(self):
+        self.profile.enable()
+        self.running = True
+
+    def stop(self):
+        self.profile.disable()
+        self.running = False
+
+    def dump(self, filename):
+        '''write a pstats file'''
+        self.profile.dump_stats(filename)
+
+    def summary(self, f, count=20):
+        '''write the functions with the most cumulative time'''
+        import pstats
+        stats = pstats.Stats(self.profile, stream=f)
+        stats.sort_stats('cumulative').print_stats(count)
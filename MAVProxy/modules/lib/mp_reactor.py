@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+'''
+file descriptor event loop for MAVProxy
+
+This uses epoll where available (Linux), falling back to poll() and
+then select(). Handlers are kept in a fd -> (fn, args) map so a ready
+fd is dispatched without scanning the link lists.
+'''
+
+import os, select, errno, time, math
+
+READ = 1
+WRITE = 4
+
+class Reactor(object):
+    '''dispatch events on file descriptors to registered handlers'''
+    def __init__(self):
+        self.readers = {}
+        self.writers = {}
+        # fds that can't be polled (eg. regular files) are always ready
+        self.always_ready = set()
+        if hasattr(select, 'epoll'):
+            self.backend = 'epoll'
+            self.poller = select.epoll()
+            self.err_mask = select.EPOLLERR | select.EPOLLHUP
+        elif hasattr(select, 'poll'):
+            self.backend = 'poll'
+            self.poller = select.poll()
+            self.err_mask = select.POLLERR | select.POLLHUP | select.POLLNVAL
+        else:
+            self.backend = 'select'
+            self.poller = None
+            self.err_mask = 0
+        self.registered = {}
+
+        # a pipe so other threads can wake us up from poll()
+        self.wakeup_fd = None
+        if os.name != 'nt':
+            import fcntl
+            (rfd, wfd) = os.pipe()
+            for fd in [rfd, wfd]:
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+            self.wakeup_fd = wfd
+            self.add_reader(rfd, self._drain_wakeup, rfd)
+
+    def can_wakeup(self):
+        '''return True if wakeup() can interrupt a poll from another thread'''
+        return self.wakeup_fd is not None
+
+    def wakeup(self):
+        '''wake up a poll() in progress. Safe to call from any thread'''
+        if self.wakeup_fd is None:
+            return
+        try:
+            os.write(self.wakeup_fd, 'x')
+        except OSError:
+            # pipe full, so a wakeup is already pending
+            pass
+
+    def _drain_wakeup(self, fd):
+        '''empty the wakeup pipe'''
+        try:
+            while len(os.read(fd, 256)) == 256:
+                pass
+        except OSError:
+            pass
+
+    def _update(self, fd):
+        '''update the poller registration for a fd'''
+        mask = 0
+        if fd in self.readers:
+            mask |= READ
+        if fd in self.writers:
+            mask |= WRITE
+        if self.poller is None or fd in self.always_ready:
+            if mask == 0:
+                self.always_ready.discard(fd)
+            return
+        try:
+            if mask == 0:
+                if fd in self.registered:
+                    self.registered.pop(fd)
+                    self.poller.unregister(fd)
+            elif fd in self.registered:
+                if self.registered[fd] != mask:
+                    self.poller.modify(fd, mask)
+                    self.registered[fd] = mask
+            else:
+                self.poller.register(fd, mask)
+                self.registered[fd] = mask
+        except (IOError, OSError) as e:
+            if e.errno == errno.EPERM:
+                # epoll refuses regular files, which are always readable
+                self.registered.pop(fd, None)
+                self.always_ready.add(fd)
+            elif e.errno not in [errno.EBADF, errno.ENOENT]:
+                raise
+            else:
+                # the fd was closed under us
+                self.registered.pop(fd, None)
+
+    def add_reader(self, fd, fn, args):
+        '''call fn(args) when fd is readable'''
+        self.readers[fd] = (fn, args)
+        self._update(fd)
+
+    def remove_reader(self, fd):
+        '''stop watching fd for reading'''
+        if fd in self.readers:
+            self.readers.pop(fd)
+            self._update(fd)
+
+    def add_writer(self, fd, fn, args):
+        '''call fn(args) when fd is writable'''
+        self.writers[fd] = (fn, args)
+        self._update(fd)
+
+    def remove_writer(self, fd):
+        '''stop watching fd for writing'''
+        if fd in self.writers:
+            self.writers.pop(fd)
+            self._update(fd)
+
+    def _events(self, timeout):
+        '''wait for events, returning a list of (fd, mask)'''
+        if self.always_ready:
+            timeout = 0
+        # epoll and poll truncate to milliseconds, so round up to avoid
+        # spinning for the last millisecond before a timer is due
+        msec = int(math.ceil(timeout * 1000))
+        if self.backend == 'epoll':
+            return self.poller.poll(msec * 0.001)
+        if self.backend == 'poll':
+            return self.poller.poll(msec)
+        rin = self.readers.keys()
+        win = self.writers.keys()
+        if not rin and not win:
+            time.sleep(timeout)
+            return []
+        (rin, win, xin) = select.select(rin, win, [], timeout)
+        events = {}
+        for fd in rin:
+            events[fd] = READ
+        for fd in win:
+            events[fd] = events.get(fd, 0) | WRITE
+        return events.items()
+
+    def poll(self, timeout):
+        '''wait up to timeout seconds, then call the handlers of ready fds'''
+        try:
+            events = self._events(max(timeout, 0))
+        except (select.error, IOError, OSError) as e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        if self.always_ready:
+            events = list(events)
+            for fd in self.always_ready:
+                events.append((fd, READ))
+        for (fd, mask) in events:
+            if mask & (READ | self.err_mask) and fd in self.readers:
+                (fn, args) = self.readers[fd]
+                fn(args)
+            if mask & WRITE and fd in self.writers:
+                (fn, args) = self.writers[fd]
+                fn(args)
+
+
+class SelectExtra(dict):
+    '''fd -> (fn, args) map of module file descriptors for the main
+    loop. Entries are registered with the reactor as they are added, and
+    a handler that raises an exception is removed'''
+    def __init__(self, reactor, on_error=None):
+        dict.__init__(self)
+        self.reactor = reactor
+        self.on_error = on_error
+
+    def __setitem__(self, fd, value):
+        dict.__setitem__(self, fd, value)
+        self.reactor.add_reader(fd, self._call, fd)
+
+    def __delitem__(self, fd):
+        dict.__delitem__(self, fd)
+        self.reactor.remove_reader(fd)
+
+    def pop(self, fd, *args):
+        ret = dict.pop(self, fd, *args)
+        self.reactor.remove_reader(fd)
+        return ret
+
+    def _call(self, fd):
+        '''call the registered read function'''
+        if not fd in self:
+            return
+        (fn, args) = self[fd]
+        try:
+            fn(args)
+        except Exception, msg:
+            if self.on_error is not None:
+                self.on_error(msg)
+            # on an exception, remove it from the select list
+            self.pop(fd, None)
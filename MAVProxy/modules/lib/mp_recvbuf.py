@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+'''
+per-link receive buffer for MAVProxy
+
+Each master link gets a preallocated buffer which is filled by reading
+until the link would block (or the buffer is full), so all the UDP
+datagrams queued since the last wakeup are handled in one pass without
+allocating a new string per read.
+'''
+
+import errno, socket
+from pymavlink import mavutil
+
+# room we keep free for a UDP read, as recvfrom_into() silently
+# truncates a datagram that doesn't fit
+UDP_MAX_PACKET = 65535
+
+class LinkDead(Exception):
+    '''the link reported data ready but gave us nothing, or failed'''
+    pass
+
+class ReceiveBuffer(object):
+    '''drain a mavlink connection into a preallocated buffer'''
+    def __init__(self, conn, size=2*UDP_MAX_PACKET):
+        self.conn = conn
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.reads = 0
+        self.drains = 0
+        self.bytes = 0
+
+    def _recv_into(self, ofs):
+        '''read into the buffer at ofs, returning the number of bytes
+        read, or None if the link would block'''
+        conn = self.conn
+        space = len(self.buf) - ofs
+        if isinstance(conn, mavutil.mavudp):
+            if space < UDP_MAX_PACKET:
+                return None
+            try:
+                (n, addr) = conn.port.recvfrom_into(self.view[ofs:])
+            except socket.error as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNREFUSED]:
+                    return None
+                raise
+            if conn.udp_server or getattr(conn, 'broadcast', False):
+                conn.last_address = addr
+            return n
+        if isinstance(conn, mavutil.mavtcp) and conn.port is not None:
+            try:
+                n = conn.port.recv_into(self.view[ofs:])
+            except socket.error as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    return None
+                raise
+            if n == 0:
+                # EOF, let pymavlink reconnect
+                conn.recv()
+                raise LinkDead()
+            return n
+        # other links (serial, files) use the normal recv()
+        s = conn.recv(min(space, 16*1024))
+        if len(s) == 0:
+            return None
+        self.buf[ofs:ofs+len(s)] = s
+        return len(s)
+
+    def drain(self):
+        '''read until the link would block or the buffer is full,
+        returning the data. Raises LinkDead if the link gave no data'''
+        ofs = 0
+        try:
+            while ofs < len(self.buf):
+                n = self._recv_into(ofs)
+                if n is None:
+                    break
+                self.reads += 1
+                ofs += n
+        except LinkDead:
+            raise
+        except Exception:
+            if ofs == 0:
+                raise LinkDead()
+        if ofs == 0:
+            raise LinkDead()
+        self.drains += 1
+        self.bytes += ofs
+        return str(self.buf[:ofs])
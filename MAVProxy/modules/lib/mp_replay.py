@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+'''
+telemetry log replay for MAVProxy
+
+A recorded tlog is played back as if it were a live master link, using
+the logged timestamps to space the packets out at 1x, Nx or as fast as
+possible. Seeking uses the log's sidecar index when it has one, and
+otherwise scans the log from the start.
+'''
+
+import gzip, time, struct
+
+from pymavlink import mavutil
+from MAVProxy.modules.lib import mp_frame, mp_tlogindex
+
+class ReplayLink(mavutil.mavlogfile):
+    '''a master link reading from a log. Anything sent to the vehicle is
+    discarded'''
+    def __init__(self, filename):
+        mavutil.mavlogfile.__init__(self, filename)
+        self.sent = 0
+
+    def write(self, buf):
+        self.sent += 1
+
+
+class TlogReader(object):
+    '''read (timestamp, frame) records from a tlog'''
+    def __init__(self, filename):
+        if filename.endswith('.gz'):
+            self.f = gzip.open(filename, 'rb')
+        else:
+            self.f = open(filename, 'rb')
+        self.offset = 0
+        self.pushback = ''
+        self.bad_bytes = 0
+
+    def _read(self, n):
+        if self.pushback:
+            s = self.pushback[:n]
+            self.pushback = self.pushback[n:]
+            if len(s) < n:
+                s += self.f.read(n - len(s))
+        else:
+            s = self.f.read(n)
+        self.offset += len(s)
+        return s
+
+    def _unread(self, s):
+        self.pushback = s + self.pushback
+        self.offset -= len(s)
+
+    def seek(self, offset):
+        '''move to a record at offset'''
+        self.f.seek(offset)
+        self.offset = offset
+        self.pushback = ''
+
+    def read_record(self):
+        '''return the next (time, frame) record, or None at the end of
+        the log'''
+        while True:
+            hdr = self._read(10)
+            if len(hdr) < 10:
+                return None
+            magic = hdr[8]
+            if magic == mp_frame.MAGIC_V1:
+                flen = ord(hdr[9]) + 8
+            elif magic == mp_frame.MAGIC_V2:
+                flen = ord(hdr[9]) + 12
+            else:
+                # not a record, resync a byte at a time
+                self._unread(hdr[1:])
+                self.bad_bytes += 1
+                continue
+            rest = self._read(flen - 2)
+            if len(rest) < flen - 2:
+                return None
+            if magic == mp_frame.MAGIC_V2 and ord(rest[0]) & mp_frame.MAVLINK_IFLAG_SIGNED:
+                sig = self._read(mp_frame.SIGNATURE_LEN)
+                if len(sig) < mp_frame.SIGNATURE_LEN:
+                    return None
+                rest += sig
+            (tusec,) = struct.unpack('>Q', hdr[:8])
+            return (tusec * 1.0e-6, hdr[8:] + rest)
+
+
+class Replay(object):
+    '''play back the records of a tlog against the wall clock'''
+    def __init__(self, filename, speed=1.0):
+        self.filename = filename
+        self.reader = TlogReader(filename)
+        self.index = None
+        if not filename.endswith('.gz'):
+            self.index = mp_tlogindex.load(filename)
+        self.speed = speed
+        self.paused = False
+        self.records = 0
+        self.next_rec = self.reader.read_record()
+        self.start_time = None
+        if self.next_rec is not None:
+            self.start_time = self.next_rec[0]
+        # log time corresponding to base_wall
+        self.base_log = self.start_time
+        self.base_wall = time.time()
+        self.wall_start = self.base_wall
+
+    def finished(self):
+        return self.next_rec is None
+
+    def log_time(self, tnow):
+        '''return the log time being played at wall time tnow'''
+        if self.paused or self.speed <= 0:
+            return self.base_log
+        return self.base_log + (tnow - self.base_wall) * self.speed
+
+    def _rebase(self, log_time):
+        self.base_log = log_time
+        self.base_wall = time.time()
+
+    def due(self, tnow, max_records=100):
+        '''return the records that should have been played by wall time
+        tnow, up to max_records of them'''
+        ret = []
+        if self.paused:
+            return ret
+        t = self.log_time(tnow)
+        while self.next_rec is not None and len(ret) < max_records:
+            if self.speed > 0 and self.next_rec[0] > t:
+                break
+            ret.append(self.next_rec)
+            if self.speed <= 0:
+                self.base_log = self.next_rec[0]
+            self.next_rec = self.reader.read_record()
+        self.records += len(ret)
+        return ret
+
+    def delay(self, tnow):
+        '''return how long until the next record is due, or None if
+        nothing will be due until the replay is resumed or seeked'''
+        if self.paused or self.next_rec is None:
+            return None
+        if self.speed <= 0:
+            return 0
+        return max((self.next_rec[0] - self.log_time(tnow)) / self.speed, 0)
+
+    def set_speed(self, speed):
+        '''change the playback speed, 0 for as fast as possible'''
+        self._rebase(self.log_time(time.time()))
+        self.speed = speed
+
+    def pause(self):
+        self._rebase(self.log_time(time.time()))
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self._rebase(self.base_log)
+
+    def seek(self, t):
+        '''move to t seconds from the start of the log'''
+        if self.start_time is None:
+            return
+        target = self.start_time + t
+        if self.index is not None:
+            ofs = self.index.time_offset(target)
+        else:
+            ofs = 0
+        self.reader.seek(ofs)
+        self.next_rec = self.reader.read_record()
+        # step forward from the coarse position to the exact time
+        while self.next_rec is not None and self.next_rec[0] < target:
+            self.next_rec = self.reader.read_record()
+        self._rebase(target)
+
+    def position(self):
+        '''return the current position in seconds from the start of the log'''
+        if self.start_time is None:
+            return 0
+        return self.log_time(time.time()) - self.start_time
+
+    def status(self):
+        '''return a one line status'''
+        if self.finished():
+            state = 'finished'
+        elif self.paused:
+            state = 'paused'
+        elif self.speed <= 0:
+            state = 'playing as fast as possible'
+        else:
+            state = 'playing at %.2fx' % self.speed
+        return "%s: %s at %.1fs, %u packets" % (self.filename, state, self.position(), self.records)
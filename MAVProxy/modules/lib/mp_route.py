@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+'''
+system ID routing table for MAVProxy
+
+Routes are learned from the source (sysid, compid) of packets seen on
+each master and output link, and can be overridden with static routes.
+Messages with a target_system are only sent to the links that can reach
+the target, everything else is sent as before.
+'''
+
+import re, struct, time
+
+class RouteTable(object):
+    '''map of (sysid, compid) to the links they have been seen on'''
+    def __init__(self, timeout=30.0):
+        # learned routes older than this are ignored
+        self.timeout = timeout
+        # sysid -> compid -> link -> time last seen
+        self.learned = {}
+        # (sysid, compid) -> link, compid of 0 covers the whole system
+        self.static = {}
+
+    def learn(self, sysid, compid, link, tnow):
+        '''note that (sysid, compid) was heard on link'''
+        comps = self.learned.get(sysid, None)
+        if comps is None:
+            comps = {}
+            self.learned[sysid] = comps
+        links = comps.get(compid, None)
+        if links is None:
+            links = {}
+            comps[compid] = links
+        links[link] = tnow
+
+    def add_static(self, sysid, compid, link):
+        '''add a static route'''
+        self.static[(sysid, compid)] = link
+
+    def remove_static(self, sysid, compid):
+        '''remove a static route, returning False if there was none'''
+        return self.static.pop((sysid, compid), None) is not None
+
+    def remove_link(self, link):
+        '''forget all static and learned routes through a link'''
+        for (key, l) in self.static.items():
+            if l is link:
+                del self.static[key]
+        for (sysid, comps) in self.learned.items():
+            for (compid, links) in comps.items():
+                links.pop(link, None)
+                if len(links) == 0:
+                    del comps[compid]
+            if len(comps) == 0:
+                del self.learned[sysid]
+
+    def clear(self):
+        '''forget all learned routes'''
+        self.learned = {}
+
+    def lookup(self, sysid, compid):
+        '''return the list of links that can reach (sysid, compid), or
+        None if we don't know a route to it'''
+        if (sysid, compid) in self.static:
+            return [self.static[(sysid, compid)]]
+        if (sysid, 0) in self.static:
+            return [self.static[(sysid, 0)]]
+        comps = self.learned.get(sysid, None)
+        if comps is None:
+            return None
+        if compid != 0 and compid in comps:
+            tables = [comps[compid]]
+        else:
+            # a whole system, or a component we haven't heard from
+            tables = comps.values()
+        oldest = time.time() - self.timeout
+        ret = []
+        for links in tables:
+            for (link, t) in links.items():
+                if t >= oldest and not link in ret:
+                    ret.append(link)
+        if len(ret) == 0:
+            return None
+        return ret
+
+    def routes(self):
+        '''return a sorted list of (sysid, compid, link, age, static)'''
+        tnow = time.time()
+        ret = []
+        for ((sysid, compid), link) in self.static.items():
+            ret.append((sysid, compid, link, None, True))
+        for (sysid, comps) in self.learned.items():
+            for (compid, links) in comps.items():
+                for (link, t) in links.items():
+                    ret.append((sysid, compid, link, tnow - t, False))
+        return sorted(ret, key=lambda r: (r[0], r[1], not r[4], r[3]))
+
+
+class TargetFields(object):
+    '''find target_system and target_component in raw frames'''
+    def __init__(self, mavlink):
+        self.mavlink = mavlink
+        # msgid -> (target_system offset, target_component offset) or None
+        self.offsets = {}
+
+    def _field_offsets(self, msgid):
+        '''work out the payload offsets of the target fields'''
+        entry = self.mavlink.mavlink_map.get(msgid, None)
+        fieldnames = getattr(entry, 'ordered_fieldnames', None)
+        fmt = getattr(entry, 'format', None)
+        if fieldnames is None or fmt is None or not 'target_system' in fieldnames:
+            return None
+        tokens = re.findall(r'\d*[a-zA-Z]', fmt)
+        def offset(name):
+            if not name in fieldnames:
+                return None
+            return struct.calcsize('<' + ''.join(tokens[:fieldnames.index(name)]))
+        return (offset('target_system'), offset('target_component'))
+
+    def target(self, msgid, frame):
+        '''return (target_system, target_component) of a frame, or None
+        if the message isn't targeted'''
+        if not msgid in self.offsets:
+            self.offsets[msgid] = self._field_offsets(msgid)
+        ofs = self.offsets[msgid]
+        if ofs is None:
+            return None
+        if frame[0] == '\xfe':
+            hdrlen = 6
+        else:
+            hdrlen = 10
+        plen = ord(frame[1])
+        ret = []
+        for o in ofs:
+            # MAVLink2 trims trailing zero bytes from the payload
+            if o is None or o >= plen:
+                ret.append(0)
+            else:
+                ret.append(ord(frame[hdrlen+o]))
+        return tuple(ret)
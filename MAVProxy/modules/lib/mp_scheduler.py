@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+'''
+timer scheduler for MAVProxy
+
+Periodic and one-shot callbacks are kept in a heap ordered by deadline,
+so the main loop only has to look at the head of the heap to know when
+it next needs to wake up. Each task keeps deadline-miss statistics.
+'''
+
+import heapq, time
+
+class ScheduledTask(object):
+    '''a periodic or one-shot callback'''
+    def __init__(self, name, fn, period, deadline):
+        self.name = name
+        self.fn = fn
+        self.period = period
+        self.deadline = deadline
+        self.runs = 0
+        self.misses = 0
+        self.total_late = 0.0
+        self.max_late = 0.0
+        self.total_time = 0.0
+
+    def late_threshold(self):
+        '''how late a run can be before it counts as a missed deadline'''
+        if self.period:
+            return self.period * 0.5
+        return 0.05
+
+    def active(self):
+        '''return True if the task has not been cancelled or completed'''
+        return self.deadline is not None
+
+    def reset_stats(self):
+        '''reset timing statistics'''
+        self.runs = 0
+        self.misses = 0
+        self.total_late = 0.0
+        self.max_late = 0.0
+        self.total_time = 0.0
+
+
+class Scheduler(object):
+    '''run callbacks at their deadlines'''
+    def __init__(self, on_error=None):
+        self.heap = []
+        self.tasks = []
+        self.seq = 0
+        self.on_error = on_error
+
+    def _push(self, task):
+        self.seq += 1
+        heapq.heappush(self.heap, (task.deadline, self.seq, task))
+
+    def add_periodic(self, name, period, fn, delay=None):
+        '''call fn() every period seconds, first after delay seconds
+        (defaults to one period)'''
+        if delay is None:
+            delay = period
+        task = ScheduledTask(name, fn, period, time.time() + delay)
+        self.tasks.append(task)
+        self._push(task)
+        return task
+
+    def add_oneshot(self, name, delay, fn):
+        '''call fn() once after delay seconds'''
+        task = ScheduledTask(name, fn, 0, time.time() + delay)
+        self.tasks.append(task)
+        self._push(task)
+        return task
+
+    def set_period(self, task, period):
+        '''change the period of a periodic task'''
+        if period == task.period or not task.active():
+            return
+        task.period = period
+        deadline = time.time() + period
+        if deadline < task.deadline:
+            task.deadline = deadline
+            self._push(task)
+
+    def reschedule(self, task, delay):
+        '''move the next deadline of a task to delay seconds from now'''
+        if task not in self.tasks:
+            self.tasks.append(task)
+        task.deadline = time.time() + delay
+        self._push(task)
+
+    def cancel(self, task):
+        '''stop a task. Its heap entry is discarded when it reaches the top'''
+        task.deadline = None
+        if task in self.tasks:
+            self.tasks.remove(task)
+
+    def next_deadline(self):
+        '''return the time of the next deadline, or None'''
+        while self.heap:
+            (deadline, seq, task) = self.heap[0]
+            if deadline == task.deadline:
+                return deadline
+            # stale entry from a cancel or reschedule
+            heapq.heappop(self.heap)
+        return None
+
+    def run_pending(self):
+        '''run all tasks that are due'''
+        tnow = time.time()
+        while self.heap and self.heap[0][0] <= tnow:
+            (deadline, seq, task) = heapq.heappop(self.heap)
+            if deadline != task.deadline:
+                continue
+            late = tnow - deadline
+            task.runs += 1
+            task.total_late += late
+            if late > task.max_late:
+                task.max_late = late
+            if late > task.late_threshold():
+                task.misses += 1
+            if task.period:
+                # skip over any whole periods we missed rather than
+                # running the task several times in a row
+                task.deadline = deadline + task.period
+                if task.deadline <= tnow:
+                    task.deadline = tnow + task.period
+                self._push(task)
+            else:
+                self.cancel(task)
+            t1 = time.time()
+            try:
+                task.fn()
+            except Exception as e:
+                if self.on_error is None:
+                    raise
+                self.on_error(task, e)
+            task.total_time += time.time() - t1
+
+    def show(self, f):
+        '''write task statistics'''
+        f.write("%-24s %8s %8s %6s %9s %9s %9s\n" % ('Task', 'Period', 'Runs', 'Misses',
+                                                     'AvgLate', 'MaxLate', 'AvgRun'))
+        for task in sorted(self.tasks, key=lambda t: t.name):
+            runs = max(task.runs, 1)
+            f.write("%-24.24s %7.3fs %8u %6u %7.2fms %7.2fms %7.2fms\n" % (
+                task.name, task.period, task.runs, task.misses,
+                1000.0 * task.total_late / runs,
+                1000.0 * task.max_late,
+                1000.0 * task.total_time / runs))
+
+    def reset_stats(self):
+        '''reset statistics on all tasks'''
+        for task in self.tasks:
+            task.reset_stats()
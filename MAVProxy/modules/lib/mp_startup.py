@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+'''
+startup time measurement for MAVProxy
+
+With --startup-bench, MAVProxy notes the time of each startup phase,
+from process start to the first packet forwarded to an output, and
+times every import. The import timer replaces __import__, so it is only
+installed when benchmarking.
+'''
+
+import sys, os, time, thread
+
+def process_start_time():
+    '''return the time the process started, or None if it can't be found'''
+    try:
+        stat = open('/proc/self/stat').read()
+        # the command name can contain spaces, so split after it
+        fields = stat[stat.rindex(')')+2:].split()
+        ticks = float(fields[19])
+        for line in open('/proc/stat'):
+            if line.startswith('btime'):
+                return int(line.split()[1]) + ticks / os.sysconf('SC_CLK_TCK')
+    except Exception:
+        pass
+    return None
+
+
+class ImportTimer(object):
+    '''time each import, separating the time spent in nested imports'''
+    def __init__(self):
+        # name -> [count, total time, self time]
+        self.times = {}
+        # time spent in nested imports, for each import in progress
+        self.stack = []
+        self.orig_import = None
+        # only imports in the thread starting up are timed
+        self.thread = thread.get_ident()
+
+    def install(self):
+        import __builtin__
+        self.orig_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def uninstall(self):
+        import __builtin__
+        if self.orig_import is not None:
+            __builtin__.__import__ = self.orig_import
+            self.orig_import = None
+
+    def _import(self, name, *args, **kwargs):
+        if thread.get_ident() != self.thread:
+            return self.orig_import(name, *args, **kwargs)
+        t0 = time.time()
+        self.stack.append(0.0)
+        try:
+            return self.orig_import(name, *args, **kwargs)
+        finally:
+            dt = time.time() - t0
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += dt
+            entry = self.times.get(name, None)
+            if entry is None:
+                entry = [0, 0.0, 0.0]
+                self.times[name] = entry
+            entry[0] += 1
+            entry[1] += dt
+            entry[2] += dt - nested
+
+    def report(self, f, count=20):
+        '''write the imports that took the most time themselves'''
+        f.write("%-40s %6s %9s %9s\n" % ('Import', 'Count', 'Self(ms)', 'Total(ms)'))
+        for (name, (n, total, own)) in sorted(self.times.items(), key=lambda x: -x[1][2])[:count]:
+            f.write("%-40.40s %6u %9.1f %9.1f\n" % (name, n, own*1000, total*1000))
+
+
+class StartupTimer(object):
+    '''record the time of each startup phase'''
+    def __init__(self, enabled):
+        self.active = enabled
+        self.phases = []
+        self.start = None
+        self.imports = None
+        if not enabled:
+            return
+        self.start = process_start_time()
+        if self.start is None:
+            self.start = time.time()
+        self.imports = ImportTimer()
+        self.imports.install()
+
+    def phase(self, name):
+        '''note that a startup phase has finished'''
+        if self.active:
+            self.phases.append((name, time.time()))
+
+    def finish(self, name, f=sys.stdout):
+        '''note the last phase and write the report'''
+        if not self.active:
+            return
+        self.phase(name)
+        self.active = False
+        self.imports.uninstall()
+        f.write("Startup times from process start:\n")
+        last = self.start
+        for (pname, t) in self.phases:
+            f.write("  %-28s %8.1fms (+%.1fms)\n" % (pname, (t - self.start)*1000, (t - last)*1000))
+            last = t
+        self.imports.report(f)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+'''
+latency statistics for MAVProxy modules
+
+Call times are kept in histograms with power of two microsecond
+buckets, so recording a call is a couple of integer operations and
+percentiles can be estimated without keeping the samples.
+'''
+
+import time
+
+NUM_BUCKETS = 32
+
+class LatencyHistogram(object):
+    '''histogram of call durations'''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''clear the histogram'''
+        self.buckets = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, dt):
+        '''record a call that took dt seconds'''
+        # bucket n holds durations of 2^(n-1) to 2^n microseconds
+        b = int(dt * 1.0e6).bit_length()
+        if b >= NUM_BUCKETS:
+            b = NUM_BUCKETS - 1
+        self.buckets[b] += 1
+        self.count += 1
+        self.total += dt
+        if dt > self.max:
+            self.max = dt
+
+    def percentile(self, p):
+        '''estimate the p'th percentile in seconds, using the upper edge
+        of the bucket it falls in'''
+        if self.count == 0:
+            return 0.0
+        target = self.count * p / 100.0
+        n = 0
+        for b in range(NUM_BUCKETS):
+            n += self.buckets[b]
+            if n >= target:
+                return min((1 << b) * 1.0e-6, self.max)
+        return self.max
+
+    def mean(self):
+        '''average call time in seconds'''
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+
+class ModuleStats(object):
+    '''call statistics for one module'''
+    kinds = ['packet', 'idle', 'command']
+
+    def __init__(self):
+        self.packet = LatencyHistogram()
+        self.idle = LatencyHistogram()
+        self.command = LatencyHistogram()
+        self.errors = 0
+        self.start = time.time()
+
+    def reset(self):
+        '''clear all statistics'''
+        for k in self.kinds:
+            getattr(self, k).reset()
+        self.errors = 0
+        self.start = time.time()
+
+    def show(self, name, f):
+        '''write a line per call type'''
+        elapsed = max(time.time() - self.start, 0.001)
+        for k in self.kinds:
+            h = getattr(self, k)
+            if h.count == 0:
+                continue
+            f.write("%-12.12s %-7s %8u %8.1f/s %8.3f %8.3f %8.3f %8.3f %6.2f%%\n" % (
+                name, k, h.count, h.count / elapsed,
+                h.mean()*1000, h.percentile(50)*1000, h.percentile(99)*1000,
+                h.max*1000, 100.0 * h.total / elapsed))
+        if self.errors:
+            f.write("%-12.12s %u exceptions\n" % (name, self.errors))
+
+
+def show_header(f):
+    '''write the column headings for ModuleStats.show()'''
+    f.write("%-12s %-7s %8s %10s %8s %8s %8s %8s %7s\n" % (
+        'Module', 'Call', 'Count', 'Rate', 'Mean', 'P50', 'P99', 'Max', 'Load'))
+    f.write("%-12s %-7s %8s %10s %8s %8s %8s %8s %7s\n" % (
+        '', '', '', '', '(ms)', '(ms)', '(ms)', '(ms)', ''))
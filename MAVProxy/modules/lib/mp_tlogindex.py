@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+'''
+sidecar index for telemetry logs
+
+The index of flight.tlog is kept in flight.tlog.idx. It holds the file
+offset of every record, grouped by message ID, and a coarse table of
+the first record at or after each second of the log. Readers that only
+want a few message types, or a time window, can seek straight to the
+records they need instead of parsing the whole log.
+
+Each record in a tlog is a big endian microsecond timestamp followed by
+a MAVLink 1.0 or 2.0 frame. The index is invalidated by any change in
+the size of the log.
+'''
+
+import os, sys, struct, mmap, bisect
+from array import array
+
+from MAVProxy.modules.lib import mp_frame
+
+MAGIC = 'MAVTIDX1'
+
+GZIP_MAGIC = '\x1f\x8b'
+
+# longest gap in seconds between records that is treated as real
+MAX_TIME_GAP = 24*60*60
+
+def index_name(filename):
+    '''return the name of the index of a log'''
+    return filename + '.idx'
+
+def _le(a):
+    '''convert an array to or from the little endian file format'''
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+class TlogIndex(object):
+    '''offsets of the records in a tlog, by message ID and by time'''
+    def __init__(self, logsize=0, interval=1.0):
+        self.logsize = logsize
+        self.interval = interval
+        # msgid -> array of record offsets
+        self.offsets = {}
+        # start time, and the offset of the first record at or after
+        # each interval from it
+        self.start_time = 0
+        self.time_offsets = array('d')
+        self.records = 0
+
+    def add(self, msgid, offset, t):
+        '''add a record to the index. Records must be added in file order'''
+        offsets = self.offsets.get(msgid, None)
+        if offsets is None:
+            offsets = array('d')
+            self.offsets[msgid] = offsets
+        offsets.append(offset)
+        if len(self.time_offsets) == 0:
+            self.start_time = t
+        slot = int((t - self.start_time) / self.interval)
+        # don't let a corrupt timestamp far in the future blow up the table
+        if slot - len(self.time_offsets) < MAX_TIME_GAP / self.interval:
+            while len(self.time_offsets) <= slot:
+                self.time_offsets.append(offset)
+        self.records += 1
+
+    def time_offset(self, t):
+        '''return the offset of the first record at or after time t,
+        to the resolution of the time table'''
+        if len(self.time_offsets) == 0 or t is None:
+            return None
+        slot = int((t - self.start_time) / self.interval)
+        if slot <= 0:
+            return 0
+        if slot >= len(self.time_offsets):
+            return self.logsize
+        return int(self.time_offsets[slot])
+
+    def message_offsets(self, msgids, start=None, end=None):
+        '''return the sorted offsets of the records of the given message
+        IDs between the start and end times'''
+        lo = self.time_offset(start)
+        hi = self.time_offset(end)
+        ret = []
+        for msgid in msgids:
+            offsets = self.offsets.get(msgid, None)
+            if offsets is None:
+                continue
+            i = 0
+            j = len(offsets)
+            if lo is not None:
+                i = bisect.bisect_left(offsets, lo)
+            if hi is not None:
+                j = bisect.bisect_left(offsets, hi)
+            ret.extend([int(o) for o in offsets[i:j]])
+        ret.sort()
+        return ret
+
+    def type_offsets(self, mavlink, types, start=None, end=None):
+        '''like message_offsets(), but taking message type names'''
+        ids = mp_frame.message_table(mavlink).ids
+        return self.message_offsets([ids[t] for t in types if t in ids], start, end)
+
+    def save(self, filename):
+        '''write the index to a file'''
+        f = open(filename + '.tmp', 'wb')
+        f.write(MAGIC)
+        f.write(struct.pack('<QddII', self.logsize, self.interval, self.start_time,
+                            len(self.time_offsets), len(self.offsets)))
+        _le(array('d', self.time_offsets)).tofile(f)
+        for msgid in sorted(self.offsets.keys()):
+            offsets = self.offsets[msgid]
+            f.write(struct.pack('<II', msgid, len(offsets)))
+            _le(array('d', offsets)).tofile(f)
+        f.close()
+        os.rename(filename + '.tmp', filename)
+
+
+def _read_array(f, count):
+    a = array('d')
+    a.fromfile(f, count)
+    return _le(a)
+
+def load(filename):
+    '''load the index of a log, returning None if there isn't one or it
+    is out of date'''
+    idxname = index_name(filename)
+    try:
+        f = open(idxname, 'rb')
+    except IOError:
+        return None
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        hdr = struct.Struct('<QddII')
+        (logsize, interval, start_time, ntimes, ntypes) = hdr.unpack(f.read(hdr.size))
+        if logsize != os.path.getsize(filename):
+            return None
+        idx = TlogIndex(logsize, interval)
+        idx.start_time = start_time
+        idx.time_offsets = _read_array(f, ntimes)
+        for i in range(ntypes):
+            (msgid, count) = struct.unpack('<II', f.read(8))
+            idx.offsets[msgid] = _read_array(f, count)
+            idx.records += count
+    except (struct.error, EOFError):
+        return None
+    finally:
+        f.close()
+    return idx
+
+def is_compressed(filename):
+    '''return True if a file is gzip compressed'''
+    f = open(filename, 'rb')
+    magic = f.read(2)
+    f.close()
+    return magic == GZIP_MAGIC
+
+def build(filename, interval=1.0):
+    '''scan a tlog and return its index. Offsets in a compressed log
+    can't be seeked to, so those raise ValueError'''
+    if is_compressed(filename):
+        raise ValueError("%s is gzip compressed, decompress it to index it" % filename)
+    logsize = os.path.getsize(filename)
+    idx = TlogIndex(logsize, interval)
+    if logsize == 0:
+        return idx
+    f = open(filename, 'rb')
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    ofs = 0
+    # a record needs a timestamp and at least a MAVLink 1.0 header
+    while ofs + 16 <= logsize:
+        magic = buf[ofs+8]
+        if magic == mp_frame.MAGIC_V1:
+            flen = ord(buf[ofs+9]) + 8
+            msgid = ord(buf[ofs+13])
+        elif magic == mp_frame.MAGIC_V2 and ofs + 20 <= logsize:
+            flen = ord(buf[ofs+9]) + 12
+            if ord(buf[ofs+10]) & mp_frame.MAVLINK_IFLAG_SIGNED:
+                flen += mp_frame.SIGNATURE_LEN
+            msgid = struct.unpack('<I', buf[ofs+15:ofs+18] + '\0')[0]
+        else:
+            # not a record, resync a byte at a time
+            ofs += 1
+            continue
+        if ofs + 8 + flen > logsize:
+            break
+        (tusec,) = struct.unpack('>Q', buf[ofs:ofs+8])
+        idx.add(msgid, ofs, tusec * 1.0e-6)
+        ofs += 8 + flen
+    buf.close()
+    f.close()
+    return idx
+
+def read_messages(mlog, offsets):
+    '''generate the messages at the given offsets of a log opened with
+    mavutil.mavlogfile(), updating the log state as recv_msg() does'''
+    for ofs in offsets:
+        mlog.f.seek(ofs)
+        m = mlog.recv_msg()
+        if m is not None:
+            yield m
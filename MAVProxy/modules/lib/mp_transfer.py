@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+'''
+pipelined point transfers for MAVProxy
+
+Fence and rally points are fetched one at a time by index, and there is
+no acknowledgement when a point is sent, so an upload is checked by
+fetching each point back. Rather than waiting for each reply in turn,
+a PointTransfer keeps a window of requests in flight. Replies are
+matched by index as they arrive through the module's mavlink_packet(),
+and a timer re-sends any request that has timed out. Nothing blocks, so
+telemetry keeps flowing during a transfer on a slow or lossy link.
+
+The timeout adapts to the link. Round trip times are smoothed as TCP
+does (RFC 6298), ignoring replies to re-sent requests, and the timeout
+doubles while requests keep timing out.
+
+Mission uploads are driven by the vehicle, which requests each item in
+turn, so an UploadTransfer only answers requests and watches for the
+upload stalling.
+'''
+
+import time
+
+class TransferError(Exception):
+    '''a transfer failed'''
+    pass
+
+
+class RttEstimator(object):
+    '''smoothed round trip time and retransmission timeout'''
+    def __init__(self, initial=1.0, min_rto=0.2, max_rto=5.0):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.samples = 0
+
+    def sample(self, rtt):
+        '''add a round trip time measurement'''
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+        self.samples += 1
+
+    def backoff(self):
+        '''double the timeout after a timeout'''
+        self.rto = min(self.rto * 2, self.max_rto)
+
+
+class PointTransfer(object):
+    '''an event driven download, or upload and verify, of a list of
+    points. fetch(idx) requests a point from the vehicle. For an upload,
+    send(point) sends a point and match(sent, received) checks the copy
+    fetched back. The future completes with the list of points
+    received, or with a TransferError. timeout is the initial timeout,
+    which adapts to the round trip time unless adaptive is False.
+    indexes lists the points to transfer, by default 0 to count-1, and
+    the points and the list received are in the same order'''
+    def __init__(self, name, count, fetch, future, scheduler,
+                 points=None, send=None, match=None,
+                 window=4, timeout=1.0, retries=5, progress=None, adaptive=True,
+                 indexes=None):
+        self.name = name
+        if indexes is None:
+            indexes = range(count)
+        self.indexes = list(indexes)
+        self.position = dict((idx, i) for (i, idx) in enumerate(self.indexes))
+        count = len(self.indexes)
+        self.count = count
+        self.fetch = fetch
+        self.future = future
+        self.scheduler = scheduler
+        self.points = points
+        self.send = send
+        self.match = match
+        self.window = max(window, 1)
+        self.rtt = RttEstimator(timeout)
+        if not adaptive:
+            self.rtt.min_rto = self.rtt.max_rto = timeout
+        self.retries = retries
+        self.progress = progress
+        self.received = [None] * count
+        # idx -> [deadline, tries, time sent] for requests in flight
+        self.pending = {}
+        # position in indexes of the next point to request
+        self.next_idx = 0
+        self.completed = 0
+        self.retransmits = 0
+        self.start_time = None
+        self.last_progress = 0
+        self.timer = None
+
+    def active(self):
+        '''return True if the transfer is still running'''
+        return not self.future.done()
+
+    def start(self):
+        '''send the first window of requests'''
+        self.start_time = time.time()
+        # only transfers taking more than a second report progress
+        self.last_progress = self.start_time
+        if self.count == 0:
+            self.future.set_result(self.received)
+            return
+        self.timer = self.scheduler.add_periodic('transfer:%s' % self.name,
+                                                 self.rtt.min_rto / 2, self.check_timeouts)
+        self._fill()
+
+    def _request(self, idx, tries):
+        if self.points is not None:
+            self.send(self.points[self.position[idx]])
+        self.fetch(idx)
+        tnow = time.time()
+        self.pending[idx] = [tnow + self.rtt.rto, tries, tnow]
+
+    def _fill(self):
+        '''keep the window of requests full'''
+        while len(self.pending) < self.window and self.next_idx < self.count:
+            self._request(self.indexes[self.next_idx], 1)
+            self.next_idx += 1
+
+    def _retry(self, idx, reason):
+        tries = self.pending[idx][1]
+        if tries >= self.retries:
+            self.fail("%s point %u %s after %u tries" % (self.name, idx, reason, tries))
+            return
+        self.retransmits += 1
+        self._request(idx, tries + 1)
+
+    def handle(self, idx, m):
+        '''handle a point received from the vehicle'''
+        if not self.active() or not idx in self.pending:
+            # a duplicate, or a late reply to a request already re-sent
+            return
+        if self.points is not None and not self.match(self.points[self.position[idx]], m):
+            self._retry(idx, 'mismatched')
+            return
+        (deadline, tries, sent) = self.pending.pop(idx)
+        if tries == 1:
+            # replies to re-sent requests are ambiguous, so aren't timed
+            self.rtt.sample(time.time() - sent)
+        self.received[self.position[idx]] = m
+        self.completed += 1
+        if self.completed == self.count:
+            self._finish()
+            return
+        self._report()
+        self._fill()
+
+    def check_timeouts(self):
+        '''re-send requests that have timed out'''
+        tnow = time.time()
+        expired = [idx for (idx, p) in self.pending.items() if tnow >= p[0]]
+        if not expired:
+            return
+        self.rtt.backoff()
+        for idx in sorted(expired):
+            if not self.active():
+                return
+            self._retry(idx, 'timed out')
+
+    def _report(self):
+        '''report progress at most once a second'''
+        if self.progress is None:
+            return
+        tnow = time.time()
+        if tnow - self.last_progress >= 1:
+            self.last_progress = tnow
+            self.progress(self)
+
+    def _stop(self):
+        if self.timer is not None:
+            self.scheduler.cancel(self.timer)
+            self.timer = None
+        self.pending.clear()
+
+    def _finish(self):
+        self._stop()
+        self.future.set_result(self.received)
+
+    def fail(self, msg):
+        '''abandon the transfer'''
+        self._stop()
+        self.future.set_exception(TransferError(msg))
+
+    def cancel(self):
+        '''abandon the transfer without reporting an error'''
+        self._stop()
+        self.future.cancel()
+
+    def status(self):
+        '''return a one line summary'''
+        dt = time.time() - self.start_time if self.start_time is not None else 0
+        return "%s: %u/%u points, %u in flight, %u retransmits, timeout %.2fs, %.1fs" % (
+            self.name, self.completed, self.count, len(self.pending), self.retransmits,
+            self.rtt.rto, dt)
+
+
+class UploadTransfer(object):
+    '''an upload driven by requests from the vehicle. start() asks the
+    vehicle to begin, and is called again if no request arrives. send(idx)
+    sends an item. The vehicle acknowledges the whole upload, and the
+    future completes with True when it does, or with False if everything
+    was sent but no acknowledgement arrived. The upload fails if the
+    vehicle stops requesting items for stall_timeout seconds'''
+    def __init__(self, name, first, count, start, send, future, scheduler,
+                 timeout=1.0, retries=5, progress=None, stall_timeout=10.0):
+        self.name = name
+        self.first = first
+        self.count = count
+        self.start_fn = start
+        self.send = send
+        self.future = future
+        self.scheduler = scheduler
+        self.rtt = RttEstimator(timeout)
+        self.retries = retries
+        self.stall_timeout = stall_timeout
+        self.progress = progress
+        self.sent = set()
+        self.requests = 0
+        self.retransmits = 0
+        self.restarts = 0
+        self.start_time = None
+        self.last_progress = 0
+        self.last_activity = 0
+        self.last_send = None
+        self.timer = None
+
+    def active(self):
+        '''return True if the upload is still running'''
+        return not self.future.done()
+
+    def start(self):
+        '''ask the vehicle to start requesting items'''
+        self.start_time = time.time()
+        self.last_progress = self.start_time
+        self.last_activity = self.start_time
+        self.start_fn()
+        self.timer = self.scheduler.add_periodic('upload:%s' % self.name,
+                                                 self.rtt.min_rto / 2, self.check_timeout)
+
+    def handle_request(self, idx):
+        '''send the item the vehicle asked for'''
+        if not self.active():
+            return False
+        if idx < self.first or idx >= self.first + self.count:
+            return False
+        tnow = time.time()
+        if idx in self.sent:
+            # our copy or the vehicle's request was lost
+            self.retransmits += 1
+        elif self.last_send is not None and idx == self.last_send[0] + 1:
+            # the request for the next item times the one before
+            self.rtt.sample(tnow - self.last_send[1])
+        self.send(idx)
+        self.sent.add(idx)
+        self.requests += 1
+        self.last_send = (idx, tnow)
+        self.last_activity = tnow
+        self._report()
+        return True
+
+    def handle_ack(self, ok, reason=None):
+        '''the vehicle has accepted or rejected the upload'''
+        if not self.active():
+            return
+        self._stop()
+        if ok:
+            self.future.set_result(True)
+        else:
+            self.future.set_exception(TransferError("%s upload rejected: %s" % (self.name, reason)))
+
+    def check_timeout(self):
+        '''restart an upload that never started, and give up on one that
+        has stalled'''
+        tnow = time.time()
+        if self.requests == 0:
+            if tnow - self.last_activity < self.rtt.rto:
+                return
+            if self.restarts < self.retries:
+                self.restarts += 1
+                self.rtt.backoff()
+                self.last_activity = tnow
+                self.start_fn()
+                return
+        elif tnow - self.last_activity < self.stall_timeout:
+            # the vehicle re-requests lost items itself, so allow it
+            # time for its own retries
+            return
+        self._stop()
+        if len(self.sent) == self.count:
+            # everything was sent, but the acknowledgement was lost
+            self.future.set_result(False)
+            return
+        self.future.set_exception(TransferError("%s upload stalled after %u/%u items" % (
+            self.name, len(self.sent), self.count)))
+
+    def _report(self):
+        '''report progress at most once a second'''
+        if self.progress is None:
+            return
+        tnow = time.time()
+        if tnow - self.last_progress >= 1:
+            self.last_progress = tnow
+            self.progress(self)
+
+    def _stop(self):
+        if self.timer is not None:
+            self.scheduler.cancel(self.timer)
+            self.timer = None
+
+    def cancel(self):
+        '''abandon the upload without reporting an error'''
+        self._stop()
+        self.future.cancel()
+
+    def status(self):
+        '''return a one line summary'''
+        dt = time.time() - self.start_time if self.start_time is not None else 0
+        return "%s: sent %u/%u items, %u retransmits, %.1fs" % (
+            self.name, len(self.sent), self.count, self.retransmits, dt)
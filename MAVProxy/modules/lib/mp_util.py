@@ -4,6 +4,7 @@
 
 import math
 import os
+import gzip
 
 radius_of_earth = 6378100.0 # in meters
 
@@ -233,3 +234,22 @@ def download_files(files):
                     open(file, mode='w').write(data)
             except Exception as e:
                     print("Failed to save to %s : %s" % (file, e))
+
+class GzipLog(gzip.GzipFile):
+    '''a gzip compressed log that reports the position in the compressed
+    file, so progress percentages are against the compressed file size'''
+    def tell(self):
+        return self.fileobj.tell()
+
+def mavlink_connection(filename, **kwargs):
+    '''open a MAVLink connection, reading gzip compressed logs transparently'''
+    from pymavlink import mavutil
+    if not filename.endswith('.gz'):
+        return mavutil.mavlink_connection(filename, **kwargs)
+    if filename.endswith('.raw.gz'):
+        # raw logs have no timestamps
+        kwargs.setdefault('notimestamps', True)
+    mlog = mavutil.mavlogfile(filename, **kwargs)
+    mlog.f.close()
+    mlog.f = GzipLog(filename, 'rb')
+    return mlog
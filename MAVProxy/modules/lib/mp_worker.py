@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+'''
+background workers for MAVProxy
+
+Blocking work (file parsing, waiting on a slow exchange with the
+vehicle) is run on a shared pool of threads, or on a process pool for
+CPU bound work that can be pickled, so the main loop keeps forwarding
+telemetry. Each job returns a Future. Callbacks on a future are always
+run from the main loop, which is woken through the reactor when a job
+completes, so they can use the rest of MAVProxy without locking.
+
+A worker thread that needs to touch MAVProxy state, for example to send
+a message on a link, should do it with run_on_main().
+'''
+
+import sys, threading, thread, Queue
+from collections import deque
+
+class CancelledError(Exception):
+    '''raised by Future.result() for a cancelled job'''
+    pass
+
+class TimeoutError(Exception):
+    '''raised by Future.result() when the timeout expires'''
+    pass
+
+
+class Future(object):
+    '''the result of an operation that completes later'''
+    def __init__(self, pool, description=None):
+        self.pool = pool
+        self.description = description
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._cancelled = False
+        self._callbacks = []
+        self.lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        '''cancel the operation if it hasn't completed. A job already
+        running on a worker runs to the end, but its result is dropped'''
+        return self._finish(None, None, cancelled=True)
+
+    def set_result(self, result):
+        '''complete the future. Safe to call from any thread'''
+        self._finish(result, None)
+
+    def set_exception(self, exc_info):
+        '''complete the future with an exception, either as returned by
+        sys.exc_info() or an exception object. Safe to call from any
+        thread'''
+        if isinstance(exc_info, BaseException):
+            exc_info = (type(exc_info), exc_info, None)
+        self._finish(None, exc_info)
+
+    def _finish(self, result, exc_info, cancelled=False):
+        with self.lock:
+            if self._done.is_set():
+                return False
+            self._result = result
+            self._exc_info = exc_info
+            self._cancelled = cancelled
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._done.set()
+        for fn in callbacks:
+            self.pool.call_soon(fn, self)
+        self.pool.finished(self)
+        return True
+
+    def add_done_callback(self, fn):
+        '''call fn(future) from the main loop once the future is done'''
+        with self.lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        self.pool.call_soon(fn, self)
+
+    def then(self, fn):
+        '''return a future for fn(result), called from the main loop once
+        this future succeeds. If fn returns a future, the returned future
+        follows it. A failure or cancellation passes straight through'''
+        future = Future(self.pool, self.description)
+        def call(f):
+            if f._cancelled:
+                future.cancel()
+                return
+            if f._exc_info is not None:
+                future.set_exception(f._exc_info)
+                return
+            try:
+                ret = fn(f._result)
+            except Exception:
+                future.set_exception(sys.exc_info())
+                return
+            if isinstance(ret, Future):
+                ret.add_done_callback(future.follow)
+            else:
+                future.set_result(ret)
+        self.add_done_callback(call)
+        return future
+
+    def follow(self, src):
+        '''complete this future the same way as the completed future src'''
+        if src._cancelled:
+            self.cancel()
+        elif src._exc_info is not None:
+            self.set_exception(src._exc_info)
+        else:
+            self.set_result(src._result)
+
+    def exception(self):
+        '''return the exception the job raised, or None'''
+        if self._exc_info is None:
+            return None
+        return self._exc_info[1]
+
+    def result(self, timeout=None):
+        '''wait for the result. This must not be called from the main
+        loop on a future that isn't done, as it would block telemetry'''
+        if not self._done.wait(timeout):
+            raise TimeoutError(self.description)
+        if self._cancelled:
+            raise CancelledError(self.description)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class WorkerPool(object):
+    '''a pool of worker threads, and optionally processes, with results
+    delivered to the main loop'''
+    def __init__(self, threads=4, wakeup=None, on_error=None):
+        self.max_threads = threads
+        self.wakeup = wakeup
+        self.on_error = on_error
+        self.main_thread = thread.get_ident()
+        self.jobs = Queue.Queue()
+        self.completions = deque()
+        self.threads = []
+        self.idle = 0
+        self.process_pool = None
+        self.process_count = None
+        # futures not yet done, for 'workers' status
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.callbacks = 0
+        self.max_queued = 0
+        self.running = True
+
+    def set_main_thread(self):
+        '''note that the calling thread runs the main loop'''
+        self.main_thread = thread.get_ident()
+
+    def on_main_thread(self):
+        '''return True if called from the main loop thread'''
+        return thread.get_ident() == self.main_thread
+
+    def call_soon(self, fn, *args):
+        '''run fn(*args) on the next pass of the main loop. Safe to call
+        from any thread'''
+        self.completions.append((fn, args))
+        if self.wakeup is not None and not self.on_main_thread():
+            self.wakeup()
+
+    def run_on_main(self, fn, *args, **kwargs):
+        '''run fn on the main loop, returning a future for its result.
+        If fn returns a future, the returned future follows it'''
+        future = Future(self, getattr(fn, '__name__', None))
+        def call():
+            try:
+                ret = fn(*args, **kwargs)
+            except Exception:
+                future.set_exception(sys.exc_info())
+                return
+            if isinstance(ret, Future):
+                ret.add_done_callback(future.follow)
+            else:
+                future.set_result(ret)
+        self._add_pending(future)
+        self.call_soon(call)
+        return future
+
+    def _add_pending(self, future):
+        with self.lock:
+            self.pending.add(future)
+            self.submitted += 1
+
+    def finished(self, future):
+        '''note that a future has completed'''
+        with self.lock:
+            if not future in self.pending:
+                return
+            self.pending.discard(future)
+            self.completed += 1
+            if future._exc_info is not None:
+                self.failed += 1
+
+    def submit(self, fn, *args, **kwargs):
+        '''run fn(*args, **kwargs) on a worker thread, returning a future'''
+        future = Future(self, getattr(fn, '__name__', None))
+        self._add_pending(future)
+        self.jobs.put((future, fn, args, kwargs))
+        qsize = self.jobs.qsize()
+        if qsize > self.max_queued:
+            self.max_queued = qsize
+        with self.lock:
+            if self.idle < qsize and len(self.threads) < self.max_threads:
+                self._start_thread()
+        return future
+
+    def submit_process(self, fn, *args):
+        '''run fn(*args) in a worker process, returning a future. fn, its
+        arguments and its result must be picklable'''
+        if self.process_pool is None:
+            import multiprocessing
+            self.process_pool = multiprocessing.Pool(self.process_count)
+        pool = self.process_pool
+        future = self.submit(lambda: pool.apply(fn, args))
+        future.description = getattr(fn, '__name__', None)
+        return future
+
+    def _start_thread(self):
+        t = threading.Thread(target=self._worker, name='worker%u' % (len(self.threads)+1))
+        t.daemon = True
+        self.threads.append(t)
+        t.start()
+
+    def _worker(self):
+        while self.running:
+            with self.lock:
+                self.idle += 1
+            job = self.jobs.get()
+            with self.lock:
+                self.idle -= 1
+            if job is None:
+                break
+            (future, fn, args, kwargs) = job
+            if future.done():
+                # cancelled while queued
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+
+    def run_completions(self):
+        '''run callbacks for completed jobs. Called from the main loop.
+        Callbacks queued while this runs wait for the next pass, so a
+        callback that re-queues itself can't starve the rest of the loop'''
+        for i in range(len(self.completions)):
+            (fn, args) = self.completions.popleft()
+            self.callbacks += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                if self.on_error is None:
+                    raise
+                self.on_error(fn, e)
+
+    def show(self, f):
+        '''write pool status'''
+        f.write("%u threads (%u idle) of %u, %u jobs queued (max %u)\n" % (
+            len(self.threads), self.idle, self.max_threads, self.jobs.qsize(), self.max_queued))
+        f.write("%u submitted, %u completed, %u failed, %u callbacks run\n" % (
+            self.submitted, self.completed, self.failed, self.callbacks))
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            f.write("  pending: %s\n" % future.description)
+
+    def close(self):
+        '''stop the worker threads. Jobs still running are abandoned'''
+        self.running = False
+        for t in self.threads:
+            self.jobs.put(None)
+        if self.process_pool is not None:
+            self.process_pool.terminate()
+            self.process_pool = None
@@ -120,7 +120,11 @@ def complete(text, state):
         last_clist = complete_command(text) + complete_alias(text)
     elif cmd[0] in rline_mpstate.completions:
         # we have a completion rule for this command
-        last_clist = complete_rules(rline_mpstate.completions[cmd[0]], cmd[1:])
+        rules = rline_mpstate.completions[cmd[0]]
+        if callable(rules):
+            # the command's module is loaded on first use, and provides the rules
+            rules = rules()
+        last_clist = complete_rules(rules, cmd[1:])
     else:
         # assume completion by filename
         last_clist = glob.glob(text+'*')
@@ -39,6 +39,7 @@ class HILModule(mp_module.MPModule):
         self.last_apm_send_time = time.time()
         self.rc_channels_scaled = None
         self.hil_state_msg = None
+        self.add_message_types(['RC_CHANNELS_SCALED'])
         sim_in_address  = ('127.0.0.1', 5501)
         sim_out_address  = ('127.0.0.1', 5502)
 
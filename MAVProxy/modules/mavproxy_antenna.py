@@ -16,6 +16,7 @@ class AntennaModule(mp_module.MPModule):
         self.last_bearing = 0
         self.last_announce = 0
         self.add_command('antenna', self.cmd_antenna, "antenna link control")
+        self.add_message_types(['GPS_RAW', 'GPS_RAW_INT'])
 
     def cmd_antenna(self, args):
         '''set gcs location'''
@@ -24,6 +24,8 @@ class CameraViewModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(CameraViewModule, self).__init__(mpstate, "cameraview")
         self.add_command('cameraview', self.cmd_cameraview, "camera view")
+        self.add_message_types(['GLOBAL_POSITION_INT', 'ATTITUDE', 'GPS_RAW',
+                                'GPS_RAW_INT', 'SERVO_OUTPUT_RAW'])
         self.roll = 0
         self.pitch = 0
         self.yaw = 0
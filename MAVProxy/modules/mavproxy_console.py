@@ -21,6 +21,11 @@ class ConsoleModule(mp_module.MPModule):
         self.total_time = 0.0
         self.speed = 0
         mpstate.console = wxconsole.MessageConsole(title='Console')
+        self.add_message_types(['GPS_RAW', 'GPS_RAW_INT', 'VFR_HUD', 'ATTITUDE',
+                                'SYS_STATUS', 'HWSTATUS', 'POWER_STATUS',
+                                'RADIO', 'RADIO_STATUS', 'HEARTBEAT',
+                                'WAYPOINT_CURRENT', 'MISSION_CURRENT',
+                                'NAV_CONTROLLER_OUTPUT'])
     
         # setup some default status information
         mpstate.console.set_status('Mode', 'UNKNOWN', row=0, fg='blue')
@@ -204,7 +209,13 @@ class ConsoleModule(mp_module.MPModule):
                     linkline += "down"
                     fg = 'red'
                 else:
-                    linkline += "OK (%u pkts, %.2fs delay, %u lost)" % (m.mav_count, linkdelay, m.mav_loss)
+                    linkline += "OK (%u pkts, %.2fs delay, %u lost" % (m.mav_count, linkdelay, m.mav_loss)
+                    if getattr(m, 'duplicates', 0):
+                        linkline += ", %u dup" % m.duplicates
+                    if getattr(m, 'linkstats', None) is not None:
+                        (pkt_rate, byte_rate) = m.linkstats.rates()
+                        linkline += ", %.0f pkt/s %.1f kB/s" % (pkt_rate, byte_rate/1024.0)
+                    linkline += ")"
                     if linkdelay > 1:
                         fg = 'orange'
                     else:
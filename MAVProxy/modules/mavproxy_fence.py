@@ -1,9 +1,10 @@
 """
     MAVProxy geofence module
 """
-import os, time
+import os
 from pymavlink import mavwp, mavutil
 from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.lib import mp_transfer
 from MAVProxy.modules.lib import mp_module
 
 class FenceModule(mp_module.MPModule):
@@ -19,6 +20,11 @@ class FenceModule(mp_module.MPModule):
                          "geo-fence management",
                          ["<draw|list|clear|enable|disable>",
                           "<load|save> (FILENAME)"])
+        self.add_message_types(['FENCE_STATUS', 'SYS_STATUS', 'FENCE_POINT'])
+        # the point transfer in progress, and the whole operation
+        # including any parameter changes
+        self.transfer = None
+        self.operation = None
 
         if self.continue_mode and self.logdir != None:
             fencetxt = os.path.join(self.logdir, 'fence.txt')
@@ -28,7 +34,10 @@ class FenceModule(mp_module.MPModule):
 
     def mavlink_packet(self, m):
         '''handle and incoming mavlink packet'''
-        if m.get_type() == "FENCE_STATUS":
+        if m.get_type() == "FENCE_POINT":
+            if self.transfer is not None:
+                self.transfer.handle(m.idx, m)
+        elif m.get_type() == "FENCE_STATUS":
             self.last_fence_breach = m.breach_time
             self.last_fence_status = m.breach_status
         elif m.get_type() in ['SYS_STATUS']:
@@ -85,14 +94,14 @@ class FenceModule(mp_module.MPModule):
             if len(args) != 2:
                 print("usage: fence load <filename>")
                 return
-            self.load_fence(args[1])
+            return self.load_fence(args[1])
         elif args[0] == "list":
-            self.list_fence(None)
+            return self.list_fence(None)
         elif args[0] == "save":
             if len(args) != 2:
                 print("usage: fence save <filename>")
                 return
-            self.list_fence(args[1])
+            return self.list_fence(args[1])
         elif args[0] == "show":
             if len(args) != 2:
                 print("usage: fence show <filename>")
@@ -105,7 +114,7 @@ class FenceModule(mp_module.MPModule):
             self.mpstate.map_functions['draw_lines'](self.fence_draw_callback)
             print("Drawing fence on map")
         elif args[0] == "clear":
-            self.param_set('FENCE_TOTAL', 0, 3)
+            return self.param_set('FENCE_TOTAL', 0, 3)
         else:
             self.print_usage()
     
@@ -119,45 +128,56 @@ class FenceModule(mp_module.MPModule):
             print("Unable to load %s - %s" % (filename, msg))
             return
         print("Loaded %u geo-fence points from %s" % (self.fenceloader.count(), filename))
-        self.send_fence()
+        return self.send_fence()
     
     def send_fence(self):
-        '''send fence points from fenceloader'''
-        # must disable geo-fencing when loading
+        '''send fence points from fenceloader, checking each one by
+        fetching it back'''
+        if self.transfer_busy():
+            return
+        points = [self.fenceloader.point(i) for i in range(self.fenceloader.count())]
         action = self.get_mav_param('FENCE_ACTION', mavutil.mavlink.FENCE_ACTION_NONE)
-        self.param_set('FENCE_ACTION', mavutil.mavlink.FENCE_ACTION_NONE, 3)
-        self.param_set('FENCE_TOTAL', self.fenceloader.count(), 3)
-        for i in range(self.fenceloader.count()):
-            p = self.fenceloader.point(i)
-            self.master.mav.send(p)
-            p2 = self.fetch_fence_point(i)
-            if p2 is None:
-                self.param_set('FENCE_ACTION', action, 3)
-                return
-            if (p.idx != p2.idx or
-                abs(p.lat - p2.lat) >= 0.00003 or
-                abs(p.lng - p2.lng) >= 0.00003):
-                print("Failed to send fence point %u" % i)
-                self.param_set('FENCE_ACTION', action, 3)
-                return
-        self.param_set('FENCE_ACTION', action, 3)
-    
-    def fetch_fence_point(self ,i):
-        '''fetch one fence point'''
+        # must disable geo-fencing when loading
+        future = self.param_set('FENCE_ACTION', mavutil.mavlink.FENCE_ACTION_NONE, 3)
+        def set_total(ok):
+            if not ok:
+                raise mp_transfer.TransferError("unable to disable FENCE_ACTION")
+            return self.param_set('FENCE_TOTAL', len(points), 3)
+        future = future.then(set_total)
+        def upload(ok):
+            if not ok:
+                raise mp_transfer.TransferError("unable to set FENCE_TOTAL")
+            self.transfer = self.point_transfer('fence', len(points), self.send_fetch,
+                                                points=points, send=self.send_message,
+                                                match=fence_point_match)
+            return self.transfer.future
+        future = future.then(upload)
+        def done(future):
+            self.param_set('FENCE_ACTION', action, 3)
+            if future.exception() is None:
+                print("Sent %u fence points (%u retransmits)" % (len(points), self.transfer.retransmits))
+        future.add_done_callback(done)
+        self.operation = future
+        return future
+
+    def transfer_busy(self):
+        '''return True if a transfer is already running'''
+        if self.operation is None or self.operation.done():
+            return False
+        if self.transfer is not None and self.transfer.active():
+            print("Fence transfer in progress: %s" % self.transfer.status())
+        else:
+            print("Fence transfer in progress")
+        return True
+
+    def send_message(self, m):
+        '''send a message to the vehicle'''
+        self.master.mav.send(m)
+
+    def send_fetch(self, i):
+        '''request a fence point'''
         self.master.mav.fence_fetch_point_send(self.target_system,
-                                                    self.target_component, i)
-        tstart = time.time()
-        p = None
-        while time.time() - tstart < 1:
-            p = self.master.recv_match(type='FENCE_POINT', blocking=False)
-            if p is not None:
-                break
-            time.sleep(0.1)
-            continue
-        if p is None:
-            self.console.error("Failed to fetch point %u" % i)
-            return None
-        return p
+                                               self.target_component, i)
     
     def fence_draw_callback(self, points):
         '''callback from drawing a fence'''
@@ -178,17 +198,23 @@ class FenceModule(mp_module.MPModule):
     
     def list_fence(self, filename):
         '''list fence points, optionally saving to a file'''
+        if self.transfer_busy():
+            return
         self.fenceloader.clear()
         count = self.get_mav_param('FENCE_TOTAL', 0)
         if count == 0:
             print("No geo-fence points")
             return
-        for i in range(int(count)):
-            p = self.fetch_fence_point(i)
-            if p is None:
-                return
-            self.fenceloader.add(p)
-    
+        self.transfer = self.point_transfer('fence', int(count), self.send_fetch)
+        def done(points):
+            for p in points:
+                self.fenceloader.add(p)
+            self.list_fence_done(filename)
+        self.operation = self.transfer.future.then(done)
+        return self.operation
+
+    def list_fence_done(self, filename):
+        '''show or save the fetched fence points'''
         if filename is not None:
             try:
                 self.fenceloader.save(filename)
@@ -208,6 +234,12 @@ class FenceModule(mp_module.MPModule):
     def print_usage(self):
         print("usage: fence <enable|disable|list|load|save|clear|draw>")
 
+def fence_point_match(p, p2):
+    '''check a fence point fetched back from the vehicle'''
+    return (p.idx == p2.idx and
+            abs(p.lat - p2.lat) < 0.00003 and
+            abs(p.lng - p2.lng) < 0.00003)
+
 def init(mpstate):
     '''initialise module'''
     return FenceModule(mpstate)
@@ -19,6 +19,8 @@ class GraphModule(mp_module.MPModule):
         self.graphs = []
         self.add_command('graph', self.cmd_graph, "[expression...] add a live graph",
                          ['(VARIABLE) (VARIABLE) (VARIABLE) (VARIABLE) (VARIABLE) (VARIABLE)'])
+        # we subscribe to the message types used by each graph as it is added
+        self.add_message_types([])
 
     def cmd_graph(self, args):
         '''graph command'''
@@ -42,13 +44,23 @@ class GraphModule(mp_module.MPModule):
             self.tickresolution = float(args[1])
         else:
             # start a new graph
-            self.graphs.append(Graph(self, args[:]))
+            g = Graph(self, args[:])
+            self.graphs.append(g)
+            self.add_message_types(g.msg_types)
+
+    def remove_graph(self, i):
+        '''close and remove a graph, dropping message types no other graph uses'''
+        g = self.graphs.pop(i)
+        g.close()
+        in_use = set()
+        for g2 in self.graphs:
+            in_use.update(g2.msg_types)
+        self.remove_message_types(g.msg_types.difference(in_use))
 
     def unload(self):
         '''unload module'''
-        for g in self.graphs:
-            g.close()
-        self.graphs = []
+        for i in range(len(self.graphs) - 1, -1, -1):
+            self.remove_graph(i)
 
     def mavlink_packet(self, msg):
         '''handle an incoming mavlink packet'''
@@ -56,8 +68,7 @@ class GraphModule(mp_module.MPModule):
         # check for any closed graphs
         for i in range(len(self.graphs) - 1, -1, -1):
             if not self.graphs[i].is_alive():
-                self.graphs[i].close()
-                self.graphs.pop(i)
+                self.remove_graph(i)
 
         # add data to the rest
         for g in self.graphs:
@@ -109,7 +109,7 @@ class JSModule(mp_module.MPModule):
                 override[i] = v
             if override != self.module('rc').override:
                 self.module('rc').override = override
-                self.module('rc').override_period.force()
+                self.module('rc').force_override()
 
 def init(mpstate):
     '''initialise module'''
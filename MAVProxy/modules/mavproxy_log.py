@@ -9,6 +9,8 @@ class LogModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(LogModule, self).__init__(mpstate, "log", "log transfer")
         self.add_command('log', self.cmd_log, "log file handling", ['<download|status|erase|resume|cancel|list>'])
+        self.set_idle_rate(10)
+        self.add_message_types(['LOG_ENTRY', 'LOG_DATA'])
         self.reset()
 
     def reset(self):
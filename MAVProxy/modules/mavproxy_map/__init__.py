@@ -49,6 +49,8 @@ class MapModule(mp_module.MPModule):
         self.add_command('map', self.cmd_map, "map control", ['icon',
                                       'set (MAPSETTING)'])
         self.add_completion_function('(MAPSETTING)', self.map_settings.completion)
+        # we check for map events and mission changes on every packet
+        self.add_message_types(['*'])
         
     def cmd_map(self, args):
         '''map commands'''
@@ -136,11 +138,7 @@ class MapModule(mp_module.MPModule):
                 wp.target_system    = self.target_system
                 wp.target_component = self.target_component
                 self.moving_wp = 0
-                self.module('wp').loading_waypoints = True
-                self.module('wp').loading_waypoint_lasttime = time.time()
-                self.master.mav.mission_write_partial_list_send(self.target_system,
-                                                                     self.target_component,
-                                                                     self.move_wp, self.move_wp)
+                self.module('wp').send_partial(self.move_wp, self.move_wp)
                 print("Moved WP %u to %f, %f at %.1fm" % (self.move_wp, lat, lon, wp.z))
                 self.display_waypoints()
                 
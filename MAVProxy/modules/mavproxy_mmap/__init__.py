@@ -21,6 +21,7 @@ class MMapModule(mp_module.MPModule):
         self.wp_change_time = 0
         self.fence_change_time = 0
         self.server = None
+        self.add_message_types(['GPS_RAW', 'GPS_RAW_INT', 'VFR_HUD'])
         self.server = mmap_server.start_server('127.0.0.1', port=9999, module_state=self)
         webbrowser.open('http://127.0.0.1:9999/', autoraise=True)
     
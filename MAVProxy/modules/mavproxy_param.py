@@ -3,7 +3,7 @@
 
 import time, os, fnmatch
 from pymavlink import mavutil, mavparm
-from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.lib import mp_util, mp_paramcache, mp_paramdoc
 
 from MAVProxy.modules.lib import mp_module
 
@@ -19,11 +19,25 @@ class ParamState:
         self.logdir = logdir
         self.vehicle_name = vehicle_name
         self.parm_file = parm_file
+        # compiled parameter documentation, by vehicle name
+        self.docs = {}
+        # process downloading the documentation
+        self.download_child = None
+        # function to set a parameter without blocking, if available
+        self.param_set = None
+        # on-disk cache of the vehicle's parameters, and the indexes
+        # still to be checked against it while it is verified
+        self.cache = None
+        self.verify = None
 
     def handle_mavlink_packet(self, master, m):
         '''handle an incoming mavlink packet'''
         if m.get_type() == 'PARAM_VALUE':
             param_id = "%.16s" % m.param_id
+            if self.verify is not None:
+                self.verify_param(master, str(param_id), m)
+            if self.cache is not None:
+                self.cache.set(m.param_index, str(param_id), m.param_value, m.param_count)
             if m.param_index != -1 and m.param_index not in self.mav_param_set:
                 added_new_parameter = True
                 self.mav_param_set.add(m.param_index)
@@ -39,10 +53,64 @@ class ParamState:
                 print("Received %u parameters" % m.param_count)
                 if self.logdir != None:
                     self.mav_param.save(os.path.join(self.logdir, self.parm_file), '*', verbose=True)
-    
+                if self.cache is not None and self.cache.complete():
+                    self.cache.save()
+
+    def use_cache(self, cache, samples):
+        '''preload the parameters from a cache, which is then checked by
+        fetching a sample of them. Returns False if there is no cache'''
+        self.cache = cache
+        if not cache.load():
+            return False
+        for (name, value) in cache.params.values():
+            self.mav_param[name] = value
+        self.verify = cache.sample(samples)
+        self.verify_tries = 0
+        print("Loaded %u parameters from %s, checking %u" % (cache.count, cache.path, len(self.verify)))
+        return True
+
+    def verify_param(self, master, param_id, m):
+        '''check a parameter from the vehicle against the cache'''
+        cache = self.cache
+        if m.param_count != -1 and m.param_count != cache.count:
+            self.cache_stale(master, "vehicle has %u parameters, cache %u" % (m.param_count, cache.count))
+        elif m.param_index in self.verify:
+            if not cache.matches(m.param_index, param_id, m.param_value, m.param_count):
+                self.cache_stale(master, "%s differs" % param_id)
+                return
+            self.verify.discard(m.param_index)
+            if len(self.verify) == 0:
+                self.verify = None
+                self.mav_param_count = cache.count
+                self.mav_param_set = set(range(cache.count))
+                print("Parameter cache verified")
+
+    def cache_stale(self, master, reason):
+        '''the cache doesn't match the vehicle, so fetch all parameters'''
+        print("Parameter cache is out of date (%s), fetching all parameters" % reason)
+        self.verify = None
+        self.cache.clear()
+        self.mav_param.clear()
+        self.mav_param_set = set()
+        self.mav_param_count = 0
+        master.param_fetch_all()
+
     def fetch_check(self, master):
         '''check for missing parameters periodically'''
         if self.param_period.trigger():
+            if self.cache is not None and self.cache.dirty and self.cache.complete():
+                if time.time() - self.cache.last_save >= 5:
+                    self.cache.save()
+            if self.verify is not None:
+                # re-request sampled parameters until all have arrived,
+                # giving up on vehicles that don't answer requests by index
+                self.verify_tries += 1
+                if self.verify_tries > 10:
+                    self.cache_stale(master, "no reply to %u sampled parameters" % len(self.verify))
+                    return
+                for idx in sorted(self.verify)[:10]:
+                    master.param_fetch_one(idx)
+                return
             if len(self.mav_param_set) == 0:
                 master.param_fetch_all()
             elif self.mav_param_count != 0 and len(self.mav_param_set) != self.mav_param_count:
@@ -66,54 +134,114 @@ class ParamState:
             path = mp_util.dot_mavproxy("%s-defaults.parm" % vehicle)
             files.append((url, path))
         try:
-            child = multiprocessing.Process(target=mp_util.download_files, args=(files,))
+            child = multiprocessing.Process(target=mp_paramdoc.download_docs, args=(files,))
             child.start()
+            self.download_child = child
         except Exception as e:
             print e
+
+    def downloading(self):
+        '''return True if the documentation is being downloaded'''
+        return self.download_child is not None and self.download_child.is_alive()
+
+    def download_check(self):
+        '''reload the documentation once a download has finished'''
+        if self.download_child is None or self.download_child.is_alive():
+            return
+        self.download_child.join()
+        self.download_child = None
+        self.docs = {}
     
-    def param_help(self, args):
-        '''show help on a parameter'''
+    def param_help_path(self, args):
+        '''return the documentation file for the vehicle, or None'''
         if len(args) == 0:
             print("Usage: param help PARAMETER_NAME")
-            return
+            return None
+        if self.downloading():
+            print("Parameter documentation is still downloading")
+            return None
         if self.vehicle_name is None:
             print("Unknown vehicle type")
-            return
+            return None
         path = mp_util.dot_mavproxy("%s.xml" % self.vehicle_name)
         if not os.path.exists(path):
             print("Please run 'param download' first (vehicle_name=%s)" % self.vehicle_name)
+            return None
+        return path
+
+    def param_docs(self):
+        '''return the documentation for the vehicle, compiling it if
+        needed, or None if it hasn't been downloaded'''
+        if self.vehicle_name in self.docs:
+            return self.docs[self.vehicle_name]
+        if self.vehicle_name is None or self.downloading():
+            return None
+        path = mp_util.dot_mavproxy("%s.xml" % self.vehicle_name)
+        if not os.path.exists(path):
+            return None
+        self.docs[self.vehicle_name] = mp_paramdoc.load_docs(path)
+        return self.docs[self.vehicle_name]
+
+    def param_help(self, args):
+        '''show help on a parameter'''
+        if self.param_help_path(args) is None:
             return
-        xml = open(path).read()
-        from lxml import objectify
-        objectify.enable_recursive_str()
-        tree = objectify.fromstring(xml)
-        htree = {}
-        for p in tree.vehicles.parameters.param:
-            n = p.get('name').split(':')[1]
-            htree[n] = p
-        for lib in tree.libraries.parameters:
-            for p in lib.param:
-                n = p.get('name')
-                htree[n] = p
+        self.param_help_show(self.param_docs(), args)
+
+    def param_help_show(self, docs, args):
+        '''show help on parameters from compiled documentation'''
         for h in args:
-            if h in htree:
-                help = htree[h]
-                print("%s: %s\n" % (h, help.get('humanName')))
-                print(help.get('documentation'))
-                try:
-                    vchild = help.getchildren()[0]
-                    print("\nValues: ")
-                    for v in vchild.value:
-                        print("\t%s : %s" % (v.get('code'), str(v)))
-                except Exception as e:
-                    pass
-            else:
+            doc = docs.get(h)
+            if doc is None:
                 print("Parameter '%s' not found in documentation" % h)
+                continue
+            print("%s: %s\n" % (doc.name, doc.human_name))
+            print(doc.documentation)
+            if doc.range is not None:
+                print(("\nRange: %g to %g %s" % (doc.range[0], doc.range[1], doc.units or '')).rstrip())
+            elif doc.units is not None:
+                print("\nUnits: %s" % doc.units)
+            if doc.values:
+                print("\nValues: ")
+                for (code, name) in doc.values:
+                    print("\t%s : %s" % (code, name))
+
+    def param_check(self, filename, wildcard):
+        '''check the values in a parameter file against their documented
+        ranges, returning False if any are outside them'''
+        if self.downloading():
+            print("Parameter documentation is still downloading, range check skipped")
+            return True
+        try:
+            docs = self.param_docs()
+        except Exception as e:
+            print("Unable to read parameter documentation (%s), range check skipped" % e)
+            return True
+        if docs is None:
+            return True
+        try:
+            bad = docs.check_file(filename, wildcard)
+        except IOError as e:
+            print("Failed to open file '%s': %s" % (filename, str(e)))
+            return False
+        for msg in bad:
+            print(msg)
+        if bad:
+            print("Not loading %s, use 'param forceload' to load it anyway" % filename)
+            return False
+        return True
+
+    def param_load(self, master, filename, wildcard, check_ranges=True):
+        '''load a parameter file into the vehicle, refusing it if any
+        values are outside their documented ranges'''
+        if check_ranges and not self.param_check(filename, wildcard):
+            return
+        self.mav_param.load(filename, wildcard, master)
     
     def handle_command(self, master, args):
         '''handle parameter commands'''
         param_wildcard = "*"
-        usage="Usage: param <fetch|set|show|load|preload|forceload|diff|download|help>"
+        usage="Usage: param <fetch|set|show|load|preload|forceload|diff|download|help|cache>"
         if len(args) < 1:
             print(usage)
             return
@@ -121,6 +249,7 @@ class ParamState:
             if len(args) == 1:
                 master.param_fetch_all()
                 self.mav_param_set = set()
+                self.verify = None
                 print("Requested parameter list")
             else:
                 for p in self.mav_param.keys():
@@ -167,16 +296,19 @@ class ParamState:
             if not param.upper() in self.mav_param:
                 print("Unable to find parameter '%s'" % param)
                 return
+            if self.param_set is not None:
+                return self.param_set(param.upper(), value, 3)
             self.mav_param.mavset(master, param.upper(), value, retries=3)
         elif args[0] == "load":
             if len(args) < 2:
                 print("Usage: param load <filename> [wildcard]")
+                print("Files with values outside their documented ranges are rejected, use forceload to load them")
                 return
             if len(args) > 2:
                 param_wildcard = args[2]
             else:
                 param_wildcard = "*"
-            self.mav_param.load(args[1], param_wildcard, master)
+            self.param_load(master, args[1], param_wildcard)
         elif args[0] == "preload":
             if len(args) < 2:
                 print("Usage: param preload <filename>")
@@ -194,13 +326,25 @@ class ParamState:
         elif args[0] == "download":
             self.param_help_download()
         elif args[0] == "help":
-            self.param_help(args[1:])
+            return self.param_help(args[1:])
         elif args[0] == "show":
             if len(args) > 1:
                 pattern = args[1]
             else:
                 pattern = "*"
             self.mav_param.show(pattern)
+        elif args[0] == "cache":
+            if self.cache is None:
+                print("No parameter cache in use")
+            elif len(args) > 1 and args[1] == "clear":
+                self.cache.remove()
+                print("Removed %s" % self.cache.path)
+            else:
+                state = "verified"
+                if self.verify is not None:
+                    state = "%u left to check" % len(self.verify)
+                print("%s: %u/%u parameters, %s" % (self.cache.path, len(self.cache.params),
+                                                   self.cache.count, state))
         else:
             print(usage)
         
@@ -209,10 +353,21 @@ class ParamModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(ParamModule, self).__init__(mpstate, "param", "parameter handling", public = True)
         self.pstate = ParamState(self.mav_param, self.logdir, self.vehicle_name, 'mav.parm')
+        self.pstate.param_set = self.param_set
         self.add_command('param', self.cmd_param, "parameter handling",
                          ["<fetch|download>",
-                          "<set|show|fetch|help> (PARAMETER)",
+                          "<set|show|fetch> (PARAMETER)",
+                          "help (PARAMDOC)",
+                          "cache <clear>",
                           "<load|save|diff> (FILENAME)"])
+        self.add_completion_function('(PARAMDOC)', self.complete_paramdoc)
+        # when the vehicle was first heard, and whether we have stopped
+        # waiting for a heartbeat to find its parameter cache
+        self.start_time = time.time()
+        self.first_heartbeat = None
+        self.cache_wait_over = False
+        self.add_message_types(['PARAM_VALUE', 'HEARTBEAT'])
+        self.set_idle_rate(10)
         if self.continue_mode and self.logdir != None:
             parmfile = os.path.join(self.logdir, 'mav.parm')
             if os.path.exists(parmfile):
@@ -220,16 +375,107 @@ class ParamModule(mp_module.MPModule):
                     
     def mavlink_packet(self, m):
         '''handle an incoming mavlink packet'''
+        if m.get_type() == 'HEARTBEAT':
+            if m.type == mavutil.mavlink.MAV_TYPE_GCS or m.get_srcSystem() != self.target_system:
+                return
+            if self.first_heartbeat is None:
+                self.first_heartbeat = time.time()
+            # gimbals and companion computers share the system ID, but
+            # the cache is keyed by the autopilot's heartbeat
+            if (self.pstate.cache is None and self.settings.paramcache and
+                m.autopilot != mavutil.mavlink.MAV_AUTOPILOT_INVALID):
+                self.open_cache(m)
+            return
         self.pstate.handle_mavlink_packet(self.master, m)
+
+    def open_cache(self, m):
+        '''use the parameter cache for the vehicle sending a heartbeat'''
+        path = mp_paramcache.cache_path(m.get_srcSystem(), m.autopilot, m.type)
+        cache = mp_paramcache.ParamCache(path)
+        if len(self.pstate.mav_param_set) != 0 or self.cache_wait_over:
+            # already fetching from the vehicle, so just keep the cache up to date
+            self.pstate.cache = cache
+            return
+        self.pstate.use_cache(cache, self.settings.paramsample)
     
     def idle_task(self):
         '''handle missing parameters'''
         self.pstate.vehicle_name = self.vehicle_name
+        self.pstate.download_check()
+        if self.settings.paramcache and self.pstate.cache is None and not self.cache_wait_over:
+            # wait for the autopilot's heartbeat to find its cache, but
+            # not for long if only other components are heard
+            tnow = time.time()
+            if self.first_heartbeat is None and tnow - self.start_time < 10:
+                return
+            if self.first_heartbeat is not None and tnow - self.first_heartbeat < 5:
+                return
+            self.cache_wait_over = True
         self.pstate.fetch_check(self.master)
 
+    def unload(self):
+        '''save any parameter changes to the cache'''
+        cache = self.pstate.cache
+        if cache is not None and cache.dirty and cache.complete():
+            cache.save()
+
     def cmd_param(self, args):
         '''control parameters'''
-        self.pstate.handle_command(self.master, args)
+        if len(args) > 1 and args[0] == 'help':
+            return self.param_help(args[1:])
+        if len(args) > 1 and args[0] == 'load':
+            return self.param_load(args[1:])
+        return self.pstate.handle_command(self.master, args)
+
+    def param_load(self, args):
+        '''load a parameter file, compiling the documentation for the
+        range check in the background the first time'''
+        pstate = self.pstate
+        vehicle_name = self.vehicle_name
+        pstate.vehicle_name = vehicle_name
+        wildcard = "*"
+        if len(args) > 1:
+            wildcard = args[1]
+        if vehicle_name is None or vehicle_name in pstate.docs or pstate.downloading():
+            return pstate.param_load(self.master, args[0], wildcard)
+        path = mp_util.dot_mavproxy("%s.xml" % vehicle_name)
+        if not os.path.exists(path):
+            return pstate.param_load(self.master, args[0], wildcard)
+        def done(future):
+            if future.exception() is not None:
+                print("Unable to read parameter documentation (%s), range check skipped" % future.exception())
+                pstate.param_load(self.master, args[0], wildcard, check_ranges=False)
+                return
+            pstate.docs[vehicle_name] = future.result()
+            pstate.param_load(self.master, args[0], wildcard)
+        # done() reports any error, so the future isn't returned
+        self.run_in_background(lambda: mp_paramdoc.load_docs(path), on_done=done)
+
+    def param_help(self, args):
+        '''show parameter help, parsing the documentation in the
+        background the first time'''
+        pstate = self.pstate
+        vehicle_name = self.vehicle_name
+        pstate.vehicle_name = vehicle_name
+        if vehicle_name in pstate.docs:
+            pstate.param_help_show(pstate.docs[vehicle_name], args)
+            return
+        path = pstate.param_help_path(args)
+        if path is None:
+            return
+        def done(future):
+            if future.exception() is None:
+                pstate.docs[vehicle_name] = future.result()
+                pstate.param_help_show(future.result(), args)
+        return self.run_in_background(lambda: mp_paramdoc.load_docs(path), on_done=done)
+
+    def complete_paramdoc(self, text):
+        '''complete a parameter name from the documentation, or from the
+        vehicle's parameters if it isn't loaded'''
+        docs = self.pstate.docs.get(self.vehicle_name, None)
+        if docs is None:
+            return self.mav_param.keys()
+        return docs.complete(text)
 
 def init(mpstate):
     '''initialise module'''
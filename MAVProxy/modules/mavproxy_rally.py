@@ -3,8 +3,8 @@
 """
 
 from pymavlink import mavwp
-import time
 from MAVProxy.modules.lib import mp_module
+from MAVProxy.modules.lib import mp_transfer
 
 class RallyModule(mp_module.MPModule):
     def __init__(self, mpstate):
@@ -12,6 +12,11 @@ class RallyModule(mp_module.MPModule):
         self.rallyloader = mavwp.MAVRallyLoader(mpstate.status.target_system, mpstate.status.target_component)
         self.add_command('rally', self.cmd_rally, "rally point control", ["<add|clear|list>",
                                     "<load|save> (FILENAME)"])
+        self.add_message_types(['RALLY_POINT'])
+        # the point transfer in progress, and the whole operation
+        # including any parameter changes
+        self.transfer = None
+        self.operation = None
 
     def cmd_rally(self, args):
         '''rally point commands'''
@@ -46,22 +51,28 @@ class RallyModule(mp_module.MPModule):
             if (len(args) > 3):
                 land_hdg = float(args[3])
     
+            if self.transfer_busy():
+                return
             self.rallyloader.create_and_append_rally_point(latlon[0] * 1e7, latlon[1] * 1e7, alt, break_alt, land_hdg, 0)
     
-            self.send_rally_points();
-    
             print("Added Rally point at %s %f" % (str(latlon), alt))
+            return self.send_rally_points()
     
         elif(args[0] == "clear"):
+            if self.transfer_busy():
+                return
             self.rallyloader.clear()
-            self.mav_param.mavset(self.master,'RALLY_TOTAL',0,3)
+            return self.param_set('RALLY_TOTAL', 0, 3)
     
         elif(args[0] == "list"):
-            self.list_rally_points()
+            return self.list_rally_points()
     
         elif(args[0] == "load"):
             if (len(args) < 2):
                 print("Usage: rally load filename")
+                return
+            if self.transfer_busy():
+                return
     
             try:
                 self.rallyloader.load(args[1])
@@ -69,9 +80,8 @@ class RallyModule(mp_module.MPModule):
                 print("Unable to load %s - %s" % (args[1], msg))
                 return
         
-            self.send_rally_points()
-    
             print("Loaded %u rally points from %s" % (self.rallyloader.rally_count(), args[1]))
+            return self.send_rally_points()
     
         elif(args[0] == "save"):
             if (len(args) < 2):
@@ -86,52 +96,71 @@ class RallyModule(mp_module.MPModule):
     
     def mavlink_packet(self, m):
         '''handle incoming mavlink packet'''
-        return #TODO when applicable
+        if m.get_type() == 'RALLY_POINT':
+            if self.transfer is not None:
+                self.transfer.handle(m.idx, m)
+
+    def transfer_busy(self):
+        '''return True if a transfer is already running'''
+        if self.operation is None or self.operation.done():
+            return False
+        if self.transfer is not None and self.transfer.active():
+            print("Rally transfer in progress: %s" % self.transfer.status())
+        else:
+            print("Rally transfer in progress")
+        return True
     
     def send_rally_points(self):
-        '''send rally points from fenceloader'''
-        self.mav_param.mavset(self.master,'RALLY_TOTAL',self.rallyloader.rally_count(),3)
-    
-        for i in range(self.rallyloader.rally_count()):
-            p = self.rallyloader.rally_point(i)
-            self.master.mav.send(p)
-           
-    def fetch_rally_point(self, i):
-        '''fetch one rally point'''
+        '''send rally points from rallyloader, checking each one by
+        fetching it back'''
+        points = [self.rallyloader.rally_point(i) for i in range(self.rallyloader.rally_count())]
+        future = self.param_set('RALLY_TOTAL', len(points), 3)
+        def upload(ok):
+            if not ok:
+                raise mp_transfer.TransferError("unable to set RALLY_TOTAL")
+            self.transfer = self.point_transfer('rally', len(points), self.send_fetch,
+                                                points=points, send=self.send_message,
+                                                match=rally_point_match)
+            return self.transfer.future
+        self.operation = future.then(upload)
+        return self.operation
+
+    def send_message(self, m):
+        '''send a message to the vehicle'''
+        self.master.mav.send(m)
+
+    def send_fetch(self, i):
+        '''request a rally point'''
         self.master.mav.rally_fetch_point_send(self.target_system,
-                                                    self.target_component, i)
-        tstart = time.time()
-        p = None
-        while time.time() - tstart < 1:
-            p = self.master.recv_match(type='RALLY_POINT', blocking=False)
-            if p is not None:
-                break
-            time.sleep(0.1)
-            continue
-        if p is None:
-            self.console.error("Failed to fetch rally point %u" % i)
-            return None
-        return p
+                                               self.target_component, i)
     
     def list_rally_points(self):
+        '''fetch and show the rally points'''
+        if self.transfer_busy():
+            return
         self.rallyloader.clear()
         rally_count = self.mav_param.get('RALLY_TOTAL',0)
         if rally_count == 0:
             print("No rally points")
             return
-        for i in range(int(rally_count)):
-            p = self.fetch_rally_point(i)
-            if p is None:
-                return
-            self.rallyloader.append_rally_point(p)
-    
-        for i in range(self.rallyloader.rally_count()):
-            p = self.rallyloader.rally_point(i)
-            self.console.writeln("lat=%f lng=%f alt=%f break_alt=%f land_dir=%f" % (p.lat * 1e-7, p.lng * 1e-7, p.alt, p.break_alt, p.land_dir))
+        self.transfer = self.point_transfer('rally', int(rally_count), self.send_fetch)
+        def done(points):
+            for p in points:
+                self.rallyloader.append_rally_point(p)
+            for i in range(self.rallyloader.rally_count()):
+                p = self.rallyloader.rally_point(i)
+                self.console.writeln("lat=%f lng=%f alt=%f break_alt=%f land_dir=%f" % (p.lat * 1e-7, p.lng * 1e-7, p.alt, p.break_alt, p.land_dir))
+        self.operation = self.transfer.future.then(done)
+        return self.operation
     
     def print_usage(self):
         print("Usage: rally <list|load|save|add|clear>")
         
+def rally_point_match(p, p2):
+    '''check a rally point fetched back from the vehicle'''
+    return (p.idx == p2.idx and p.lat == p2.lat and p.lng == p2.lng and
+            p.alt == p2.alt and p.break_alt == p2.break_alt)
+
 def init(mpstate):
     '''initialise module'''
     return RallyModule(mpstate)       
@@ -10,6 +10,7 @@ class RCSetupModule(mp_module.MPModule):
         self.clear_rc_cal()
         self.add_command('rccal', self.cmd_rccal, "RC calibration start/stop")
         self.add_command('rctrim', self.cmd_rctrim, "RC min/max trim")
+        self.add_message_types(['RC_CHANNELS_RAW'])
         print("rcsetup initialised")
     
     def clear_rc_cal(self):
@@ -26,6 +26,7 @@ class SensorsModule(mp_module.MPModule):
         super(SensorsModule, self).__init__(mpstate, "sensors", "monitor sensor consistancy")
         self.add_command('sensors', self.cmd_sensors, "show key sensors")
         self.add_command('speed', self.cmd_speed, "enable/disable speed report")
+        self.add_message_types(['VFR_HUD'])
 
         self.last_report = 0
         self.ok = True
@@ -20,6 +20,7 @@ class SerialModule(mp_module.MPModule):
               ]
             )
         self.add_completion_function('(SERIALSETTING)', self.serial_settings.completion)
+        self.add_message_types(['SERIAL_CONTROL'])
         self.locked = False
     
     def mavlink_packet(self, m):
@@ -44,6 +44,7 @@ class TrackerModule(mp_module.MPModule):
                           'param (TRACKERSETTING)'])
         self.add_completion_function('(TRACKERSETTING)', self.tracker_settings.completion)
         self.add_completion_function('(TRACKERPARAMETER)', self.complete_parameter)
+        self.add_message_types(['GLOBAL_POSITION_INT', 'SCALED_PRESSURE'])
 
     def complete_parameter(self, text):
         '''complete a tracker parameter'''
@@ -1,22 +1,34 @@
 #!/usr/bin/env python
 '''waypoint command handling'''
 
-import time, os, fnmatch
+import time, os, fnmatch, copy, struct
 from pymavlink import mavutil, mavwp
 from MAVProxy.modules.lib import mp_module
+from MAVProxy.modules.lib.mp_transfer import TransferError
 
 class WPModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(WPModule, self).__init__(mpstate, "wp", "waypoint handling", public = True)
         self.wp_op = None
         self.wp_save_filename = None
+        self.wp_sync_filename = None
         self.wploader = mavwp.MAVWPLoader()
-        self.loading_waypoints = False
-        self.loading_waypoint_lasttime = time.time()
+        # copies of the items on the vehicle as last downloaded or
+        # uploaded, or None if unknown
+        self.vehicle_mission = None
+        # the mission download and upload in progress
+        self.download = None
+        self.upload = None
+        self.list_timer = None
+        self.list_tries = 0
         self.last_waypoint = 0
-        self.wp_period = mavutil.periodic_event(0.5)
         self.add_command('wp', self.cmd_wp,       'waypoint management', ["<list|clear>",
-                                     "<load|update|save> (FILENAME)"])
+                                     "<load|update|save|sync> (FILENAME)"])
+        self.add_message_types(['WAYPOINT_COUNT', 'MISSION_COUNT',
+                                'WAYPOINT', 'MISSION_ITEM',
+                                'WAYPOINT_REQUEST', 'MISSION_REQUEST',
+                                'WAYPOINT_CURRENT', 'MISSION_CURRENT',
+                                'MISSION_ACK'])
         
         if self.continue_mode and self.logdir != None:
             waytxt = os.path.join(mpstate.status.logdir, 'way.txt')
@@ -29,82 +41,180 @@ class WPModule(mp_module.MPModule):
         '''handle an incoming mavlink packet'''
         mtype = m.get_type()
         if mtype in ['WAYPOINT_COUNT','MISSION_COUNT']:
-            if self.wp_op is None:
-                self.console.error("No waypoint load started")
-            else:
-                self.wploader.clear()
-                self.wploader.expected_count = m.count
-                self.console.writeln("Requesting %u waypoints t=%s now=%s" % (m.count,
-                                                                                 time.asctime(time.localtime(m._timestamp)),
-                                                                                 time.asctime()))
-                self.master.waypoint_request_send(0)
-    
-        elif mtype in ['WAYPOINT', 'MISSION_ITEM'] and self.wp_op != None:
-            if m.seq > self.wploader.count():
-                self.console.writeln("Unexpected waypoint number %u - expected %u" % (m.seq, self.wploader.count()))
-            elif m.seq < self.wploader.count():
-                # a duplicate
+            if self.download is not None and self.download.active():
+                # a reply to a re-sent list request
                 pass
+            elif self.wp_op is None:
+                # another GCS is talking to the vehicle about its
+                # mission, so our copy may be out of date
+                self.vehicle_mission = None
+                if self.download is None:
+                    self.console.error("No waypoint load started")
             else:
-                self.wploader.add(m)
-            if m.seq+1 < self.wploader.expected_count:
-                self.master.waypoint_request_send(m.seq+1)
-            else:
-                if self.wp_op == 'list':
-                    for i in range(self.wploader.count()):
-                        w = self.wploader.wp(i)
-                        print("%u %u %.10f %.10f %f p1=%.1f p2=%.1f p3=%.1f p4=%.1f cur=%u auto=%u" % (
-                            w.command, w.frame, w.x, w.y, w.z,
-                            w.param1, w.param2, w.param3, w.param4,
-                            w.current, w.autocontinue))
-                    if self.logdir != None:
-                        waytxt = os.path.join(self.logdir, 'way.txt')
-                        self.save_waypoints(waytxt)
-                        print("Saved waypoints to %s" % waytxt)
-                elif self.wp_op == "save":
-                    self.save_waypoints(self.wp_save_filename)
-                self.wp_op = None
+                self.start_download(m)
+    
+        elif mtype in ['WAYPOINT', 'MISSION_ITEM']:
+            if self.download is not None:
+                self.download.handle(m.seq, m)
     
         elif mtype in ["WAYPOINT_REQUEST", "MISSION_REQUEST"]:
+            if self.upload is None or not self.upload.active():
+                self.vehicle_mission = None
             self.process_waypoint_request(m, self.master)
+
+        elif mtype == 'MISSION_ACK':
+            if self.upload is None or not self.upload.active():
+                self.vehicle_mission = None
+            else:
+                accepted = (m.type == mavutil.mavlink.MAV_MISSION_ACCEPTED)
+                if accepted and len(self.upload.sent) < self.upload.count:
+                    # acknowledging something else, eg. the clear before an upload
+                    return
+                self.upload.handle_ack(accepted, mission_result_name(m.type))
     
         elif mtype in ["WAYPOINT_CURRENT", "MISSION_CURRENT"]:
             if m.seq != self.last_waypoint:
                 self.last_waypoint = m.seq
                 self.say("waypoint %u" % m.seq,priority='message')
-    
-    
-    
-    def idle_task(self):
-        '''handle missing waypoints'''
-        state = self
-        if state.wp_period.trigger():
-            # cope with packet loss fetching mission
-            if self.master.time_since('MISSION_ITEM') >= 2 and state.wploader.count() < getattr(state.wploader,'expected_count',0):
-                seq = state.wploader.count()
-                print("re-requesting WP %u" % seq)
-                self.master.waypoint_request_send(seq)
+
+    def request_list(self):
+        '''ask the vehicle for its mission, re-sending the request until
+        the count arrives'''
+        if self.upload is not None and self.upload.active():
+            print("Mission upload in progress: %s" % self.upload.status())
+            self.wp_op = None
+            return
+        if self.download is not None:
+            self.download.cancel()
+            self.download = None
+        if self.list_timer is not None:
+            self.mpstate.scheduler.cancel(self.list_timer)
+        self.list_tries = 0
+        self.send_list_request()
+
+    def send_list_request(self):
+        self.list_tries += 1
+        self.master.waypoint_request_list_send()
+        self.list_timer = self.mpstate.scheduler.add_oneshot('wp_list',
+                                                             self.settings.xfertimeout * self.list_tries,
+                                                             self.list_timeout)
+
+    def list_timeout(self):
+        '''re-send a list request that hasn't been answered'''
+        self.list_timer = None
+        if self.list_tries >= 5:
+            self.console.error("No mission count received")
+            self.wp_op = None
+            return
+        self.send_list_request()
+
+    def start_download(self, m):
+        '''fetch the mission items, keeping a window of requests in flight'''
+        if self.list_timer is not None:
+            self.mpstate.scheduler.cancel(self.list_timer)
+            self.list_timer = None
+        self.wploader.clear()
+        self.wploader.expected_count = m.count
+        self.console.writeln("Requesting %u waypoints t=%s now=%s" % (m.count,
+                                                                         time.asctime(time.localtime(m._timestamp)),
+                                                                         time.asctime()))
+        self.download = self.point_transfer('wp', m.count,
+                                            lambda seq: self.master.waypoint_request_send(seq))
+        self.download.future.then(self.download_done).add_done_callback(self.download_failed)
+
+    def download_done(self, items):
+        '''handle a completed mission download'''
+        for w in items:
+            self.wploader.add(w)
+        self.vehicle_mission = [copy.copy(w) for w in items]
+        transfer = self.download
+        if transfer.count > 0:
+            self.console.writeln("Received %u waypoints in %.1fs (%u retransmits)" % (
+                transfer.count, time.time() - transfer.start_time, transfer.retransmits))
+        if self.wp_op == 'list':
+            for i in range(self.wploader.count()):
+                w = self.wploader.wp(i)
+                print("%u %u %.10f %.10f %f p1=%.1f p2=%.1f p3=%.1f p4=%.1f cur=%u auto=%u" % (
+                    w.command, w.frame, w.x, w.y, w.z,
+                    w.param1, w.param2, w.param3, w.param4,
+                    w.current, w.autocontinue))
+            if self.logdir != None:
+                waytxt = os.path.join(self.logdir, 'way.txt')
+                self.save_waypoints(waytxt)
+                print("Saved waypoints to %s" % waytxt)
+        elif self.wp_op == "save":
+            self.save_waypoints(self.wp_save_filename)
+        elif self.wp_op == "sync":
+            self.wp_op = None
+            self.sync_waypoints(self.wp_sync_filename)
+        self.wp_op = None
+
+    def download_failed(self, future):
+        '''report a failed mission download'''
+        if future.cancelled() or future.exception() is None:
+            return
+        self.console.error(str(future.exception()))
+        self.wp_op = None
+
+    def start_upload(self, first, count, start, whole=False):
+        '''send count mission items from first as the vehicle requests
+        them. start() asks the vehicle to begin. whole is True if the
+        upload replaces the whole mission'''
+        if self.upload is not None:
+            self.upload.cancel()
+        self.upload = self.upload_transfer('wp', first, count, start, self.send_waypoint)
+        self.upload.whole = whole
+        self.upload.future.add_done_callback(self.upload_done)
+        return self.upload.future
+
+    def send_waypoint(self, seq):
+        '''send a mission item'''
+        wp = self.wploader.wp(seq)
+        wp.target_system = self.target_system
+        wp.target_component = self.target_component
+        self.master.mav.send(wp)
+
+    def upload_done(self, future):
+        '''report the end of a mission upload'''
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.vehicle_mission = None
+            self.console.error(str(future.exception()))
+            return
+        transfer = self.upload
+        if transfer.whole:
+            sent = "all %u waypoints" % transfer.count
+        elif transfer.count == 1:
+            sent = "waypoint %u" % transfer.first
+        else:
+            sent = "waypoints %u-%u" % (transfer.first, transfer.first + transfer.count - 1)
+        if future.result():
+            self.console.writeln("Sent %s (%u retransmits)" % (sent, transfer.retransmits))
+        else:
+            self.console.writeln("Sent %s, but the vehicle didn't acknowledge them" % sent)
+        self.note_uploaded(transfer)
+
+    def note_uploaded(self, transfer):
+        '''update the copy of the vehicle mission after an upload'''
+        if transfer.whole:
+            self.vehicle_mission = [copy.copy(self.wploader.wp(i)) for i in range(transfer.count)]
+            return
+        end = transfer.first + transfer.count
+        if self.vehicle_mission is None or end > len(self.vehicle_mission):
+            # a partial upload can't change the length of the mission
+            self.vehicle_mission = None
+            return
+        for i in range(transfer.first, end):
+            self.vehicle_mission[i] = copy.copy(self.wploader.wp(i))
     
     def process_waypoint_request(self, m, master):
         '''process a waypoint request from the master'''
-        state = self
-        if (not state.loading_waypoints or
-            time.time() > state.loading_waypoint_lasttime + 10.0):
-            state.loading_waypoints = False
+        if self.upload is None or not self.upload.active():
             self.console.error("not loading waypoints")
             return
-        if m.seq >= state.wploader.count():
-            self.console.error("Request for bad waypoint %u (max %u)" % (m.seq, state.wploader.count()))
-            return
-        wp = state.wploader.wp(m.seq)
-        wp.target_system = self.target_system
-        wp.target_component = self.target_component
-        self.master.mav.send(state.wploader.wp(m.seq))
-        state.loading_waypoint_lasttime = time.time()
-        self.console.writeln("Sent waypoint %u : %s" % (m.seq, state.wploader.wp(m.seq)))
-        if m.seq == state.wploader.count() - 1:
-            state.loading_waypoints = False
-            self.console.writeln("Sent all %u waypoints" % state.wploader.count())
+        if not self.upload.handle_request(m.seq):
+            self.console.error("Request for bad waypoint %u (max %u)" % (m.seq, self.wploader.count()))
     
     def load_waypoints(self, filename):
         '''load waypoints from a file'''
@@ -121,10 +231,12 @@ class WPModule(mp_module.MPModule):
         self.master.waypoint_clear_all_send()
         if state.wploader.count() == 0:
             return
-    
-        state.loading_waypoints = True
-        state.loading_waypoint_lasttime = time.time()
-        self.master.waypoint_count_send(state.wploader.count())
+        return self.send_all_waypoints()
+
+    def send_all_waypoints(self):
+        '''upload the whole mission'''
+        count = self.wploader.count()
+        return self.start_upload(0, count, lambda: self.master.waypoint_count_send(count), whole=True)
     
     def update_waypoints(self, filename, wpnum):
         '''update waypoints from a file'''
@@ -147,17 +259,88 @@ class WPModule(mp_module.MPModule):
         else:
             print("Loaded updated waypoint %u from %s" % (wpnum, filename))
     
-        state.loading_waypoints = True
-        state.loading_waypoint_lasttime = time.time()
         if wpnum == -1:
             start = 0
             end = state.wploader.count()-1
         else:
             start = wpnum
             end = wpnum
-        self.master.mav.mission_write_partial_list_send(self.target_system,
-                                                             self.target_component,
-                                                             start, end)
+        return self.send_partial(start, end)
+
+    def send_partial(self, start, end):
+        '''upload the mission items from start to end'''
+        def begin():
+            self.master.mav.mission_write_partial_list_send(self.target_system,
+                                                            self.target_component,
+                                                            start, end)
+        return self.start_upload(start, end - start + 1, begin)
+
+    def sync_waypoints(self, filename):
+        '''upload only the items in a file that differ from the mission on
+        the vehicle, then fetch them back to check them'''
+        if self.upload is not None and self.upload.active():
+            print("Mission upload in progress: %s" % self.upload.status())
+            return
+        if self.vehicle_mission is None:
+            print("Fetching the vehicle mission to compare with %s" % filename)
+            self.wp_sync_filename = filename
+            self.wp_op = "sync"
+            self.request_list()
+            return
+        self.wploader.target_system = self.target_system
+        self.wploader.target_component = self.target_component
+        try:
+            self.wploader.load(filename)
+        except Exception, msg:
+            print("Unable to load %s - %s" % (filename, msg))
+            return
+        count = self.wploader.count()
+        if count == 0:
+            print("No waypoints found in %s" % filename)
+            return
+        old = self.vehicle_mission
+        if count != len(old):
+            # a partial upload can't change the length of the mission
+            print("%s has %u waypoints and the vehicle %u, sending them all" % (filename, count, len(old)))
+            return self.send_all_waypoints()
+        changed = [i for i in range(count) if mission_item_changed(self.wploader.wp(i), old[i])]
+        if len(changed) == 0:
+            print("Vehicle mission already matches %s" % filename)
+            return
+        ranges = item_ranges(changed)
+        print("Sending %u of %u waypoints in %u ranges: %s" % (
+            len(changed), count, len(ranges),
+            ' '.join(["%u-%u" % r if r[0] != r[1] else str(r[0]) for r in ranges])))
+        start_time = time.time()
+        future = self.send_partial(ranges[0][0], ranges[0][1])
+        for (start, end) in ranges[1:]:
+            future = future.then(lambda ok, start=start, end=end: self.send_partial(start, end))
+        future = future.then(lambda ok: self.verify_waypoints(changed))
+        def done(f):
+            if f.cancelled():
+                return
+            if f.exception() is not None:
+                self.vehicle_mission = None
+                self.console.error("wp sync failed: %s" % f.exception())
+                return
+            self.console.writeln("Synced %u of %u waypoints with %s in %.1fs" % (
+                len(changed), count, filename, time.time() - start_time))
+        future.add_done_callback(done)
+
+    def verify_waypoints(self, items):
+        '''fetch the listed mission items back from the vehicle and check
+        they match ours'''
+        if self.download is not None:
+            self.download.cancel()
+        self.download = self.point_transfer('wp verify', 0,
+                                            lambda seq: self.master.waypoint_request_send(seq),
+                                            indexes=items)
+        def check(received):
+            bad = [seq for (seq, w) in zip(items, received) if mission_item_changed(self.wploader.wp(seq), w)]
+            if bad:
+                raise TransferError("waypoints %s differ on the vehicle" % ' '.join([str(i) for i in bad]))
+            return len(items)
+        return self.download.future.then(check)
     
     def save_waypoints(self, filename):
         '''save waypoints to a file'''
@@ -185,9 +368,7 @@ class WPModule(mp_module.MPModule):
         self.master.waypoint_clear_all_send()
         if state.wploader.count() == 0:
             return
-        state.loading_waypoints = True
-        state.loading_waypoint_lasttime = time.time()
-        self.master.waypoint_count_send(state.wploader.count())
+        self.send_all_waypoints()
     
     def wp_loop(self):
         '''close the loop on a mission'''
@@ -204,10 +385,8 @@ class WPModule(mp_module.MPModule):
                                                           0, 1, 1, -1, 0, 0, 0, 0, 0)
         loader.add(wp)
         loader.add(loader.wp(1))
-        state.loading_waypoints = True
-        state.loading_waypoint_lasttime = time.time()
-        self.master.waypoint_count_send(state.wploader.count())
         print("Closed loop on mission")
+        return self.send_all_waypoints()
     
     def set_home_location(self):
         '''set home location from last map click'''
@@ -225,18 +404,14 @@ class WPModule(mp_module.MPModule):
         w.x = lat
         w.y = lon
         state.wploader.set(w, 0)
-        state.loading_waypoints = True
-        state.loading_waypoint_lasttime = time.time()
-        self.master.mav.mission_write_partial_list_send(self.target_system,
-                                                             self.target_component,
-                                                             0, 0)
+        return self.send_partial(0, 0)
         
     
     def cmd_wp(self, args):
         '''waypoint commands'''
         state = self
         if len(args) < 1:
-            print("usage: wp <list|load|update|save|set|clear|loop>")
+            print("usage: wp <list|load|update|sync|save|set|clear|loop>")
             return
     
         if args[0] == "load":
@@ -255,14 +430,14 @@ class WPModule(mp_module.MPModule):
             self.update_waypoints(args[1], wpnum)
         elif args[0] == "list":
             state.wp_op = "list"
-            self.master.waypoint_request_list_send()
+            self.request_list()
         elif args[0] == "save":
             if len(args) != 2:
                 print("usage: wp save <filename>")
                 return
             state.wp_save_filename = args[1]
             state.wp_op = "save"
-            self.master.waypoint_request_list_send()
+            self.request_list()
         elif args[0] == "savelocal":
             if len(args) != 2:
                 print("usage: wp savelocal <filename>")
@@ -273,6 +448,11 @@ class WPModule(mp_module.MPModule):
                 print("usage: wp show <filename>")
                 return
             state.wploader.load(args[1])
+        elif args[0] == "sync":
+            if len(args) != 2:
+                print("usage: wp sync <filename>")
+                return
+            self.sync_waypoints(args[1])
         elif args[0] == "set":
             if len(args) != 2:
                 print("usage: wp set <wpindex>")
@@ -280,6 +460,7 @@ class WPModule(mp_module.MPModule):
             self.master.waypoint_set_current_send(int(args[1]))
         elif args[0] == "clear":
             self.master.waypoint_clear_all_send()
+            self.vehicle_mission = None
         elif args[0] == "draw":
             if not 'draw_lines' in self.mpstate.map_functions:
                 print("No map drawing available")
@@ -292,17 +473,53 @@ class WPModule(mp_module.MPModule):
             self.mpstate.map_functions['draw_lines'](self.wp_draw_callback)
             print("Drawing waypoints on map at altitude %d" % self.settings.wpalt)
         elif args[0] == "sethome":
-            self.set_home_location()        
+            self.set_home_location()
         elif args[0] == "loop":
-            self.wp_loop()        
+            self.wp_loop()
         else:
-            print("Usage: wp <list|load|save|set|show|clear|draw|loop>")
+            print("Usage: wp <list|load|update|sync|save|set|show|clear|draw|loop>")
 
     def fetch(self):
         """Download wpts from vehicle (this operation is public to support other modules)"""
         if self.wp_op is None:  # If we were already doing a list or save, just restart the fetch without changing the operation
             self.wp_op = "fetch"
-        self.master.waypoint_request_list_send()
+        self.request_list()
+
+def mission_result_name(result):
+    '''return the name of a MAV_MISSION_RESULT value'''
+    try:
+        return mavutil.mavlink.enums['MAV_MISSION_RESULT'][result].name
+    except Exception:
+        return str(result)
+
+def float32(v):
+    '''return the bytes of v as the vehicle stores it'''
+    try:
+        return struct.pack('<f', v)
+    except (OverflowError, struct.error):
+        return v
+
+def mission_item_changed(a, b):
+    '''return True if two mission items differ in anything the vehicle
+    stores. Positions are compared as single precision floats, as they
+    are sent'''
+    if a.command != b.command or a.frame != b.frame or a.autocontinue != b.autocontinue:
+        return True
+    for field in ['param1', 'param2', 'param3', 'param4', 'x', 'y', 'z']:
+        if float32(getattr(a, field)) != float32(getattr(b, field)):
+            return True
+    return False
+
+def item_ranges(items):
+    '''group a sorted list of item numbers into (first, last) ranges of
+    consecutive items'''
+    ranges = []
+    for i in items:
+        if ranges and ranges[-1][1] == i - 1:
+            ranges[-1] = (ranges[-1][0], i)
+        else:
+            ranges.append((i, i))
+    return ranges
 
 def init(mpstate):
     '''initialise module'''
@@ -8,7 +8,7 @@ import sys, time, os
 
 from pymavlink import mavutil, mavwp, mavextra
 from MAVProxy.modules.mavproxy_map import mp_slipmap, mp_tile
-from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.lib import mp_util, mp_tlogindex
 import functools
 
 try:
@@ -81,7 +81,7 @@ colourmap = {
 
 def mavflightview(filename):
     print("Loading %s ..." % filename)
-    mlog = mavutil.mavlink_connection(filename)
+    mlog = mp_util.mavlink_connection(filename)
     wp = mavwp.MAVWPLoader()
     if opts.mission is not None:
         wp.load(opts.mission)
@@ -98,10 +98,21 @@ def mavflightview(filename):
     if len(types) == 1:
         types.extend(['GPS','GLOBAL_POSITION_INT'])
     print("Looking for types %s" % str(types))
-    while True:
-        m = mlog.recv_match(type=types)
-        if m is None:
-            break
+    index = None
+    if opts.condition is None:
+        # conditions can use any message, so need the whole log
+        index = mp_tlogindex.load(filename)
+    if index is not None:
+        # the HEARTBEATs keep the flight mode up to date
+        mlog = mavutil.mavlogfile(filename)
+        offsets = index.type_offsets(mavutil.mavlink, types + ['HEARTBEAT'])
+        print("Using index, reading %u of %u messages" % (len(offsets), index.records))
+        messages = mp_tlogindex.read_messages(mlog, offsets)
+    else:
+        messages = iter(lambda: mlog.recv_match(type=types), None)
+    for m in messages:
+        if m.get_type() == 'HEARTBEAT':
+            continue
         if m.get_type() == 'MISSION_ITEM':
             wp.set(m, m.seq)            
             continue
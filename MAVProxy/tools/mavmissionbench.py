@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+'''
+benchmark mission transfers over a simulated lossy link
+
+A simulated vehicle is connected through a radio link with latency,
+limited bandwidth and random packet loss in each direction. Missions
+are downloaded with the windowed transfer engine, and the old one at a
+time method with a fixed timeout for comparison, and the throughput of
+each is reported. The simulation runs in real time.
+'''
+
+import sys, time, random
+
+from MAVProxy.modules.lib import mp_scheduler, mp_transfer, mp_worker
+
+from optparse import OptionParser
+parser = OptionParser("mavmissionbench.py [options]")
+parser.add_option("--items", type='int', default=300, help="number of mission items")
+parser.add_option("--loss", type='float', default=0.1, help="packet loss in each direction, 0 to 1")
+parser.add_option("--latency", type='float', default=0.05, help="one way latency in seconds")
+parser.add_option("--baud", type='int', default=57600, help="link speed in bits per second")
+parser.add_option("--windows", default='1,2,4,8,16', help="comma separated window sizes to try")
+parser.add_option("--legacy", action='store_true', default=False,
+                  help="also run one at a time with a fixed 2 second timeout")
+parser.add_option("--upload", action='store_true', default=False,
+                  help="also benchmark an upload driven by the vehicle")
+parser.add_option("--seed", type='int', default=None, help="random seed, for repeatable loss")
+
+(opts, args) = parser.parse_args()
+
+# MAVLink 1.0 frame sizes
+REQUEST_LEN = 12
+ITEM_LEN = 45
+ACK_LEN = 11
+
+class SimLink(object):
+    '''one direction of a radio link'''
+    def __init__(self, scheduler, deliver):
+        self.scheduler = scheduler
+        self.deliver = deliver
+        self.free_at = 0
+        self.sent = 0
+        self.lost = 0
+
+    def send(self, nbytes, *args):
+        '''send a packet, which is delivered by calling deliver(*args)'''
+        tnow = time.time()
+        start = max(tnow, self.free_at)
+        # 10 bits a byte on a serial radio
+        self.free_at = start + nbytes * 10.0 / opts.baud
+        self.sent += 1
+        if random.random() < opts.loss:
+            self.lost += 1
+            return
+        self.scheduler.add_oneshot('sim', self.free_at + opts.latency - tnow,
+                                   lambda: self.deliver(*args))
+
+def run(scheduler, future):
+    '''run the scheduler until the future completes'''
+    while not future.done():
+        scheduler.run_pending()
+        deadline = scheduler.next_deadline()
+        delay = 0.05
+        if deadline is not None:
+            delay = min(delay, deadline - time.time())
+        if delay > 0:
+            time.sleep(delay)
+
+def bench_download(name, window, timeout, adaptive):
+    '''download the mission, returning the transfer'''
+    scheduler = mp_scheduler.Scheduler()
+    future = mp_worker.Future(mp_worker.WorkerPool(0))
+    transfer = [None]
+    down = SimLink(scheduler, lambda seq: transfer[0].handle(seq, seq))
+    # the vehicle answers each request with the item
+    up = SimLink(scheduler, lambda seq: down.send(ITEM_LEN, seq))
+    transfer[0] = mp_transfer.PointTransfer(name, opts.items, lambda seq: up.send(REQUEST_LEN, seq),
+                                            future, scheduler, window=window, timeout=timeout,
+                                            retries=100, adaptive=adaptive)
+    transfer[0].start()
+    run(scheduler, future)
+    return transfer[0]
+
+def bench_upload(vehicle_timeout=1.0):
+    '''upload the mission, with the vehicle requesting each item and
+    re-requesting after a timeout, as ArduPilot does'''
+    scheduler = mp_scheduler.Scheduler()
+    future = mp_worker.Future(mp_worker.WorkerPool(0))
+    state = {'next': 0, 'timer': None}
+    transfer = [None]
+    def vehicle_request():
+        up.send(REQUEST_LEN, state['next'])
+        if state['timer'] is not None:
+            scheduler.cancel(state['timer'])
+        state['timer'] = scheduler.add_oneshot('vehicle', vehicle_timeout, vehicle_request)
+    def vehicle_item(seq):
+        if seq != state['next']:
+            return
+        state['next'] += 1
+        if state['next'] == opts.items:
+            scheduler.cancel(state['timer'])
+            up.send(ACK_LEN, None)
+            return
+        vehicle_request()
+    def gcs_receive(seq):
+        if seq is None:
+            transfer[0].handle_ack(True)
+        else:
+            transfer[0].handle_request(seq)
+    up = SimLink(scheduler, gcs_receive)
+    down = SimLink(scheduler, vehicle_item)
+    transfer[0] = mp_transfer.UploadTransfer('upload', 0, opts.items, vehicle_request,
+                                             lambda seq: down.send(ITEM_LEN, seq),
+                                             future, scheduler, stall_timeout=3.0)
+    transfer[0].start()
+    run(scheduler, future)
+    return transfer[0]
+
+def report(name, transfer):
+    dt = time.time() - transfer.start_time
+    print("%-16s %7.1fs %8.1f items/s %6u retransmits" % (name, dt, opts.items / dt, transfer.retransmits))
+
+if opts.seed is not None:
+    random.seed(opts.seed)
+
+print("%u items, %.0f%% loss, %.0fms latency, %u baud" % (
+    opts.items, opts.loss * 100, opts.latency * 1000, opts.baud))
+if opts.legacy:
+    report('one at a time', bench_download('legacy', 1, 2.0, False))
+for window in [int(w) for w in opts.windows.split(',')]:
+    report('window %u' % window, bench_download('window', window, 1.0, True))
+if opts.upload:
+    report('upload', bench_upload())
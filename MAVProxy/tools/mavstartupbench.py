@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+measure MAVProxy startup time
+
+Runs MAVProxy a number of times replaying a log, and times how long it
+takes from starting the process until the first packet arrives on a UDP
+output.
+'''
+
+import sys, os, time, socket, subprocess, tempfile, select, shutil
+
+from optparse import OptionParser
+parser = OptionParser("mavstartupbench.py [options] <LOGFILE>")
+parser.add_option("--runs", type='int', default=5, help="number of runs")
+parser.add_option("--port", type='int', default=14590, help="UDP port to receive packets on")
+parser.add_option("--timeout", type='float', default=30, help="seconds to wait for a packet")
+parser.add_option("--eager-modules", action='store_true', default=False,
+                  help="load all standard modules at startup")
+parser.add_option("--show", action='store_true', default=False,
+                  help="show MAVProxy's breakdown of the last run")
+parser.add_option("--mavproxy", default=None, help="path to mavproxy.py")
+
+(opts, args) = parser.parse_args()
+
+if len(args) != 1:
+    print("Usage: mavstartupbench.py [options] <LOGFILE>")
+    sys.exit(1)
+
+mavproxy = opts.mavproxy
+if mavproxy is None:
+    mavproxy = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mavproxy.py')
+
+def run_once(logdir):
+    '''start MAVProxy and return the seconds until the first packet, and its output'''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', opts.port))
+    cmd = [sys.executable, mavproxy, '--replay', args[0], '--replay-speed', '0',
+           '--out', 'udpout:127.0.0.1:%u' % opts.port,
+           '--logfile', os.path.join(logdir, 'bench.tlog'), '--startup-bench']
+    if opts.eager_modules:
+        cmd.append('--eager-modules')
+    # output goes to a file, as a pipe could fill up and stall MAVProxy
+    # before the first packet
+    out = open(os.path.join(logdir, 'output.txt'), 'w+')
+    t0 = time.time()
+    # stdin is kept open so MAVProxy doesn't see EOF and exit
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out,
+                         stderr=subprocess.STDOUT)
+    (rin, win, xin) = select.select([sock], [], [], opts.timeout)
+    elapsed = time.time() - t0
+    sock.close()
+    p.kill()
+    p.wait()
+    p.stdin.close()
+    out.seek(0)
+    output = out.read()
+    out.close()
+    if not rin:
+        return (None, output)
+    return (elapsed, output)
+
+logdir = tempfile.mkdtemp()
+times = []
+output = ''
+for i in range(opts.runs):
+    (elapsed, output) = run_once(logdir)
+    if elapsed is None:
+        print("run %u: no packet after %.0fs" % (i+1, opts.timeout))
+        continue
+    print("run %u: %.1fms" % (i+1, elapsed*1000))
+    times.append(elapsed)
+
+shutil.rmtree(logdir)
+
+if len(times) == 0:
+    sys.exit(1)
+times.sort()
+print("min %.1fms median %.1fms max %.1fms over %u runs" % (
+    times[0]*1000, times[len(times)//2]*1000, times[-1]*1000, len(times)))
+if opts.show:
+    sys.stdout.write(output)
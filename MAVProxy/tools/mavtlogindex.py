@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+'''
+build sidecar indexes for telemetry logs
+'''
+
+import sys, os, time
+
+from pymavlink import mavutil
+from MAVProxy.modules.lib import mp_frame, mp_tlogindex
+
+from optparse import OptionParser
+parser = OptionParser("mavtlogindex.py [options] <LOGFILE...>")
+parser.add_option("--interval", type='float', default=1.0, help="time table interval in seconds")
+parser.add_option("--force", action='store_true', default=False, help="rebuild indexes that are up to date")
+parser.add_option("--show", action='store_true', default=False, help="show the message counts in each index")
+
+(opts, args) = parser.parse_args()
+
+if len(args) < 1:
+    print("Usage: mavtlogindex.py [options] <LOGFILE...>")
+    sys.exit(1)
+
+names = mp_frame.message_table(mavutil.mavlink).names
+
+for filename in args:
+    idx = None
+    if not opts.force:
+        idx = mp_tlogindex.load(filename)
+    if idx is None:
+        t0 = time.time()
+        try:
+            idx = mp_tlogindex.build(filename, opts.interval)
+        except ValueError as e:
+            print(e)
+            continue
+        idx.save(mp_tlogindex.index_name(filename))
+        print("%s: indexed %u records in %.1fs" % (filename, idx.records, time.time() - t0))
+    else:
+        print("%s: index up to date, %u records" % (filename, idx.records))
+    if opts.show:
+        print("  %u seconds, %u message types" % (len(idx.time_offsets) * idx.interval, len(idx.offsets)))
+        for msgid in sorted(idx.offsets.keys(), key=lambda x: -len(idx.offsets[x])):
+            print("  %-24s %u" % (names.get(msgid, str(msgid)), len(idx.offsets[msgid])))
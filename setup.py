@@ -42,6 +42,8 @@ on how to use MAVProxy.''',
       install_requires=['pymavlink>=1.1.2',
                         'pyserial'],
       scripts=['MAVProxy/mavproxy.py', 'MAVProxy/tools/mavflightview.py',
+               'MAVProxy/tools/mavtlogindex.py', 'MAVProxy/tools/mavstartupbench.py',
+               'MAVProxy/tools/mavmissionbench.py',
                'MAVProxy/modules/mavproxy_map/mp_slipmap.py',
                'MAVProxy/modules/mavproxy_map/mp_tile.py'],
       package_data={'MAVProxy':
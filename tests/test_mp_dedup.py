@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+'''
+tests for duplicate packet suppression
+'''
+
+import unittest
+
+from MAVProxy.modules.lib import mp_dedup
+
+class DeduplicatorTest(unittest.TestCase):
+    def setUp(self):
+        self.dedup = mp_dedup.Deduplicator()
+
+    def test_copy(self):
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 10, 0))
+        self.assertTrue(self.dedup.is_duplicate(1, 1, 10, 0))
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 11, 0))
+        self.assertTrue(self.dedup.is_duplicate(1, 1, 11, 0))
+        self.assertEqual(self.dedup.duplicates, 2)
+
+    def test_sources_are_separate(self):
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 10, 0))
+        self.assertFalse(self.dedup.is_duplicate(2, 1, 10, 0))
+        self.assertFalse(self.dedup.is_duplicate(1, 2, 10, 0))
+
+    def test_msgid_differs(self):
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 10, 0))
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 10, 30))
+
+    def test_late_copy(self):
+        # a copy arriving over a slower link after newer packets
+        for seq in range(10, 20):
+            self.assertFalse(self.dedup.is_duplicate(1, 1, seq, 0))
+        self.assertTrue(self.dedup.is_duplicate(1, 1, 12, 0))
+
+    def test_late_first_copy(self):
+        # a packet that was lost on the fast link arrives on the slow one
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 10, 0))
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 12, 0))
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 11, 0))
+        self.assertTrue(self.dedup.is_duplicate(1, 1, 11, 0))
+
+    def test_wraparound(self):
+        for seq in range(250, 256) + range(0, 5):
+            self.assertFalse(self.dedup.is_duplicate(1, 1, seq, 0))
+        self.assertTrue(self.dedup.is_duplicate(1, 1, 254, 0))
+        self.assertTrue(self.dedup.is_duplicate(1, 1, 2, 0))
+
+    def test_window_clears_old_slots(self):
+        # after a full cycle of sequence numbers the same seq is a new packet
+        for i in range(3):
+            for seq in range(0, 256, 100):
+                self.assertFalse(self.dedup.is_duplicate(1, 1, seq, 0))
+        self.assertEqual(self.dedup.duplicates, 0)
+
+    def test_skipped_slots_cleared(self):
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 0, 0))
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 100, 0))
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 200, 0))
+        # sliding on to 44 wraps past 0's slot, so seq 0 is new again
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 44, 0))
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 0, 0))
+
+    def test_old_lap_never_matches(self):
+        for seq in range(0, 100):
+            self.assertFalse(self.dedup.is_duplicate(1, 1, seq, 0))
+        w = self.dedup.sources[(1, 1)]
+        w.times = [t - (self.dedup.max_delay + 1) for t in w.times]
+        # seq 50 is long past, so this is a new packet after a jump
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 50, 0))
+        self.assertEqual(self.dedup.duplicates, 0)
+        self.assertTrue(self.dedup.is_duplicate(1, 1, 50, 0))
+
+    def test_jump_resets_window(self):
+        for seq in range(0, 10):
+            self.assertFalse(self.dedup.is_duplicate(1, 1, seq, 0))
+        # a jump of more than a window after a burst of lost packets
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 200, 0))
+        self.assertEqual(self.dedup.sources[(1, 1)].newest, 200)
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 201, 0))
+        self.assertTrue(self.dedup.is_duplicate(1, 1, 200, 0))
+        self.assertEqual(self.dedup.duplicates, 1)
+
+    def test_timeout_resets_window(self):
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 10, 0))
+        self.dedup.sources[(1, 1)].last_seen -= self.dedup.timeout + 1
+        self.assertFalse(self.dedup.is_duplicate(1, 1, 10, 0))
+
+    def test_radio_never_duplicate(self):
+        (sysid, compid) = mp_dedup.RADIO_SOURCE
+        self.assertFalse(self.dedup.is_duplicate(sysid, compid, 10, 166))
+        self.assertFalse(self.dedup.is_duplicate(sysid, compid, 10, 166))
+        self.assertEqual(self.dedup.duplicates, 0)
+
+if __name__ == '__main__':
+    unittest.main()
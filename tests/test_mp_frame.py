@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+'''
+tests for byte level MAVLink framing
+'''
+
+import unittest
+
+from pymavlink.dialects.v10 import ardupilotmega as mavlink1
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from MAVProxy.modules.lib import mp_frame
+
+def heartbeat(mav, seq=0):
+    mav.seq = seq
+    return str(mav.heartbeat_encode(1, 2, 3, 4, 5).pack(mav))
+
+def param_value(mav, name, value, idx, seq=0):
+    mav.seq = seq
+    return str(mav.param_value_encode(name, value, 9, 100, idx).pack(mav))
+
+class FramerTest(unittest.TestCase):
+    def setUp(self):
+        self.mav = mavlink1.MAVLink(None, 7, 1)
+        self.framer = mp_frame.Framer(mp_frame.message_table(mavlink1))
+
+    def test_x25crc(self):
+        # the reference checksum of "123456789" for CRC-16/MCRF4XX
+        self.assertEqual(mp_frame.x25crc('123456789'), 0x6f91)
+
+    def test_single_frame(self):
+        buf = heartbeat(self.mav, 42)
+        frames = self.framer.parse(buf)
+        self.assertEqual(frames, [(0, buf, 7, 1, 42)])
+        self.assertEqual(self.framer.buf, '')
+        self.assertEqual(self.framer.errors, 0)
+
+    def test_chunked(self):
+        bufs = [heartbeat(self.mav, 1), param_value(self.mav, 'FOO', 1.5, 3), heartbeat(self.mav, 2)]
+        stream = ''.join(bufs)
+        frames = []
+        for i in range(0, len(stream), 5):
+            frames.extend(self.framer.parse(stream[i:i+5]))
+        self.assertEqual([f[1] for f in frames], bufs)
+        self.assertEqual([f[0] for f in frames], [0, mavlink1.MAVLINK_MSG_ID_PARAM_VALUE, 0])
+        self.assertEqual(self.framer.frames, 3)
+        self.assertEqual(self.framer.errors, 0)
+
+    def test_partial_header(self):
+        buf = heartbeat(self.mav)
+        self.assertEqual(self.framer.parse(buf[:3]), [])
+        self.assertEqual(self.framer.buf, buf[:3])
+        self.assertEqual(len(self.framer.parse(buf[3:])), 1)
+
+    def test_resync_on_junk(self):
+        buf = heartbeat(self.mav)
+        frames = self.framer.parse('junk' + buf + 'more' + buf)
+        self.assertEqual([f[1] for f in frames], [buf, buf])
+        self.assertEqual(self.framer.errors, 2)
+        self.assertEqual(self.framer.bad_bytes, 8)
+
+    def test_resync_on_bad_crc(self):
+        good = heartbeat(self.mav)
+        bad = good[:-1] + chr(ord(good[-1]) ^ 0xff)
+        frames = self.framer.parse(bad + good)
+        self.assertEqual([f[1] for f in frames], [good])
+        self.assertTrue(self.framer.errors >= 1)
+
+    def test_false_magic_in_payload(self):
+        # a magic byte inside a corrupt frame must not hide the next frame
+        good = heartbeat(self.mav)
+        frames = self.framer.parse('\xfe\x05\x00' + good)
+        self.assertEqual([f[1] for f in frames], [good])
+
+    def test_mavlink2(self):
+        mav = mavlink2.MAVLink(None, 9, 2)
+        framer = mp_frame.Framer(mp_frame.message_table(mavlink2))
+        bufs = [heartbeat(mav, 5), param_value(mav, 'BAR', 2.0, 1, 6)]
+        stream = ''.join(bufs)
+        frames = []
+        for c in stream:
+            frames.extend(framer.parse(c))
+        self.assertEqual([(f[1], f[2], f[3], f[4]) for f in frames],
+                         [(bufs[0], 9, 2, 5), (bufs[1], 9, 2, 6)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''
+tests for per-link traffic accounting
+'''
+
+import unittest
+
+from MAVProxy.modules.lib import mp_linkstats
+
+class FakeTime(object):
+    '''a clock the test moves by hand'''
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class LinkStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeTime()
+        self.real_time = mp_linkstats.time
+        mp_linkstats.time = self.clock
+
+    def tearDown(self):
+        mp_linkstats.time = self.real_time
+
+    def test_counts(self):
+        stats = mp_linkstats.LinkStats()
+        stats.update(0, 1, 17)
+        stats.update(30, 1, 36)
+        stats.update(30, 2, 36)
+        self.assertEqual((stats.pkts, stats.bytes), (3, 89))
+        self.assertEqual((stats.msg_pkts[30], stats.msg_bytes[30]), (2, 72))
+        self.assertEqual((stats.src_pkts[1], stats.src_pkts[2]), (2, 1))
+
+    def test_rates(self):
+        stats = mp_linkstats.LinkStats()
+        for i in range(10):
+            stats.update(0, 1, 10)
+        for i in range(20):
+            stats.update(30, 2, 30)
+        self.clock.now += 2
+        stats.sample()
+        self.assertEqual(stats.rates(), (15.0, 350.0))
+        self.assertEqual(stats.message_rates(), [(30, 10.0, 300.0), (0, 5.0, 50.0)])
+        self.assertEqual(stats.source_rates(), [(2, 10.0, 300.0), (1, 5.0, 50.0)])
+
+    def test_rolling_window(self):
+        stats = mp_linkstats.LinkStats(window=2)
+        stats.update(0, 1, 100)
+        for i in range(3):
+            self.clock.now += 1
+            stats.sample()
+        # the packet was counted more than 2 seconds ago
+        self.assertEqual(stats.rates(), (0.0, 0.0))
+        self.assertEqual(stats.message_rates(), [])
+
+    def test_mavlink2_ids(self):
+        stats = mp_linkstats.LinkStats()
+        stats.update(12900, 1, 50)
+        self.clock.now += 1
+        stats.sample()
+        stats.update(12901, 1, 60)
+        stats.update(12900, 1, 50)
+        self.clock.now += 1
+        stats.sample()
+        # an ID first seen after the oldest snapshot is still reported
+        self.assertEqual(stats.message_rates(), [(12900, 1.0, 50.0), (12901, 0.5, 30.0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+'''
+tests for the shared memory ring used by link worker processes
+'''
+
+import multiprocessing, os, signal, unittest
+
+from pymavlink import mavutil
+from MAVProxy.modules.lib import mp_linkworker
+
+class SharedRingTest(unittest.TestCase):
+    def test_put_get(self):
+        ring = mp_linkworker.SharedRing(1024)
+        self.assertFalse(ring.pending())
+        self.assertTrue(ring.put(mp_linkworker.REC_FRAME, 1.5, 'frame', 30, 1, 2, 3))
+        self.assertTrue(ring.put(mp_linkworker.REC_ADDRESS, 2.5, '127.0.0.1:14550'))
+        self.assertTrue(ring.pending())
+        self.assertEqual(ring.get(), [
+            (mp_linkworker.REC_FRAME, 1.5, 'frame', 30, 1, 2, 3),
+            (mp_linkworker.REC_ADDRESS, 2.5, '127.0.0.1:14550', 0, 0, 0, 0)])
+        self.assertFalse(ring.pending())
+        self.assertEqual(ring.get(), [])
+
+    def test_limit(self):
+        ring = mp_linkworker.SharedRing(1024)
+        for i in range(5):
+            ring.put(mp_linkworker.REC_FRAME, i, 'x')
+        self.assertEqual(len(ring.get(3)), 3)
+        self.assertEqual([r[1] for r in ring.get()], [3, 4])
+
+    def test_wraparound(self):
+        ring = mp_linkworker.SharedRing(100)
+        rec_size = mp_linkworker.REC_HEADER.size + 20
+        for i in range(20):
+            data = chr(ord('a') + i) * 20
+            self.assertTrue(ring.put(mp_linkworker.REC_RAW, i, data))
+            self.assertEqual(ring.get(), [(mp_linkworker.REC_RAW, i, data, 0, 0, 0, 0)])
+        self.assertEqual(ring.head.value, 20 * rec_size)
+
+    def test_full(self):
+        ring = mp_linkworker.SharedRing(100)
+        self.assertTrue(ring.put(mp_linkworker.REC_RAW, 0, 'x' * 50))
+        self.assertFalse(ring.put(mp_linkworker.REC_RAW, 1, 'y' * 50))
+        ring.get()
+        self.assertTrue(ring.put(mp_linkworker.REC_RAW, 1, 'y' * 50))
+
+    def test_oversize(self):
+        # a record larger than the whole ring can never be added
+        ring = mp_linkworker.SharedRing(64)
+        self.assertFalse(ring.put(mp_linkworker.REC_RAW, 0, 'x' * 64))
+        self.assertFalse(ring.pending())
+
+    def test_large_record(self):
+        # a raw record can be bigger than a 16 bit length allows
+        ring = mp_linkworker.SharedRing(200000)
+        data = ''.join([chr(i % 256) for i in range(70000)])
+        self.assertTrue(ring.put(mp_linkworker.REC_RAW, 1.0, data))
+        self.assertEqual(ring.get(), [(mp_linkworker.REC_RAW, 1.0, data, 0, 0, 0, 0)])
+
+    def test_across_processes(self):
+        ring = mp_linkworker.SharedRing(256)
+        def writer():
+            for i in range(200):
+                while not ring.put(mp_linkworker.REC_FRAME, i, '%03u' % i):
+                    pass
+        p = multiprocessing.Process(target=writer)
+        p.start()
+        received = []
+        while len(received) < 200:
+            received.extend([r[2] for r in ring.get()])
+        p.join()
+        self.assertEqual(received, ['%03u' % i for i in range(200)])
+
+
+class LinkWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = mavutil.mavudp('127.0.0.1:0', input=True)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_stop(self):
+        worker = mp_linkworker.LinkWorker(self.conn, ring_size=4096)
+        self.assertTrue(worker.alive())
+        worker.stop()
+        self.assertFalse(worker.alive())
+
+    def test_died(self):
+        worker = mp_linkworker.LinkWorker(self.conn, ring_size=4096)
+        os.kill(worker.process.pid, signal.SIGKILL)
+        worker.process.join(5)
+        self.assertFalse(worker.alive())
+        self.assertEqual(worker.process.exitcode, -signal.SIGKILL)
+        worker.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+'''
+tests for the group commit log writer
+'''
+
+import os, shutil, struct, tempfile, time, gzip, unittest
+
+from MAVProxy.modules.lib import mp_logwriter
+
+class LogWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'flight.tlog')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, path):
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+        return data
+
+    def test_commit(self):
+        writer = mp_logwriter.LogWriter()
+        ring = writer.add(self.path, 'w', 64)
+        self.assertTrue(ring.put('abc'))
+        self.assertTrue(ring.put('def', usec=0x0102030405060708))
+        self.assertEqual(ring.pending(), 14)
+        writer.commit()
+        self.assertEqual(ring.pending(), 0)
+        writer.close()
+        self.assertEqual(self.read(self.path), 'abc' + struct.pack('>Q', 0x0102030405060708) + 'def')
+        self.assertEqual((ring.records, ring.written, writer.commits), (2, 14, 1))
+
+    def test_wrap(self):
+        writer = mp_logwriter.LogWriter()
+        ring = writer.add(self.path, 'w', 16)
+        expected = ''
+        for i in range(10):
+            data = chr(ord('a') + i) * 5
+            self.assertTrue(ring.put(data, usec=i))
+            expected += struct.pack('>Q', i) + data
+            writer.commit()
+        writer.close()
+        self.assertEqual(self.read(self.path), expected)
+
+    def test_full_ring_drops(self):
+        writer = mp_logwriter.LogWriter()
+        ring = writer.add(self.path, 'w', 10)
+        self.assertTrue(ring.put('123456'))
+        self.assertFalse(ring.put('7890a'))
+        self.assertTrue(ring.put('7890'))
+        self.assertEqual((ring.dropped, ring.dropped_bytes, ring.max_fill), (1, 5, 10))
+        writer.close()
+        self.assertEqual(self.read(self.path), '1234567890')
+
+    def test_writer_thread(self):
+        writer = mp_logwriter.LogWriter(commit_interval=0.01, commit_bytes=8)
+        ring = writer.add(self.path, 'w', 1024)
+        writer.start()
+        for i in range(100):
+            while not ring.put('%04u' % i):
+                pass
+        writer.close()
+        self.assertEqual(self.read(self.path), ''.join(['%04u' % i for i in range(100)]))
+
+    def test_segment_name(self):
+        self.assertEqual(mp_logwriter.segment_name('logs/flight.tlog.raw', 1, False), 'logs/flight.tlog.raw')
+        self.assertEqual(mp_logwriter.segment_name('logs/flight.tlog.raw', 2, False), 'logs/flight-2.tlog.raw')
+        self.assertEqual(mp_logwriter.segment_name('logs/flight.tlog', 3, True), 'logs/flight-3.tlog.gz')
+
+    def test_rotate(self):
+        writer = mp_logwriter.LogWriter()
+        writer.rotate_bytes = 10
+        ring = writer.add(self.path, 'w', 64)
+        ring.put('0123456789ab')
+        writer.commit()
+        ring.put('cd')
+        writer.close()
+        self.assertEqual(self.read(self.path), '0123456789ab')
+        self.assertEqual(self.read(os.path.join(self.dir, 'flight-2.tlog')), 'cd')
+
+    def test_gzip(self):
+        writer = mp_logwriter.LogWriter()
+        writer.compress = 6
+        ring = writer.add(self.path, 'w', 64)
+        ring.put('first ')
+        writer.commit()
+        ring.put('second')
+        writer.close()
+        # each commit is a gzip member, read back as one stream
+        f = gzip.open(self.path + '.gz', 'rb')
+        self.assertEqual(f.read(), 'first second')
+        f.close()
+
+    def test_append_last_segment(self):
+        for name in ['flight.tlog', 'flight-2.tlog.gz', 'flight-3.tlog']:
+            open(os.path.join(self.dir, name), 'w').close()
+        self.assertEqual(mp_logwriter.last_segment(self.path), 3)
+        writer = mp_logwriter.LogWriter()
+        ring = writer.add(self.path, 'a', 64)
+        self.assertEqual(ring.name, os.path.join(self.dir, 'flight-3.tlog'))
+        writer.close()
+
+    def test_compress_flights(self):
+        flights = [os.path.join(self.dir, 'flight%u' % i) for i in range(1, 4)]
+        for d in flights:
+            os.mkdir(d)
+            f = open(os.path.join(d, 'flight.tlog'), 'w')
+            f.write('data')
+            f.close()
+        old = time.time() - 3600
+        for d in flights[:2]:
+            os.utime(os.path.join(d, 'flight.tlog'), (old, old))
+        # flight1 is the current flight, flight3 was written too recently
+        self.assertEqual(mp_logwriter.compress_flights(self.dir, flights[0]), 1)
+        self.assertTrue(os.path.exists(os.path.join(flights[0], 'flight.tlog')))
+        self.assertTrue(os.path.exists(os.path.join(flights[1], 'flight.tlog.gz')))
+        self.assertFalse(os.path.exists(os.path.join(flights[1], 'flight.tlog')))
+        self.assertTrue(os.path.exists(os.path.join(flights[2], 'flight.tlog')))
+        f = gzip.open(os.path.join(flights[1], 'flight.tlog.gz'), 'rb')
+        self.assertEqual(f.read(), 'data')
+        f.close()
+
+
+class CaptureRingTest(unittest.TestCase):
+    def test_snapshot(self):
+        ring = mp_logwriter.CaptureRing(8)
+        ring.put('abc')
+        self.assertEqual(ring.snapshot(), 'abc')
+        ring.put('defgh')
+        ring.put('ij')
+        self.assertEqual(ring.snapshot(), 'cdefghij')
+
+    def test_oversize(self):
+        ring = mp_logwriter.CaptureRing(4)
+        ring.put('abcdefg')
+        self.assertEqual(ring.snapshot(), 'defg')
+        self.assertEqual(ring.head, 7)
+
+if __name__ == '__main__':
+    unittest.main()
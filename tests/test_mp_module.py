@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+'''
+tests for module message type subscriptions
+'''
+
+import unittest
+
+from MAVProxy.modules.lib import mp_module
+
+class FakeState(object):
+    def __init__(self):
+        self.public_modules = {}
+        self.module_dispatch = {}
+
+
+class MessageTypesTest(unittest.TestCase):
+    def setUp(self):
+        self.mpstate = FakeState()
+        self.module = mp_module.MPModule(self.mpstate, 'test')
+
+    def test_default_all(self):
+        # a module that declares nothing sees every message
+        self.assertTrue(self.module.wants_message('HEARTBEAT'))
+        self.assertTrue(self.module.wants_message('ATTITUDE'))
+
+    def test_subscribe(self):
+        self.module.add_message_types(['HEARTBEAT', 'GPS_RAW_INT'])
+        self.assertTrue(self.module.wants_message('HEARTBEAT'))
+        self.assertFalse(self.module.wants_message('ATTITUDE'))
+        self.module.remove_message_types(['HEARTBEAT'])
+        self.assertFalse(self.module.wants_message('HEARTBEAT'))
+        self.assertTrue(self.module.wants_message('GPS_RAW_INT'))
+
+    def test_remove_only(self):
+        # removing types from a module that declared none leaves it with none
+        self.module.remove_message_types(['HEARTBEAT'])
+        self.assertFalse(self.module.wants_message('ATTITUDE'))
+
+    def test_wildcard(self):
+        self.module.add_message_types(['*'])
+        self.assertTrue(self.module.wants_message('ATTITUDE'))
+
+    def test_dispatch_cache_cleared(self):
+        self.mpstate.module_dispatch['HEARTBEAT'] = [self.module]
+        self.module.add_message_types(['HEARTBEAT'])
+        self.assertEqual(self.mpstate.module_dispatch, {})
+        self.mpstate.module_dispatch['HEARTBEAT'] = [self.module]
+        self.module.remove_message_types(['HEARTBEAT'])
+        self.assertEqual(self.mpstate.module_dispatch, {})
+    def test_no_base_init(self):
+        # modules that don't call MPModule.__init__ see every message
+        class OldModule(mp_module.MPModule):
+            def __init__(self, mpstate):
+                self.mpstate = mpstate
+        module = OldModule(self.mpstate)
+        self.assertTrue(module.wants_message('ATTITUDE'))
+        module.add_message_types(['HEARTBEAT'])
+        self.assertFalse(module.wants_message('ATTITUDE'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+'''
+tests for per-output message filters
+'''
+
+import unittest
+
+from MAVProxy.modules.lib import mp_outfilter
+
+class OutputFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.filt = mp_outfilter.OutputFilter()
+
+    def test_default_allow(self):
+        self.assertTrue(self.filt.check('ATTITUDE'))
+        self.assertEqual(self.filt.passed, 1)
+
+    def test_drop(self):
+        self.filt.drop('ATTITUDE')
+        self.assertFalse(self.filt.check('ATTITUDE'))
+        self.assertTrue(self.filt.check('HEARTBEAT'))
+        self.filt.allow('ATTITUDE')
+        self.assertTrue(self.filt.check('ATTITUDE'))
+
+    def test_only(self):
+        self.filt.only(['HEARTBEAT', 'GPS_RAW_INT'])
+        self.assertTrue(self.filt.check('HEARTBEAT'))
+        self.assertFalse(self.filt.check('ATTITUDE'))
+        self.filt.allow('ATTITUDE')
+        self.assertTrue(self.filt.check('ATTITUDE'))
+        self.assertEqual((self.filt.passed, self.filt.dropped), (2, 1))
+
+    def test_rate(self):
+        self.filt.set_rate('ATTITUDE', 1)
+        self.assertTrue(self.filt.check('ATTITUDE'))
+        self.assertFalse(self.filt.check('ATTITUDE'))
+        # once the interval has passed the next packet goes through
+        self.filt.next_send['ATTITUDE'] -= 1
+        self.assertTrue(self.filt.check('ATTITUDE'))
+        self.assertFalse(self.filt.check('ATTITUDE'))
+
+    def test_describe(self):
+        self.filt.set_rate('ATTITUDE', 2)
+        self.filt.drop('RAW_IMU')
+        self.assertEqual(self.filt.describe(), ['ATTITUDE 2.0Hz', 'RAW_IMU drop'])
+
+    def test_match_types(self):
+        names = ['RAW_IMU', 'RAW_PRESSURE', 'ATTITUDE']
+        self.assertEqual(mp_outfilter.match_types('raw_*', names), ['RAW_IMU', 'RAW_PRESSURE'])
+        self.assertEqual(mp_outfilter.match_types('attitude', names), ['ATTITUDE'])
+
+if __name__ == '__main__':
+    unittest.main()
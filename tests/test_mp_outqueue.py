@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''
+tests for the outbound queues of output links
+'''
+
+import unittest
+
+from MAVProxy.modules.lib import mp_outqueue
+
+class FakeConn(object):
+    '''a transport that takes every write'''
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+
+class OutputQueueTest(unittest.TestCase):
+    def test_flush_coalesces(self):
+        conn = FakeConn()
+        q = mp_outqueue.OutputQueue(conn, None)
+        q.push('aaaa', 'ATTITUDE')
+        q.push('bbbb', 'HEARTBEAT')
+        self.assertEqual(len(q), 2)
+        q.flush()
+        self.assertEqual(conn.writes, ['aaaabbbb'])
+        self.assertEqual(len(q), 0)
+        self.assertEqual((q.frames, q.writes, q.bytes, q.dropped), (2, 1, 8, 0))
+
+    def test_drop_oldest(self):
+        conn = FakeConn()
+        q = mp_outqueue.OutputQueue(conn, None, maxbytes=10, policy='oldest')
+        q.push('1111', 'HEARTBEAT')
+        q.push('2222', 'ATTITUDE')
+        q.push('3333', 'PARAM_VALUE')
+        self.assertEqual(q.dropped, 1)
+        self.assertEqual(q.qbytes, 8)
+        q.flush()
+        self.assertEqual(conn.writes, ['22223333'])
+
+    def test_drop_priority(self):
+        conn = FakeConn()
+        q = mp_outqueue.OutputQueue(conn, None, maxbytes=12, policy='priority')
+        q.push('hb01', 'HEARTBEAT')
+        q.push('at01', 'ATTITUDE')
+        q.push('gp01', 'GPS_RAW_INT')
+        q.push('at02', 'ATTITUDE')
+        q.push('gp02', 'GPS_RAW_INT')
+        # the low priority ATTITUDE packets go first, oldest first
+        self.assertEqual(q.dropped, 2)
+        q.flush()
+        self.assertEqual(conn.writes, ['hb01gp01gp02'])
+
+    def test_drop_priority_normal_before_high(self):
+        conn = FakeConn()
+        q = mp_outqueue.OutputQueue(conn, None, maxbytes=8, policy='priority')
+        q.push('hb01', 'HEARTBEAT')
+        q.push('gp01', 'GPS_RAW_INT')
+        q.push('hb02', 'HEARTBEAT')
+        q.flush()
+        self.assertEqual(conn.writes, ['hb01hb02'])
+
+    def test_oversize_frame(self):
+        conn = FakeConn()
+        q = mp_outqueue.OutputQueue(conn, None, maxbytes=4)
+        q.push('1234567', 'HEARTBEAT')
+        self.assertEqual(len(q), 0)
+        self.assertEqual(q.qbytes, 0)
+        self.assertEqual(q.dropped, 1)
+
+    def test_stream_write_limit(self):
+        conn = FakeConn()
+        q = mp_outqueue.OutputQueue(conn, None, maxbytes=1000000)
+        frame = 'x' * 1000
+        n = mp_outqueue.STREAM_MAX_WRITE // len(frame) + 1
+        for i in range(n):
+            q.push(frame)
+        q.flush()
+        self.assertEqual(len(conn.writes), 2)
+        self.assertTrue(len(conn.writes[0]) <= mp_outqueue.STREAM_MAX_WRITE)
+        self.assertEqual(''.join(conn.writes), frame * n)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+'''
+tests for the on-disk parameter cache
+'''
+
+import os, shutil, tempfile, unittest
+
+from MAVProxy.modules.lib import mp_paramcache
+
+class ParamCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'params.parm')
+        self.cache = mp_paramcache.ParamCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def fill(self, cache, count):
+        for i in range(count):
+            cache.set(i, 'P%u' % i, i * 0.5, count)
+
+    def test_save_load(self):
+        self.fill(self.cache, 5)
+        self.assertTrue(self.cache.complete())
+        self.assertTrue(self.cache.dirty)
+        self.cache.save()
+        self.assertFalse(self.cache.dirty)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        cache = mp_paramcache.ParamCache(self.path)
+        self.assertTrue(cache.load())
+        self.assertEqual(cache.count, 5)
+        self.assertEqual(cache.params, self.cache.params)
+        self.assertEqual(cache.index['P3'], 3)
+        self.assertTrue(cache.matches(3, 'P3', 1.5, 5))
+        self.assertFalse(cache.matches(3, 'P3', 1.0, 5))
+        self.assertFalse(cache.matches(3, 'P3', 1.5, 6))
+
+    def test_float_round_trip(self):
+        self.cache.set(0, 'RATE', 0.1, 1)
+        self.cache.save()
+        cache = mp_paramcache.ParamCache(self.path)
+        self.assertTrue(cache.load())
+        self.assertTrue(cache.matches(0, 'RATE', 0.1, 1))
+
+    def test_load_missing(self):
+        self.assertFalse(self.cache.load())
+
+    def test_load_incomplete(self):
+        self.fill(self.cache, 5)
+        del self.cache.params[2]
+        self.cache.save()
+        cache = mp_paramcache.ParamCache(self.path)
+        self.assertFalse(cache.load())
+        self.assertEqual((cache.count, cache.params), (0, {}))
+
+    def test_load_corrupt(self):
+        f = open(self.path, 'w')
+        f.write("# count 1\n0 P0 notanumber\n")
+        f.close()
+        self.assertFalse(self.cache.load())
+
+    def test_set_by_name(self):
+        # replies to a set may not carry the index
+        self.fill(self.cache, 3)
+        self.cache.set(65535, 'P1', 7.0, 3)
+        self.assertEqual(self.cache.params[1], ('P1', 7.0))
+        self.cache.set(65535, 'UNKNOWN', 1.0, 3)
+        self.assertEqual(len(self.cache.params), 3)
+
+    def test_set_renamed(self):
+        self.fill(self.cache, 3)
+        self.cache.set(1, 'NEW', 1.0, 3)
+        self.assertFalse('P1' in self.cache.index)
+        self.assertEqual(self.cache.index['NEW'], 1)
+
+    def test_sample(self):
+        self.fill(self.cache, 100)
+        indexes = self.cache.sample(10)
+        self.assertEqual(len(indexes), 10)
+        self.assertTrue(99 in indexes)
+        self.assertTrue(all([0 <= i < 100 for i in indexes]))
+        self.assertEqual(self.cache.sample(500), set(range(100)))
+        self.assertEqual(self.cache.sample(0), set([99]))
+
+    def test_remove(self):
+        self.fill(self.cache, 2)
+        self.cache.save()
+        self.cache.remove()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(self.cache.complete())
+
+if __name__ == '__main__':
+    unittest.main()
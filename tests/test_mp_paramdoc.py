@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+'''
+tests for compiled parameter documentation
+'''
+
+import os, shutil, tempfile, time, unittest
+
+from MAVProxy.modules.lib import mp_paramdoc
+
+XML = '''<?xml version="1.0" encoding="utf-8"?>
+<paramfile>
+<vehicles>
+<parameters name="ArduCopter">
+<param humanName="Throttle filter" name="ArduCopter:THR_FILT" documentation="throttle filter cutoff">
+<field name="Range">0 10</field>
+<field name="Units">Hz</field>
+</param>
+<param humanName="Frame" name="ArduCopter:FRAME" documentation="frame layout">
+<values>
+<value code="0">Plus</value>
+<value code="1">X</value>
+</values>
+</param>
+</parameters>
+</vehicles>
+<libraries>
+<parameters name="COMPASS_">
+<param humanName="Compass declination" name="COMPASS_DEC" documentation="declination">
+<field name="Range">-3.142 3.142</field>
+<field name="Units">rad</field>
+</param>
+</parameters>
+</libraries>
+</paramfile>
+'''
+
+class ParamDocsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.xml = os.path.join(self.dir, 'apm.pdef.xml')
+        self.write(self.xml, XML)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, text):
+        f = open(path, 'w')
+        f.write(text)
+        f.close()
+
+    def test_compile(self):
+        docs = mp_paramdoc.compile_docs(self.xml)
+        self.assertTrue(os.path.exists(mp_paramdoc.store_path(self.xml)))
+        # no temporary file is left behind
+        self.assertEqual(sorted(os.listdir(self.dir)), ['apm.pdef.pdoc', 'apm.pdef.xml'])
+        doc = docs.get('thr_filt')
+        self.assertEqual((doc.name, doc.human_name, doc.units, doc.range),
+                         ('THR_FILT', 'Throttle filter', 'Hz', (0.0, 10.0)))
+        self.assertEqual(docs.get('FRAME').values, [('0', 'Plus'), ('1', 'X')])
+        self.assertEqual(docs.get('FRAME').range, None)
+        self.assertEqual(docs.get('COMPASS_DEC').units, 'rad')
+        self.assertEqual(docs.get('NOPE'), None)
+
+    def test_load_uses_index(self):
+        mp_paramdoc.compile_docs(self.xml)
+        # an up to date index is used without parsing the XML
+        self.write(self.xml, 'not xml')
+        old = time.time() - 60
+        os.utime(self.xml, (old, old))
+        docs = mp_paramdoc.load_docs(self.xml)
+        self.assertNotEqual(docs.get('THR_FILT'), None)
+
+    def test_load_recompiles(self):
+        mp_paramdoc.compile_docs(self.xml)
+        self.write(self.xml, XML.replace('THR_FILT', 'THR_CUTOFF'))
+        new = time.time() + 60
+        os.utime(self.xml, (new, new))
+        docs = mp_paramdoc.load_docs(self.xml)
+        self.assertEqual(docs.get('THR_FILT'), None)
+        self.assertNotEqual(docs.get('THR_CUTOFF'), None)
+
+    def test_bad_xml(self):
+        self.write(self.xml, '<paramfile><vehicles>')
+        self.assertRaises(Exception, mp_paramdoc.load_docs, self.xml)
+
+    def test_complete(self):
+        docs = mp_paramdoc.compile_docs(self.xml)
+        self.assertEqual(docs.complete('comp'), ['COMPASS_DEC'])
+        self.assertEqual(docs.complete('F'), ['FRAME'])
+        self.assertEqual(docs.complete('X'), [])
+        self.assertEqual(len(docs.complete('')), 3)
+
+    def test_check(self):
+        docs = mp_paramdoc.compile_docs(self.xml)
+        self.assertEqual(docs.check('THR_FILT', 5), None)
+        self.assertEqual(docs.check('THR_FILT', 10), None)
+        self.assertNotEqual(docs.check('THR_FILT', 11), None)
+        self.assertEqual(docs.check('FRAME', 99), None)
+        self.assertEqual(docs.check('UNKNOWN', 99), None)
+
+    def test_check_file(self):
+        docs = mp_paramdoc.compile_docs(self.xml)
+        parm = os.path.join(self.dir, 'test.parm')
+        self.write(parm, '''# a comment
+THR_FILT 20
+COMPASS_DEC,-4
+FRAME 1
+THR_FILT notanumber
+UNKNOWN 1000
+
+COMPASS_DEC 0.5
+''')
+        msgs = docs.check_file(parm)
+        self.assertEqual(len(msgs), 2)
+        self.assertTrue(msgs[0].startswith('THR_FILT 20'))
+        self.assertTrue(msgs[1].startswith('COMPASS_DEC -4'))
+        msgs = docs.check_file(parm, 'compass*')
+        self.assertEqual(len(msgs), 1)
+        self.assertTrue(msgs[0].startswith('COMPASS_DEC'))
+
+if __name__ == '__main__':
+    unittest.main()
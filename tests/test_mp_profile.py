@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+'''
+tests for profiling a running MAVProxy
+'''
+
+import os, shutil, tempfile, threading, time, unittest
+from StringIO import StringIO
+
+from MAVProxy.modules.lib import mp_profile
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+class SamplingProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_sample(self):
+        stop = threading.Event()
+        th = threading.Thread(target=busy_loop, args=(stop,), name='busy')
+        th.start()
+        prof = mp_profile.SamplingProfiler([th], interval=0.001)
+        prof.start()
+        time.sleep(0.1)
+        prof.stop()
+        stop.set()
+        th.join()
+        self.assertTrue(prof.samples > 0)
+        self.assertTrue(prof.elapsed > 0)
+        for stack in prof.counts.keys():
+            self.assertTrue(stack.startswith('busy;'))
+            self.assertTrue('busy_loop (test_mp_profile.py:' in stack)
+        path = os.path.join(self.dir, 'stacks.txt')
+        prof.dump(path)
+        lines = open(path).read().splitlines()
+        self.assertEqual(sum([int(l.rsplit(' ', 1)[1]) for l in lines]), sum(prof.counts.values()))
+        f = StringIO()
+        prof.summary(f)
+        self.assertTrue(f.getvalue().startswith('%u samples over' % prof.samples))
+
+    def test_finished_thread(self):
+        # a thread that has exited has no stack to sample
+        th = threading.Thread(target=lambda: None)
+        prof = mp_profile.SamplingProfiler([th])
+        prof._sample()
+        self.assertEqual((prof.samples, prof.counts), (1, {}))
+
+
+class DeterministicProfilerTest(unittest.TestCase):
+    def test_profile(self):
+        prof = mp_profile.DeterministicProfiler()
+        prof.start()
+        sum(range(1000))
+        prof.stop()
+        f = StringIO()
+        prof.summary(f)
+        self.assertTrue('function calls' in f.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+'''
+tests for the file descriptor event loop
+'''
+
+import os, tempfile, threading, time, unittest
+
+from MAVProxy.modules.lib import mp_reactor
+
+class ReactorTest(unittest.TestCase):
+    def setUp(self):
+        self.reactor = mp_reactor.Reactor()
+        (self.rfd, self.wfd) = os.pipe()
+        self.events = []
+
+    def tearDown(self):
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+    def test_reader(self):
+        self.reactor.add_reader(self.rfd, self.events.append, 'read')
+        self.reactor.poll(0)
+        self.assertEqual(self.events, [])
+        os.write(self.wfd, 'x')
+        self.reactor.poll(1)
+        self.assertEqual(self.events, ['read'])
+        self.reactor.remove_reader(self.rfd)
+        self.reactor.poll(0)
+        self.assertEqual(self.events, ['read'])
+
+    def test_writer(self):
+        self.reactor.add_writer(self.wfd, self.events.append, 'write')
+        self.reactor.poll(0)
+        self.assertEqual(self.events, ['write'])
+        self.reactor.remove_writer(self.wfd)
+        self.reactor.poll(0)
+        self.assertEqual(self.events, ['write'])
+
+    def test_timeout(self):
+        t0 = time.time()
+        self.reactor.poll(0.05)
+        self.assertTrue(time.time() - t0 >= 0.04)
+
+    def test_wakeup(self):
+        self.assertTrue(self.reactor.can_wakeup())
+        timer = threading.Timer(0.05, self.reactor.wakeup)
+        timer.start()
+        t0 = time.time()
+        self.reactor.poll(5)
+        timer.join()
+        self.assertTrue(time.time() - t0 < 2)
+        # the wakeup pipe is drained, so the next poll waits again
+        t0 = time.time()
+        self.reactor.poll(0.05)
+        self.assertTrue(time.time() - t0 >= 0.04)
+
+    def test_regular_file(self):
+        # epoll refuses regular files, which are always readable
+        f = tempfile.TemporaryFile()
+        self.reactor.add_reader(f.fileno(), self.events.append, 'file')
+        self.reactor.poll(1)
+        self.assertEqual(self.events, ['file'])
+        self.reactor.remove_reader(f.fileno())
+        self.assertEqual(self.reactor.always_ready, set())
+        f.close()
+
+
+class SelectExtraTest(unittest.TestCase):
+    def test_error_removes(self):
+        reactor = mp_reactor.Reactor()
+        errors = []
+        extra = mp_reactor.SelectExtra(reactor, errors.append)
+        (rfd, wfd) = os.pipe()
+        def fail(args):
+            raise RuntimeError(args)
+        extra[rfd] = (fail, 'boom')
+        os.write(wfd, 'x')
+        reactor.poll(1)
+        self.assertEqual([str(e) for e in errors], ['boom'])
+        self.assertFalse(rfd in extra)
+        self.assertFalse(rfd in reactor.readers)
+        os.close(rfd)
+        os.close(wfd)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+'''
+tests for the per-link receive buffer
+'''
+
+import socket, unittest
+from pymavlink import mavutil
+
+from MAVProxy.modules.lib import mp_recvbuf
+
+class FakeConn(object):
+    '''a link returning queued chunks from recv()'''
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv(self, n):
+        if not self.chunks:
+            return ''
+        s = self.chunks.pop(0)
+        if len(s) > n:
+            self.chunks.insert(0, s[n:])
+            s = s[:n]
+        return s
+
+
+class ReceiveBufferTest(unittest.TestCase):
+    def test_drain(self):
+        rb = mp_recvbuf.ReceiveBuffer(FakeConn(['abc', 'def']))
+        self.assertEqual(rb.drain(), 'abcdef')
+        self.assertEqual((rb.reads, rb.drains, rb.bytes), (2, 1, 6))
+
+    def test_full_buffer(self):
+        conn = FakeConn(['0123456789'])
+        rb = mp_recvbuf.ReceiveBuffer(conn, size=4)
+        self.assertEqual(rb.drain(), '0123')
+        self.assertEqual(rb.drain(), '4567')
+        self.assertEqual(rb.drain(), '89')
+
+    def test_no_data(self):
+        rb = mp_recvbuf.ReceiveBuffer(FakeConn([]))
+        self.assertRaises(mp_recvbuf.LinkDead, rb.drain)
+
+    def test_error_after_data(self):
+        # data read before a failure is still returned
+        conn = FakeConn(['abc'])
+        def recv(n, recv=conn.recv):
+            if not conn.chunks:
+                raise IOError('gone')
+            return recv(n)
+        conn.recv = recv
+        rb = mp_recvbuf.ReceiveBuffer(conn)
+        self.assertEqual(rb.drain(), 'abc')
+        self.assertRaises(mp_recvbuf.LinkDead, rb.drain)
+
+    def test_udp(self):
+        conn = mavutil.mavudp('127.0.0.1:0', input=True)
+        port = conn.port.getsockname()[1]
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for d in ['one', 'two', 'three']:
+            s.sendto(d, ('127.0.0.1', port))
+        rb = mp_recvbuf.ReceiveBuffer(conn)
+        self.assertEqual(rb.drain(), 'onetwothree')
+        self.assertEqual(conn.last_address[1], s.getsockname()[1])
+        self.assertRaises(mp_recvbuf.LinkDead, rb.drain)
+        s.close()
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+'''
+tests for telemetry log replay
+'''
+
+import gzip, os, shutil, struct, tempfile, unittest
+from pymavlink.dialects.v10 import ardupilotmega as mavlink1
+
+from MAVProxy.modules.lib import mp_replay, mp_tlogindex
+
+START = 1500000000.0
+
+def tlog_data():
+    '''a 10 second log with a HEARTBEAT each second'''
+    mav = mavlink1.MAVLink(None, 1, 1)
+    data = ''
+    for i in range(10):
+        m = mav.heartbeat_encode(1, 3, 0, 0, i)
+        data += struct.pack('>Q', int((START + i) * 1.0e6)) + str(m.pack(mav))
+    return data
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'flight.tlog')
+        self.write(self.path, tlog_data())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data):
+        f = open(path, 'wb')
+        f.write(data)
+        f.close()
+
+    def test_reader(self):
+        reader = mp_replay.TlogReader(self.path)
+        records = []
+        while True:
+            rec = reader.read_record()
+            if rec is None:
+                break
+            records.append(rec)
+        self.assertEqual([t for (t, frame) in records], [START + i for i in range(10)])
+        self.assertEqual(records[0][1][0], '\xfe')
+
+    def test_reader_resync(self):
+        data = tlog_data()
+        self.write(self.path, 'junk' + data[:25] + 'xx' + data[25:])
+        reader = mp_replay.TlogReader(self.path)
+        n = 0
+        while reader.read_record() is not None:
+            n += 1
+        self.assertEqual(n, 10)
+        self.assertEqual(reader.bad_bytes, 6)
+
+    def test_reader_truncated(self):
+        self.write(self.path, tlog_data()[:-3])
+        reader = mp_replay.TlogReader(self.path)
+        n = 0
+        while reader.read_record() is not None:
+            n += 1
+        self.assertEqual(n, 9)
+
+    def test_gzip(self):
+        gzpath = self.path + '.gz'
+        f = gzip.open(gzpath, 'wb')
+        f.write(tlog_data())
+        f.close()
+        replay = mp_replay.Replay(gzpath, speed=0)
+        self.assertEqual(len(replay.due(0)), 10)
+        self.assertTrue(replay.finished())
+
+    def test_as_fast_as_possible(self):
+        replay = mp_replay.Replay(self.path, speed=0)
+        self.assertEqual(replay.delay(0), 0)
+        self.assertEqual(len(replay.due(0, max_records=4)), 4)
+        self.assertEqual(len(replay.due(0)), 6)
+        self.assertTrue(replay.finished())
+        self.assertEqual(replay.delay(0), None)
+
+    def test_realtime(self):
+        replay = mp_replay.Replay(self.path, speed=2)
+        wall = replay.base_wall
+        self.assertEqual(len(replay.due(wall)), 1)
+        self.assertAlmostEqual(replay.delay(wall), 0.5)
+        # 1.6s of wall time at 2x plays the log up to 3.2s
+        self.assertEqual(len(replay.due(wall + 1.6)), 3)
+        self.assertEqual(replay.records, 4)
+
+    def test_pause(self):
+        replay = mp_replay.Replay(self.path)
+        replay.pause()
+        self.assertEqual(replay.due(replay.base_wall + 100), [])
+        self.assertEqual(replay.delay(0), None)
+        replay.resume()
+        self.assertEqual(len(replay.due(replay.base_wall)), 1)
+
+    def test_seek(self):
+        replay = mp_replay.Replay(self.path)
+        replay.seek(5.5)
+        self.assertEqual(replay.next_rec[0], START + 6)
+        replay.seek(1)
+        self.assertEqual(replay.next_rec[0], START + 1)
+
+    def test_seek_indexed(self):
+        mp_tlogindex.build(self.path).save(mp_tlogindex.index_name(self.path))
+        replay = mp_replay.Replay(self.path)
+        self.assertNotEqual(replay.index, None)
+        replay.seek(7)
+        self.assertEqual(replay.next_rec[0], START + 7)
+        self.assertEqual(len(replay.due(replay.base_wall + 10)), 3)
+
+    def test_empty(self):
+        self.write(self.path, '')
+        replay = mp_replay.Replay(self.path)
+        self.assertTrue(replay.finished())
+        replay.seek(10)
+        self.assertEqual(replay.position(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+'''
+tests for the system ID routing table
+'''
+
+import time, unittest
+
+from pymavlink.dialects.v10 import ardupilotmega as mavlink1
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from MAVProxy.modules.lib import mp_route
+
+class RouteTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = mp_route.RouteTable(timeout=30)
+
+    def test_unknown(self):
+        self.assertEqual(self.table.lookup(1, 1), None)
+
+    def test_learn(self):
+        tnow = time.time()
+        self.table.learn(1, 1, 'master', tnow)
+        self.table.learn(1, 100, 'camera', tnow)
+        self.table.learn(255, 190, 'gcs', tnow)
+        self.assertEqual(self.table.lookup(1, 1), ['master'])
+        self.assertEqual(self.table.lookup(1, 100), ['camera'])
+        self.assertEqual(sorted(self.table.lookup(1, 0)), ['camera', 'master'])
+        # a component we haven't heard from may be behind any link of its system
+        self.assertEqual(sorted(self.table.lookup(1, 50)), ['camera', 'master'])
+        self.assertEqual(self.table.lookup(255, 190), ['gcs'])
+
+    def test_several_links(self):
+        tnow = time.time()
+        self.table.learn(1, 1, 'a', tnow)
+        self.table.learn(1, 1, 'b', tnow)
+        self.assertEqual(sorted(self.table.lookup(1, 1)), ['a', 'b'])
+
+    def test_timeout(self):
+        self.table.learn(1, 1, 'old', time.time() - 60)
+        self.assertEqual(self.table.lookup(1, 1), None)
+        self.table.learn(1, 1, 'new', time.time())
+        self.assertEqual(self.table.lookup(1, 1), ['new'])
+
+    def test_static(self):
+        self.table.learn(1, 1, 'learned', time.time())
+        self.table.add_static(1, 0, 'static')
+        self.assertEqual(self.table.lookup(1, 1), ['static'])
+        self.table.add_static(1, 1, 'comp')
+        self.assertEqual(self.table.lookup(1, 1), ['comp'])
+        self.assertEqual(self.table.lookup(1, 2), ['static'])
+        self.assertTrue(self.table.remove_static(1, 1))
+        self.assertTrue(self.table.remove_static(1, 0))
+        self.assertFalse(self.table.remove_static(1, 0))
+        self.assertEqual(self.table.lookup(1, 1), ['learned'])
+
+    def test_clear(self):
+        self.table.learn(1, 1, 'a', time.time())
+        self.table.add_static(2, 0, 'b')
+        self.table.clear()
+        self.assertEqual(self.table.lookup(1, 1), None)
+        self.assertEqual(self.table.lookup(2, 1), ['b'])
+
+    def test_remove_link(self):
+        tnow = time.time()
+        self.table.learn(1, 1, 'a', tnow)
+        self.table.learn(1, 1, 'b', tnow)
+        self.table.learn(2, 1, 'a', tnow)
+        self.table.add_static(3, 0, 'a')
+        self.table.add_static(4, 0, 'b')
+        self.table.remove_link('a')
+        self.assertEqual(self.table.lookup(1, 1), ['b'])
+        self.assertEqual(self.table.lookup(2, 1), None)
+        self.assertEqual(self.table.lookup(3, 1), None)
+        self.assertEqual(self.table.lookup(4, 1), ['b'])
+        self.assertEqual(self.table.learned.keys(), [1])
+
+    def test_routes(self):
+        self.table.learn(1, 1, 'a', time.time())
+        self.table.add_static(1, 1, 'b')
+        routes = self.table.routes()
+        self.assertEqual([(r[0], r[1], r[2], r[4]) for r in routes],
+                         [(1, 1, 'b', True), (1, 1, 'a', False)])
+
+
+class TargetFieldsTest(unittest.TestCase):
+    def test_targeted(self):
+        mav = mavlink1.MAVLink(None, 255, 190)
+        fields = mp_route.TargetFields(mavlink1)
+        m = mav.param_request_read_encode(7, 3, 'FOO', -1)
+        frame = str(m.pack(mav))
+        self.assertEqual(fields.target(m.get_msgId(), frame), (7, 3))
+
+    def test_untargeted(self):
+        mav = mavlink1.MAVLink(None, 1, 1)
+        fields = mp_route.TargetFields(mavlink1)
+        m = mav.heartbeat_encode(1, 2, 3, 4, 5)
+        self.assertEqual(fields.target(m.get_msgId(), str(m.pack(mav))), None)
+
+    def test_mavlink2_trimmed(self):
+        # trailing zero bytes, here target_component, are trimmed from
+        # MAVLink2 payloads
+        mav = mavlink2.MAVLink(None, 255, 190)
+        fields = mp_route.TargetFields(mavlink2)
+        m = mav.mission_request_list_encode(9, 0)
+        self.assertEqual(fields.target(m.get_msgId(), str(m.pack(mav))), (9, 0))
+        m = mav.mission_request_list_encode(9, 4)
+        self.assertEqual(fields.target(m.get_msgId(), str(m.pack(mav))), (9, 4))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+'''
+tests for the timer scheduler
+'''
+
+import time, unittest
+
+from MAVProxy.modules.lib import mp_scheduler
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.sched = mp_scheduler.Scheduler()
+        self.calls = []
+
+    def call(self, name):
+        return lambda: self.calls.append(name)
+
+    def test_oneshot(self):
+        task = self.sched.add_oneshot('now', 0, self.call('now'))
+        self.sched.add_oneshot('later', 10, self.call('later'))
+        self.sched.run_pending()
+        self.sched.run_pending()
+        self.assertEqual(self.calls, ['now'])
+        self.assertFalse(task.active())
+        self.assertEqual([t.name for t in self.sched.tasks], ['later'])
+
+    def test_order(self):
+        self.sched.add_oneshot('b', -1, self.call('b'))
+        self.sched.add_oneshot('a', -2, self.call('a'))
+        self.sched.add_oneshot('c', 0, self.call('c'))
+        self.sched.run_pending()
+        self.assertEqual(self.calls, ['a', 'b', 'c'])
+
+    def test_periodic(self):
+        task = self.sched.add_periodic('p', 1, self.call('p'), delay=0)
+        self.sched.run_pending()
+        self.assertEqual(self.calls, ['p'])
+        self.assertTrue(task.deadline > time.time())
+        self.assertEqual(self.sched.next_deadline(), task.deadline)
+
+    def test_missed_periods_skipped(self):
+        # a task five periods late runs once, not five times
+        task = self.sched.add_periodic('p', 1, self.call('p'), delay=-5.5)
+        self.sched.run_pending()
+        self.assertEqual(self.calls, ['p'])
+        self.assertEqual((task.runs, task.misses), (1, 1))
+        self.assertTrue(task.deadline > time.time())
+
+    def test_cancel(self):
+        task = self.sched.add_periodic('p', 1, self.call('p'), delay=0)
+        self.sched.cancel(task)
+        self.assertEqual(self.sched.next_deadline(), None)
+        self.sched.run_pending()
+        self.assertEqual(self.calls, [])
+
+    def test_reschedule(self):
+        task = self.sched.add_oneshot('t', 0, self.call('t'))
+        self.sched.reschedule(task, 10)
+        self.sched.run_pending()
+        self.assertEqual(self.calls, [])
+        self.sched.reschedule(task, 0)
+        self.sched.run_pending()
+        self.assertEqual(self.calls, ['t'])
+
+    def test_set_period(self):
+        task = self.sched.add_periodic('p', 100, self.call('p'))
+        self.sched.set_period(task, 0.5)
+        self.assertTrue(self.sched.next_deadline() <= time.time() + 0.5)
+
+    def test_on_error(self):
+        errors = []
+        sched = mp_scheduler.Scheduler(on_error=lambda task, e: errors.append(task.name))
+        def fail():
+            raise RuntimeError('fail')
+        sched.add_oneshot('bad', 0, fail)
+        sched.add_oneshot('good', 0, self.call('good'))
+        sched.run_pending()
+        self.assertEqual(errors, ['bad'])
+        self.assertEqual(self.calls, ['good'])
+
+    def test_error_raised(self):
+        def fail():
+            raise RuntimeError('fail')
+        self.sched.add_oneshot('bad', 0, fail)
+        self.assertRaises(RuntimeError, self.sched.run_pending)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+'''
+tests for startup time measurement
+'''
+
+import __builtin__, time, unittest
+from StringIO import StringIO
+
+from MAVProxy.modules.lib import mp_startup
+
+class StartupTest(unittest.TestCase):
+    def test_process_start_time(self):
+        t = mp_startup.process_start_time()
+        if t is not None:
+            self.assertTrue(t <= time.time() + 1)
+
+    def test_import_timer(self):
+        orig = __builtin__.__import__
+        timer = mp_startup.ImportTimer()
+        timer.install()
+        try:
+            import json
+            import json
+        finally:
+            timer.uninstall()
+        self.assertTrue(__builtin__.__import__ is orig)
+        (count, total, own) = timer.times['json']
+        self.assertEqual(count, 2)
+        self.assertTrue(0 <= own <= total)
+        self.assertEqual(timer.stack, [])
+        f = StringIO()
+        timer.report(f)
+        self.assertTrue('json' in f.getvalue())
+
+    def test_disabled(self):
+        orig = __builtin__.__import__
+        st = mp_startup.StartupTimer(False)
+        st.phase('modules')
+        f = StringIO()
+        st.finish('first packet', f)
+        self.assertEqual(st.phases, [])
+        self.assertEqual(f.getvalue(), '')
+        self.assertTrue(__builtin__.__import__ is orig)
+
+    def test_report(self):
+        orig = __builtin__.__import__
+        st = mp_startup.StartupTimer(True)
+        try:
+            st.phase('modules')
+        finally:
+            f = StringIO()
+            st.finish('first packet', f)
+        self.assertTrue(__builtin__.__import__ is orig)
+        self.assertEqual([p[0] for p in st.phases], ['modules', 'first packet'])
+        lines = f.getvalue().splitlines()
+        self.assertEqual(lines[0], 'Startup times from process start:')
+        self.assertTrue(lines[1].split()[0] == 'modules')
+        # finishing twice doesn't report again
+        f = StringIO()
+        st.finish('again', f)
+        self.assertEqual(f.getvalue(), '')
+
+if __name__ == '__main__':
+    unittest.main()
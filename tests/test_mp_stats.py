@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''
+tests for module latency statistics
+'''
+
+import unittest
+from StringIO import StringIO
+
+from MAVProxy.modules.lib import mp_stats
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_empty(self):
+        h = mp_stats.LatencyHistogram()
+        self.assertEqual((h.mean(), h.percentile(50)), (0.0, 0.0))
+
+    def test_percentile(self):
+        h = mp_stats.LatencyHistogram()
+        for i in range(99):
+            h.add(100.0e-6)
+        h.add(0.5)
+        self.assertEqual(h.count, 100)
+        self.assertEqual(h.max, 0.5)
+        # 100us falls in the 64-128us bucket
+        self.assertAlmostEqual(h.percentile(50), 128.0e-6)
+        self.assertAlmostEqual(h.percentile(99), 128.0e-6)
+        self.assertEqual(h.percentile(100), 0.5)
+        self.assertAlmostEqual(h.mean(), (99 * 100.0e-6 + 0.5) / 100)
+
+    def test_percentile_capped_by_max(self):
+        h = mp_stats.LatencyHistogram()
+        h.add(70.0e-6)
+        self.assertAlmostEqual(h.percentile(50), 70.0e-6)
+
+    def test_huge(self):
+        h = mp_stats.LatencyHistogram()
+        h.add(1.0e6)
+        self.assertEqual(h.buckets[mp_stats.NUM_BUCKETS-1], 1)
+
+    def test_reset(self):
+        h = mp_stats.LatencyHistogram()
+        h.add(0.1)
+        h.reset()
+        self.assertEqual((h.count, h.total, h.max, sum(h.buckets)), (0, 0.0, 0.0, 0))
+
+
+class ModuleStatsTest(unittest.TestCase):
+    def test_show(self):
+        s = mp_stats.ModuleStats()
+        s.packet.add(0.001)
+        s.command.add(0.002)
+        s.errors = 2
+        f = StringIO()
+        s.show('test', f)
+        lines = f.getvalue().splitlines()
+        self.assertEqual([l.split()[:3] for l in lines[:2]], [['test', 'packet', '1'], ['test', 'command', '1']])
+        self.assertEqual(lines[2], 'test         2 exceptions')
+        s.reset()
+        f = StringIO()
+        s.show('test', f)
+        self.assertEqual(f.getvalue(), '')
+
+if __name__ == '__main__':
+    unittest.main()
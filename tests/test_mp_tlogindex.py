@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+'''
+tests for sidecar tlog indexes
+'''
+
+import gzip, os, shutil, struct, tempfile, unittest
+from pymavlink import mavutil
+from pymavlink.dialects.v10 import ardupilotmega as mavlink1
+
+from MAVProxy.modules.lib import mp_tlogindex
+
+START = 1500000000.0
+
+def write_tlog(path, junk=''):
+    '''write a 10 second log with a HEARTBEAT each second and an
+    ATTITUDE every half second, returning the record offsets'''
+    mav = mavlink1.MAVLink(None, 1, 1)
+    f = open(path, 'wb')
+    offsets = []
+    for i in range(20):
+        t = START + i * 0.5
+        if i % 2 == 0:
+            m = mav.heartbeat_encode(1, 3, 0, 0, 0)
+        else:
+            m = mav.attitude_encode(i, 0.1 * i, 0, 0, 0, 0, 0)
+        offsets.append(f.tell())
+        f.write(struct.pack('>Q', int(t * 1.0e6)) + str(m.pack(mav)))
+        if i == 5:
+            f.write(junk)
+    f.close()
+    return offsets
+
+class TlogIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'flight.tlog')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_build(self):
+        offsets = write_tlog(self.path)
+        idx = mp_tlogindex.build(self.path)
+        self.assertEqual(idx.records, 20)
+        self.assertEqual(idx.start_time, START)
+        self.assertEqual(idx.message_offsets([0]), offsets[0::2])
+        self.assertEqual(idx.type_offsets(mavlink1, ['ATTITUDE']), offsets[1::2])
+        self.assertEqual(idx.message_offsets([0, 30]), offsets)
+        self.assertEqual(idx.type_offsets(mavlink1, ['NOT_A_MESSAGE']), [])
+
+    def test_time_window(self):
+        offsets = write_tlog(self.path)
+        idx = mp_tlogindex.build(self.path)
+        # records from 2s up to 4s into the log
+        self.assertEqual(idx.message_offsets([0, 30], START + 2, START + 4), offsets[4:8])
+        self.assertEqual(idx.time_offset(START - 5), 0)
+        self.assertEqual(idx.time_offset(START + 100), os.path.getsize(self.path))
+
+    def test_resync(self):
+        offsets = write_tlog(self.path, junk='\x00' * 7)
+        idx = mp_tlogindex.build(self.path)
+        self.assertEqual(idx.records, 20)
+        self.assertEqual(idx.message_offsets([0, 30])[:6], offsets[:6])
+
+    def test_save_load(self):
+        write_tlog(self.path)
+        idx = mp_tlogindex.build(self.path)
+        self.assertEqual(mp_tlogindex.load(self.path), None)
+        idx.save(mp_tlogindex.index_name(self.path))
+        loaded = mp_tlogindex.load(self.path)
+        self.assertEqual(loaded.records, idx.records)
+        self.assertEqual(loaded.offsets, idx.offsets)
+        self.assertEqual(loaded.time_offsets, idx.time_offsets)
+        self.assertEqual(loaded.start_time, idx.start_time)
+
+    def test_stale(self):
+        write_tlog(self.path)
+        mp_tlogindex.build(self.path).save(mp_tlogindex.index_name(self.path))
+        f = open(self.path, 'ab')
+        f.write('more')
+        f.close()
+        self.assertEqual(mp_tlogindex.load(self.path), None)
+
+    def test_corrupt(self):
+        write_tlog(self.path)
+        mp_tlogindex.build(self.path).save(mp_tlogindex.index_name(self.path))
+        f = open(mp_tlogindex.index_name(self.path), 'r+b')
+        f.truncate(20)
+        f.close()
+        self.assertEqual(mp_tlogindex.load(self.path), None)
+
+    def test_empty(self):
+        open(self.path, 'wb').close()
+        self.assertEqual(mp_tlogindex.build(self.path).records, 0)
+
+    def test_gzip_refused(self):
+        # offsets in a compressed log can't be seeked to
+        write_tlog(self.path)
+        data = open(self.path, 'rb').read()
+        f = gzip.open(self.path + '.gz', 'wb')
+        f.write(data)
+        f.close()
+        self.assertTrue(mp_tlogindex.is_compressed(self.path + '.gz'))
+        self.assertFalse(mp_tlogindex.is_compressed(self.path))
+        self.assertRaises(ValueError, mp_tlogindex.build, self.path + '.gz')
+
+    def test_read_messages(self):
+        write_tlog(self.path)
+        idx = mp_tlogindex.build(self.path)
+        mlog = mavutil.mavlogfile(self.path)
+        msgs = list(mp_tlogindex.read_messages(mlog, idx.type_offsets(mavutil.mavlink, ['ATTITUDE'])))
+        self.assertEqual([m.get_type() for m in msgs], ['ATTITUDE'] * 10)
+        self.assertAlmostEqual(msgs[0]._timestamp, START + 0.5)
+        mlog.close()
+
+if __name__ == '__main__':
+    unittest.main()
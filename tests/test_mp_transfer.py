@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+'''
+tests for pipelined point transfers
+'''
+
+import unittest
+
+from MAVProxy.modules.lib import mp_transfer, mp_worker, mp_scheduler
+
+class PointTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = mp_worker.WorkerPool(0)
+        self.future = mp_worker.Future(self.pool)
+        self.scheduler = mp_scheduler.Scheduler()
+        self.fetched = []
+        self.sent = []
+
+    def transfer(self, count, **kwargs):
+        return mp_transfer.PointTransfer('test', count, self.fetched.append, self.future,
+                                         self.scheduler, **kwargs)
+
+    def expire(self, t):
+        '''time out every request in flight'''
+        for p in t.pending.values():
+            p[0] = 0
+        t.check_timeouts()
+
+    def test_download(self):
+        t = self.transfer(6, window=4)
+        t.start()
+        self.assertEqual(self.fetched, [0, 1, 2, 3])
+        # replies out of order, each one lets another request out
+        t.handle(2, 'p2')
+        self.assertEqual(self.fetched, [0, 1, 2, 3, 4])
+        for idx in [0, 1, 3, 4, 5]:
+            t.handle(idx, 'p%u' % idx)
+        self.assertEqual(self.future.result(0), ['p0', 'p1', 'p2', 'p3', 'p4', 'p5'])
+        self.assertEqual(t.retransmits, 0)
+        self.assertEqual(t.timer, None)
+
+    def test_empty(self):
+        t = self.transfer(0)
+        t.start()
+        self.assertEqual(self.future.result(0), [])
+        self.assertEqual(self.fetched, [])
+
+    def test_indexes(self):
+        t = self.transfer(0, indexes=[5, 2])
+        t.start()
+        self.assertEqual(self.fetched, [5, 2])
+        t.handle(2, 'two')
+        t.handle(5, 'five')
+        self.assertEqual(self.future.result(0), ['five', 'two'])
+
+    def test_duplicate_reply(self):
+        t = self.transfer(2)
+        t.start()
+        t.handle(0, 'p0')
+        t.handle(0, 'again')
+        self.assertEqual(t.completed, 1)
+        t.handle(1, 'p1')
+        self.assertEqual(self.future.result(0), ['p0', 'p1'])
+
+    def test_retry(self):
+        t = self.transfer(2, window=1)
+        t.start()
+        self.assertEqual(self.fetched, [0])
+        self.expire(t)
+        self.assertEqual(self.fetched, [0, 0])
+        self.assertEqual(t.retransmits, 1)
+        t.handle(0, 'p0')
+        t.handle(1, 'p1')
+        self.assertEqual(self.future.result(0), ['p0', 'p1'])
+
+    def test_rtt(self):
+        t = self.transfer(2, window=1)
+        t.start()
+        rto = t.rtt.rto
+        self.expire(t)
+        self.assertEqual(t.rtt.rto, min(rto * 2, t.rtt.max_rto))
+        t.handle(0, 'p0')
+        # a reply to a re-sent request is ambiguous, so isn't timed
+        self.assertEqual(t.rtt.samples, 0)
+        t.handle(1, 'p1')
+        self.assertEqual(t.rtt.samples, 1)
+
+    def test_fail(self):
+        t = self.transfer(3, retries=3)
+        t.start()
+        for i in range(3):
+            self.expire(t)
+        self.assertTrue(self.future.done())
+        self.assertTrue(isinstance(self.future.exception(), mp_transfer.TransferError))
+        self.assertTrue('timed out after 3 tries' in str(self.future.exception()))
+        self.assertEqual(t.pending, {})
+        self.assertEqual(t.timer, None)
+
+    def test_upload_mismatch(self):
+        points = ['a', 'b']
+        t = self.transfer(2, points=points, send=self.sent.append,
+                          match=lambda sent, received: sent == received, retries=2)
+        t.start()
+        self.assertEqual(self.sent, ['a', 'b'])
+        t.handle(0, 'x')
+        # a mismatched point is sent again
+        self.assertEqual(self.sent, ['a', 'b', 'a'])
+        self.assertEqual(self.fetched, [0, 1, 0])
+        t.handle(0, 'a')
+        t.handle(1, 'b')
+        self.assertEqual(self.future.result(0), ['a', 'b'])
+
+    def test_upload_mismatch_fails(self):
+        t = self.transfer(1, points=['a'], send=self.sent.append,
+                          match=lambda sent, received: sent == received, retries=2)
+        t.start()
+        t.handle(0, 'x')
+        t.handle(0, 'x')
+        self.assertTrue('mismatched after 2 tries' in str(self.future.exception()))
+
+    def test_cancel(self):
+        t = self.transfer(2)
+        t.start()
+        t.cancel()
+        self.assertTrue(self.future.cancelled())
+        t.handle(0, 'p0')
+        self.assertEqual(t.completed, 0)
+
+
+class RttEstimatorTest(unittest.TestCase):
+    def test_sample(self):
+        rtt = mp_transfer.RttEstimator(initial=1.0, min_rto=0.2, max_rto=5.0)
+        rtt.sample(0.1)
+        self.assertAlmostEqual(rtt.srtt, 0.1)
+        self.assertAlmostEqual(rtt.rto, 0.3)
+        for i in range(50):
+            rtt.sample(0.1)
+        # a steady round trip time converges on the minimum timeout
+        self.assertAlmostEqual(rtt.srtt, 0.1)
+        self.assertAlmostEqual(rtt.rto, 0.2, places=3)
+
+    def test_backoff(self):
+        rtt = mp_transfer.RttEstimator(initial=1.0, max_rto=5.0)
+        rtt.backoff()
+        self.assertEqual(rtt.rto, 2.0)
+        for i in range(5):
+            rtt.backoff()
+        self.assertEqual(rtt.rto, 5.0)
+
+
+class UploadTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = mp_worker.WorkerPool(0)
+        self.future = mp_worker.Future(self.pool)
+        self.scheduler = mp_scheduler.Scheduler()
+        self.starts = 0
+        self.sent = []
+
+    def start_fn(self):
+        self.starts += 1
+
+    def upload(self, count, **kwargs):
+        t = mp_transfer.UploadTransfer('test', 1, count, self.start_fn, self.sent.append,
+                                       self.future, self.scheduler, **kwargs)
+        t.start()
+        return t
+
+    def test_ack(self):
+        t = self.upload(3)
+        self.assertEqual(self.starts, 1)
+        for idx in [1, 2, 3]:
+            self.assertTrue(t.handle_request(idx))
+        t.handle_ack(True)
+        self.assertEqual(self.future.result(0), True)
+        self.assertEqual(self.sent, [1, 2, 3])
+        self.assertEqual(t.timer, None)
+        self.assertFalse(t.handle_request(1))
+
+    def test_rejected(self):
+        t = self.upload(1)
+        t.handle_request(1)
+        t.handle_ack(False, 'no space')
+        self.assertTrue('rejected: no space' in str(self.future.exception()))
+
+    def test_out_of_range(self):
+        t = self.upload(2)
+        self.assertFalse(t.handle_request(0))
+        self.assertFalse(t.handle_request(3))
+        self.assertEqual(self.sent, [])
+
+    def test_rerequest(self):
+        t = self.upload(2)
+        t.handle_request(1)
+        t.handle_request(1)
+        self.assertEqual(self.sent, [1, 1])
+        self.assertEqual(t.retransmits, 1)
+
+    def test_restart(self):
+        t = self.upload(2, retries=2)
+        for i in range(2):
+            t.last_activity -= t.rtt.rto
+            t.check_timeout()
+        self.assertEqual(self.starts, 3)
+        self.assertFalse(self.future.done())
+        t.last_activity -= t.rtt.rto
+        t.check_timeout()
+        self.assertTrue('stalled after 0/2 items' in str(self.future.exception()))
+
+    def test_stall(self):
+        t = self.upload(3, stall_timeout=10)
+        t.handle_request(1)
+        t.last_activity -= 5
+        t.check_timeout()
+        self.assertFalse(self.future.done())
+        t.last_activity -= 6
+        t.check_timeout()
+        self.assertTrue('stalled after 1/3 items' in str(self.future.exception()))
+        self.assertEqual(t.timer, None)
+
+    def test_lost_ack(self):
+        t = self.upload(2, stall_timeout=10)
+        t.handle_request(1)
+        t.handle_request(2)
+        t.last_activity -= 11
+        t.check_timeout()
+        self.assertEqual(self.future.result(0), False)
+
+if __name__ == '__main__':
+    unittest.main()
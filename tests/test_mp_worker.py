@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+'''
+tests for the background worker pool
+'''
+
+import sys, threading, time, unittest
+from StringIO import StringIO
+
+from MAVProxy.modules.lib import mp_worker
+
+def settle(pool):
+    '''wait for the jobs of a pool to finish, including queueing their
+    callbacks, which happens after result() returns'''
+    deadline = time.time() + 5
+    while pool.pending and time.time() < deadline:
+        time.sleep(0.001)
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = mp_worker.WorkerPool(2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_submit(self):
+        future = self.pool.submit(lambda a, b=0: a + b, 1, b=2)
+        self.assertEqual(future.result(5), 3)
+        self.assertTrue(future.done())
+        self.assertEqual(future.exception(), None)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('bad value')
+        future = self.pool.submit(fail)
+        self.assertRaises(ValueError, future.result, 5)
+        self.assertTrue(isinstance(future.exception(), ValueError))
+        settle(self.pool)
+        self.assertEqual((self.pool.completed, self.pool.failed), (1, 1))
+
+    def test_timeout(self):
+        event = threading.Event()
+        future = self.pool.submit(event.wait, 5)
+        self.assertRaises(mp_worker.TimeoutError, future.result, 0.01)
+        event.set()
+        future.result(5)
+
+    def test_callbacks_on_main(self):
+        calls = []
+        future = self.pool.submit(lambda: 42)
+        future.add_done_callback(lambda f: calls.append(f.result()))
+        settle(self.pool)
+        # callbacks only run from the main loop
+        self.assertEqual(calls, [])
+        self.pool.run_completions()
+        self.assertEqual(calls, [42])
+        # a callback added after completion is still queued for the main loop
+        future.add_done_callback(lambda f: calls.append('late'))
+        self.assertEqual(calls, [42])
+        self.pool.run_completions()
+        self.assertEqual(calls, [42, 'late'])
+
+    def test_call_soon_order(self):
+        calls = []
+        for i in range(5):
+            self.pool.call_soon(calls.append, i)
+        self.pool.run_completions()
+        self.assertEqual(calls, range(5))
+        self.assertEqual(self.pool.callbacks, 5)
+
+    def test_call_soon_next_pass(self):
+        calls = []
+        def again(n):
+            calls.append(n)
+            self.pool.call_soon(again, n+1)
+        self.pool.call_soon(again, 0)
+        self.pool.run_completions()
+        self.assertEqual(calls, [0])
+        self.pool.run_completions()
+        self.assertEqual(calls, [0, 1])
+        self.assertEqual(len(self.pool.completions), 1)
+
+    def test_cancel_queued(self):
+        pool = mp_worker.WorkerPool(1)
+        event = threading.Event()
+        calls = []
+        first = pool.submit(event.wait, 5)
+        second = pool.submit(calls.append, 'ran')
+        self.assertTrue(second.cancel())
+        event.set()
+        first.result(5)
+        pool.submit(lambda: None).result(5)
+        self.assertEqual(calls, [])
+        self.assertRaises(mp_worker.CancelledError, second.result, 0)
+        pool.close()
+
+    def test_cancel_running(self):
+        # a job already running completes, but its result is dropped
+        started = threading.Event()
+        release = threading.Event()
+        def job():
+            started.set()
+            release.wait(5)
+            return 'done'
+        future = self.pool.submit(job)
+        started.wait(5)
+        self.assertTrue(future.cancel())
+        self.assertFalse(future.cancel())
+        release.set()
+        self.assertRaises(mp_worker.CancelledError, future.result, 5)
+        self.assertTrue(future.cancelled())
+
+    def test_set_once(self):
+        future = mp_worker.Future(self.pool)
+        future.set_result(1)
+        future.set_result(2)
+        future.set_exception((ValueError, ValueError('late'), None))
+        self.assertEqual(future.result(0), 1)
+
+    def test_run_on_main(self):
+        result = []
+        def worker():
+            return self.pool.run_on_main(lambda x: x * 2, 21).result(5)
+        th = threading.Thread(target=lambda: result.append(worker()))
+        th.start()
+        while th.is_alive():
+            self.pool.run_completions()
+            time.sleep(0.001)
+        self.assertEqual(result, [42])
+
+    def test_run_on_main_follows_future(self):
+        inner = mp_worker.Future(self.pool)
+        outer = self.pool.run_on_main(lambda: inner)
+        self.pool.run_completions()
+        self.assertFalse(outer.done())
+        inner.set_result('inner')
+        self.pool.run_completions()
+        self.assertEqual(outer.result(0), 'inner')
+
+    def test_on_error(self):
+        errors = []
+        pool = mp_worker.WorkerPool(0, on_error=lambda fn, e: errors.append(str(e)))
+        def fail():
+            raise RuntimeError('callback failed')
+        pool.call_soon(fail)
+        pool.call_soon(errors.append, 'next')
+        pool.run_completions()
+        self.assertEqual(errors, ['callback failed', 'next'])
+
+    def test_wakeup(self):
+        wakeups = []
+        pool = mp_worker.WorkerPool(1, wakeup=lambda: wakeups.append(1))
+        event = threading.Event()
+        future = pool.submit(event.wait, 5)
+        future.add_done_callback(lambda f: None)
+        event.set()
+        settle(pool)
+        # the callback is queued from the worker thread, waking the main loop
+        self.assertEqual(len(wakeups), 1)
+        # no wakeup is needed from the main loop itself
+        pool.call_soon(lambda: None)
+        self.assertEqual(len(wakeups), 1)
+        pool.close()
+
+    def test_close(self):
+        pool = mp_worker.WorkerPool(2)
+        for i in range(4):
+            pool.submit(time.sleep, 0.01)
+        threads = list(pool.threads)
+        pool.close()
+        for t in threads:
+            t.join(5)
+            self.assertFalse(t.is_alive())
+
+    def test_show(self):
+        event = threading.Event()
+        future = self.pool.submit(event.wait, 5)
+        f = StringIO()
+        self.pool.show(f)
+        self.assertTrue('pending: wait' in f.getvalue())
+        event.set()
+        future.result(5)
+
+
+class ThenTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = mp_worker.WorkerPool(0)
+        self.future = mp_worker.Future(self.pool)
+
+    def test_then(self):
+        chained = self.future.then(lambda x: x + 1).then(lambda x: x * 2)
+        self.future.set_result(1)
+        # each step of the chain runs on its own pass of the main loop
+        self.pool.run_completions()
+        self.assertFalse(chained.done())
+        self.pool.run_completions()
+        self.assertEqual(chained.result(0), 4)
+
+    def test_then_follows_future(self):
+        inner = mp_worker.Future(self.pool)
+        chained = self.future.then(lambda x: inner)
+        self.future.set_result(1)
+        self.pool.run_completions()
+        self.assertFalse(chained.done())
+        inner.set_result('inner')
+        self.pool.run_completions()
+        self.assertEqual(chained.result(0), 'inner')
+
+    def test_exception_passes_through(self):
+        calls = []
+        chained = self.future.then(calls.append)
+        self.future.set_exception(ValueError('bad'))
+        self.pool.run_completions()
+        self.assertEqual(calls, [])
+        self.assertRaises(ValueError, chained.result, 0)
+
+    def test_exception_in_callback(self):
+        def fail(x):
+            raise KeyError(x)
+        chained = self.future.then(fail)
+        self.future.set_result('key')
+        self.pool.run_completions()
+        self.assertTrue(isinstance(chained.exception(), KeyError))
+
+    def test_cancel_passes_through(self):
+        chained = self.future.then(lambda x: x)
+        self.future.cancel()
+        self.pool.run_completions()
+        self.assertTrue(chained.cancelled())
+
+    def test_follow(self):
+        src = mp_worker.Future(self.pool)
+        src.set_exception(RuntimeError('failed'))
+        self.future.follow(src)
+        self.assertRaises(RuntimeError, self.future.result, 0)
+
+if __name__ == '__main__':
+    unittest.main()